@@ -0,0 +1,226 @@
+"""
+Benchmarks for sno, using deterministic synthetic data.
+
+Run from this directory (so that benchmarks/pytest.ini is used):
+
+    $ pytest --synthetic-rows=100000 --benchmark-json=results.json
+
+Every benchmark records peak RSS (and features/s, if it processes features) in its extra_info, and the parameters
+of the synthetic data are recorded alongside the machine info, so results saved with --benchmark-json or
+--benchmark-autosave can be compared across runs - see `pytest-benchmark compare`.
+"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+from synthetic import SyntheticSpec, create_repo, write_gpkg
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("synthetic", "synthetic benchmark data")
+    group.addoption(
+        "--synthetic-rows",
+        type=int,
+        default=10000,
+        help="Number of features in the synthetic dataset",
+    )
+    group.addoption(
+        "--synthetic-columns",
+        type=int,
+        default=10,
+        help="Number of attribute columns in the synthetic dataset",
+    )
+    group.addoption(
+        "--synthetic-vertices",
+        type=int,
+        default=20,
+        help="Vertices per polygon geometry. 1 for point geometries, 0 for no geometry",
+    )
+    group.addoption(
+        "--synthetic-commits",
+        type=int,
+        default=10,
+        help="Number of commits to make after importing the synthetic dataset",
+    )
+    group.addoption(
+        "--synthetic-edit-ratio",
+        type=float,
+        default=0.01,
+        help="Proportion of features updated by each commit or working copy edit",
+    )
+    group.addoption(
+        "--synthetic-seed", type=int, default=0, help="Seed for all synthetic data"
+    )
+    group.addoption(
+        "--synthetic-repo-version",
+        type=int,
+        default=2,
+        help="Repository version of the synthetic repository",
+    )
+    group.addoption(
+        "--bench-rounds",
+        type=int,
+        default=3,
+        help="How many times to run each benchmark",
+    )
+
+
+def _synthetic_spec(config):
+    return SyntheticSpec(
+        rows=config.getoption("synthetic_rows"),
+        columns=config.getoption("synthetic_columns"),
+        vertices=config.getoption("synthetic_vertices"),
+        commits=config.getoption("synthetic_commits"),
+        edit_ratio=config.getoption("synthetic_edit_ratio"),
+        seed=config.getoption("synthetic_seed"),
+        repo_version=config.getoption("synthetic_repo_version"),
+    )
+
+
+def pytest_benchmark_update_machine_info(config, machine_info):
+    import sno
+
+    machine_info["sno_version"] = sno.__version__
+    machine_info["synthetic"] = _synthetic_spec(config)._asdict()
+
+
+@pytest.fixture(scope="session")
+def synthetic_spec(request):
+    return _synthetic_spec(request.config)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def git_user_env(tmp_path_factory):
+    """Commits are made using the git environment variables, not any user's config."""
+    home = tmp_path_factory.mktemp("home")
+    env = {
+        "HOME": str(home),
+        "GIT_CONFIG_NOSYSTEM": "1",
+        "GIT_AUTHOR_NAME": "Sno Benchmarker",
+        "GIT_AUTHOR_EMAIL": "sno-benchmarker@example.com",
+        "GIT_COMMITTER_NAME": "Sno Benchmarker",
+        "GIT_COMMITTER_EMAIL": "sno-benchmarker@example.com",
+    }
+    orig_env = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    yield
+    for k, v in orig_env.items():
+        if v is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = v
+
+
+@pytest.fixture(scope="session")
+def synthetic_gpkg(tmp_path_factory, synthetic_spec):
+    """A GeoPackage containing the synthetic dataset."""
+    path = tmp_path_factory.mktemp("synthetic") / "synthetic.gpkg"
+    write_gpkg(path, synthetic_spec)
+    return path
+
+
+@pytest.fixture(scope="session")
+def synthetic_repo(tmp_path_factory, synthetic_spec, synthetic_gpkg):
+    """
+    Path to a repository containing the synthetic dataset and its history.
+    Don't modify it - benchmarks that modify a repository should use copy_repo.
+    """
+    path = tmp_path_factory.mktemp("synthetic") / "synthetic.sno"
+    create_repo(path, synthetic_gpkg, synthetic_spec)
+    return path
+
+
+@pytest.fixture
+def copy_repo(synthetic_repo, tmp_path):
+    """Returns a function which makes a new copy of the synthetic repository, and returns the copy's path."""
+    copies = []
+
+    def _copy_repo():
+        path = tmp_path / f"copy{len(copies)}.sno"
+        shutil.copytree(synthetic_repo, path)
+        copies.append(path)
+        return path
+
+    return _copy_repo
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak RSS of this process, if possible - only on Linux.
+    Returns True if it was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    """Returns the peak RSS of this process, in bytes - or None if it isn't known."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+@pytest.fixture
+def measure(benchmark, request):
+    """
+    Benchmarks a function using benchmark.pedantic, and records its throughput and memory use.
+    _measure(func, features=N, setup=None) - where features is the number of features func processes,
+    or a function that returns that number, given the result of func - or None if func doesn't process features. If given, setup is called before
+    each round and returns the (args, kwargs) for func - the time spent in setup isn't measured.
+    Returns the result of func.
+    """
+    rounds = request.config.getoption("bench_rounds")
+
+    def _measure(func, *, features=None, setup=None):
+        peak_rss = None
+        peak_rss_per_round = True
+
+        def _target(*args, **kwargs):
+            nonlocal peak_rss, peak_rss_per_round
+            peak_rss_per_round = _reset_peak_rss() and peak_rss_per_round
+            result = func(*args, **kwargs)
+            round_peak_rss = _peak_rss()
+            if round_peak_rss is not None:
+                peak_rss = max(peak_rss or 0, round_peak_rss)
+            return result
+
+        result = benchmark.pedantic(
+            _target, setup=setup, rounds=rounds, iterations=1, warmup_rounds=0
+        )
+
+        if callable(features):
+            features = features(result)
+        if features is not None:
+            benchmark.extra_info["features"] = features
+            if not benchmark.disabled:
+                benchmark.extra_info["features_per_second"] = (
+                    features / benchmark.stats.stats.median
+                )
+        benchmark.extra_info["peak_rss_bytes"] = peak_rss
+        # Otherwise, peak RSS is the peak of the whole process so far.
+        benchmark.extra_info["peak_rss_per_round"] = peak_rss_per_round
+        return result
+
+    return _measure
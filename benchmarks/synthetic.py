@@ -0,0 +1,176 @@
+"""
+Deterministic synthetic data for benchmarking sno.
+
+The same SyntheticSpec always generates exactly the same features and the same history,
+so results from different runs (and different versions of sno) are comparable.
+"""
+
+import math
+import random
+from collections import namedtuple
+
+import pygit2
+from osgeo import ogr, osr
+
+from sno.diff_structs import Delta, DeltaDiff, RepoDiff
+from sno.fast_import import fast_import_tables
+from sno.ogr_import_source import OgrImportSource
+from sno.repository_version import write_repo_version_config
+from sno.structure import RepositoryStructure
+from sno.working_copy import WorkingCopy
+
+
+TABLE_NAME = "synthetic"
+PK_NAME = "fid"
+GEOM_NAME = "geom"
+
+# Attribute columns cycle through these types.
+FIELD_TYPES = (ogr.OFTInteger, ogr.OFTReal, ogr.OFTString)
+
+SyntheticSpec = namedtuple(
+    "SyntheticSpec",
+    ("rows", "columns", "vertices", "commits", "edit_ratio", "seed", "repo_version"),
+)
+SyntheticSpec.__doc__ = """
+The scale of a synthetic dataset and its history.
+rows - the number of features.
+columns - the number of attribute columns (as well as the primary key and geometry).
+vertices - the number of vertices in each polygon geometry. 1 means point geometries, 0 means no geometry.
+commits - the number of commits made after the initial import.
+edit_ratio - the proportion of features updated by each commit, and by working copy edits.
+seed - seeds all random values.
+repo_version - the sno repository version to create.
+"""
+
+
+def field_names(spec):
+    return [f"field{i}" for i in range(spec.columns)]
+
+
+def edit_count(spec):
+    """The number of features updated by each synthetic edit."""
+    return max(1, int(spec.rows * spec.edit_ratio))
+
+
+def _random_value(rng, field_type):
+    if field_type == ogr.OFTInteger:
+        return rng.randrange(-(2 ** 31), 2 ** 31)
+    elif field_type == ogr.OFTReal:
+        return rng.uniform(-1e6, 1e6)
+    else:
+        return f"value-{rng.getrandbits(64):016x}"
+
+
+def _random_geometry(rng, vertices):
+    x = rng.uniform(-170, 170)
+    y = rng.uniform(-80, 80)
+    if vertices == 1:
+        geom = ogr.Geometry(ogr.wkbPoint)
+        geom.AddPoint_2D(x, y)
+        return geom
+
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    radius = rng.uniform(0.001, 0.1)
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        ring.AddPoint_2D(x + radius * math.cos(angle), y + radius * math.sin(angle))
+    ring.CloseRings()
+    geom = ogr.Geometry(ogr.wkbPolygon)
+    geom.AddGeometry(ring)
+    return geom
+
+
+def write_gpkg(path, spec):
+    """Writes a GeoPackage at path containing a single table of synthetic features."""
+    rng = random.Random(spec.seed)
+
+    ogr_ds = ogr.GetDriverByName("GPKG").CreateDataSource(str(path))
+    if spec.vertices:
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        geom_type = ogr.wkbPoint if spec.vertices == 1 else ogr.wkbPolygon
+        layer = ogr_ds.CreateLayer(
+            TABLE_NAME,
+            srs,
+            geom_type,
+            [f"FID={PK_NAME}", f"GEOMETRY_NAME={GEOM_NAME}", "SPATIAL_INDEX=NO"],
+        )
+    else:
+        layer = ogr_ds.CreateLayer(TABLE_NAME, None, ogr.wkbNone, [f"FID={PK_NAME}"])
+
+    field_types = [FIELD_TYPES[i % len(FIELD_TYPES)] for i in range(spec.columns)]
+    for name, field_type in zip(field_names(spec), field_types):
+        layer.CreateField(ogr.FieldDefn(name, field_type))
+
+    layer_defn = layer.GetLayerDefn()
+    layer.StartTransaction()
+    for fid in range(1, spec.rows + 1):
+        feature = ogr.Feature(layer_defn)
+        feature.SetFID(fid)
+        for i, field_type in enumerate(field_types):
+            feature.SetField(i, _random_value(rng, field_type))
+        if spec.vertices:
+            feature.SetGeometryDirectly(_random_geometry(rng, spec.vertices))
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+    del ogr_ds
+
+
+def open_import_source(gpkg_path):
+    return OgrImportSource.open(gpkg_path, table=TABLE_NAME)
+
+
+def init_repo(repo_path, spec):
+    """Creates a new, empty sno repository (without a working copy) at repo_path."""
+    repo = pygit2.init_repository(str(repo_path), bare=True)
+    write_repo_version_config(repo, spec.repo_version)
+    WorkingCopy.write_config(repo, bare=True)
+    repo.config["user.name"] = "Sno Benchmarker"
+    repo.config["user.email"] = "sno-benchmarker@example.com"
+    return repo
+
+
+def edited_features(dataset, spec, seed, pks=None):
+    """
+    Yields (old_feature, new_feature) for edit_count(spec) features of the dataset, chosen from pks
+    (or from all features). One attribute of each feature is changed. The same seed always edits the
+    same features in the same way.
+    """
+    rng = random.Random(seed)
+    if pks is None:
+        pks = range(1, spec.rows + 1)
+    pks = sorted(rng.sample(pks, min(edit_count(spec), len(pks))))
+    names = field_names(spec)
+    field_types = [FIELD_TYPES[i % len(FIELD_TYPES)] for i in range(spec.columns)]
+    for pk in pks:
+        old_feature = dataset.get_feature(pk)
+        i = rng.randrange(len(names))
+        new_feature = {**old_feature, names[i]: _random_value(rng, field_types[i])}
+        yield old_feature, new_feature
+
+
+def commit_edits(repo, spec, seed, message, pks=None):
+    """Commits an update to edit_count(spec) features of the synthetic dataset. Returns the new commit ID."""
+    rs = RepositoryStructure(repo)
+    dataset = rs[TABLE_NAME]
+    feature_diff = DeltaDiff(
+        Delta.update((str(old[PK_NAME]), old), (str(new[PK_NAME]), new))
+        for old, new in edited_features(dataset, spec, seed, pks)
+    )
+    repo_diff = RepoDiff()
+    repo_diff.recursive_set([dataset.path, "feature"], feature_diff)
+    return rs.commit(repo_diff, message)
+
+
+def create_repo(repo_path, gpkg_path, spec):
+    """
+    Creates a repository containing the synthetic dataset, imported from the GeoPackage at gpkg_path,
+    followed by spec.commits commits which each update some features.
+    """
+    repo = init_repo(repo_path, spec)
+    fast_import_tables(
+        repo, [open_import_source(gpkg_path)], quiet=True, message="Import"
+    )
+    for i in range(spec.commits):
+        commit_edits(repo, spec, seed=f"{spec.seed}:edit:{i}", message=f"Edit {i + 1}")
+    return repo
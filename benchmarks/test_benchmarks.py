@@ -0,0 +1,223 @@
+import shutil
+import subprocess
+import sys
+
+import pygit2
+import pytest
+
+from sno import gpkg
+from sno.fast_import import fast_import_tables
+from sno.merge import do_merge
+from sno.spatial_index import get_spatial_index
+from sno.structure import RepositoryStructure
+from sno.working_copy import WorkingCopy
+
+from synthetic import (
+    PK_NAME,
+    TABLE_NAME,
+    commit_edits,
+    edit_count,
+    edited_features,
+    init_repo,
+    open_import_source,
+)
+
+
+def _round_paths(tmp_path, name):
+    """Yields a new path for each benchmark round."""
+    i = 0
+    while True:
+        yield tmp_path / f"{name}{i}.sno"
+        i += 1
+
+
+def _dataset_at(repo, refish):
+    return RepositoryStructure.lookup(repo, refish)[TABLE_NAME]
+
+
+def _first_commit(repo):
+    """The commit that imported the synthetic dataset."""
+    return list(repo.walk(repo.head.target))[-1]
+
+
+def _create_working_copy(repo):
+    WorkingCopy.write_config(repo)
+    wc = WorkingCopy.get(repo, create_if_missing=True)
+    wc.create()
+    return wc
+
+
+def _read_values(ds_diff):
+    """Reads every feature in the diff, since some diffs only read features when they are needed."""
+    for delta in ds_diff["feature"].values():
+        delta.old_value, delta.new_value
+    return ds_diff
+
+
+def test_fast_import_tables(measure, synthetic_spec, synthetic_gpkg, tmp_path):
+    paths = _round_paths(tmp_path, "import")
+
+    def setup():
+        repo = init_repo(next(paths), synthetic_spec)
+        return (repo, [open_import_source(synthetic_gpkg)]), {"quiet": True}
+
+    measure(fast_import_tables, features=synthetic_spec.rows, setup=setup)
+
+
+def test_write_full(measure, synthetic_spec, copy_repo):
+    def setup():
+        repo = pygit2.Repository(str(copy_repo()))
+        wc = _create_working_copy(repo)
+        commit = repo.head.peel(pygit2.Commit)
+        return (wc, commit, _dataset_at(repo, "HEAD")), {}
+
+    def write_full(wc, commit, dataset):
+        # Like checkout.reset_wc_if_needed, when creating a new working copy.
+        wc.write_full(commit, dataset, safe=False)
+
+    measure(write_full, features=synthetic_spec.rows, setup=setup)
+
+
+@pytest.fixture
+def edited_working_copy(synthetic_spec, copy_repo):
+    """A working copy in which edit_count(spec) features have been updated."""
+    repo = pygit2.Repository(str(copy_repo()))
+    wc = _create_working_copy(repo)
+    dataset = _dataset_at(repo, "HEAD")
+    wc.write_full(repo.head.peel(pygit2.Commit), dataset, safe=False)
+
+    table = gpkg.ident(dataset.table_name)
+    with wc.session() as db:
+        dbcur = db.cursor()
+        for old, new in edited_features(
+            dataset, synthetic_spec, seed=f"{synthetic_spec.seed}:working-copy"
+        ):
+            for name, value in new.items():
+                if value != old[name]:
+                    sql = f"UPDATE {table} SET {gpkg.ident(name)}=? WHERE {gpkg.ident(PK_NAME)}=?;"
+                    dbcur.execute(sql, (value, new[PK_NAME]))
+    return wc, dataset
+
+
+def test_diff_db_to_tree(measure, synthetic_spec, edited_working_copy):
+    wc, dataset = edited_working_copy
+
+    def diff_db_to_tree():
+        return _read_values(wc.diff_db_to_tree(dataset))
+
+    ds_diff = measure(diff_db_to_tree, features=edit_count(synthetic_spec))
+    assert len(ds_diff["feature"]) == edit_count(synthetic_spec)
+
+
+def test_feature_change_counts(measure, synthetic_spec, edited_working_copy):
+    wc, dataset = edited_working_copy
+
+    def feature_change_counts():
+        return wc.feature_change_counts(dataset)
+
+    counts = measure(feature_change_counts, features=edit_count(synthetic_spec))
+    assert counts == {"updates": edit_count(synthetic_spec)}
+
+
+def test_dataset_diff(measure, synthetic_repo):
+    repo = pygit2.Repository(str(synthetic_repo))
+    old_dataset = _dataset_at(repo, str(_first_commit(repo).id))
+    new_dataset = _dataset_at(repo, "HEAD")
+
+    def diff():
+        return _read_values(old_dataset.diff(new_dataset))
+
+    measure(diff, features=lambda ds_diff: len(ds_diff["feature"]))
+
+
+def test_write_to_new_tree(measure, copy_repo):
+    repo = pygit2.Repository(str(copy_repo()))
+    orig_tree = _first_commit(repo).tree
+    old_dataset = _dataset_at(repo, str(_first_commit(repo).id))
+    ds_diff = _read_values(old_dataset.diff(_dataset_at(repo, "HEAD")))
+    ds_diff.prune()
+
+    def write_to_new_tree():
+        return old_dataset.write_to_new_tree(ds_diff, repo, orig_tree=orig_tree)
+
+    new_tree_id = measure(write_to_new_tree, features=len(ds_diff["feature"]))
+    assert new_tree_id == repo.head.peel(pygit2.Tree).id
+
+
+@pytest.fixture
+def branched_repo(synthetic_spec, copy_repo):
+    """
+    A repository where the current branch and the "theirs" branch have each updated different features
+    since they diverged, so they can be merged without conflicts.
+    """
+    repo = pygit2.Repository(str(copy_repo()))
+    head_commit = repo.head.peel(pygit2.Commit)
+    branch = repo.head.name
+    all_pks = range(1, synthetic_spec.rows + 1)
+
+    repo.branches.local.create("theirs", head_commit)
+    repo.set_head("refs/heads/theirs")
+    commit_edits(
+        repo,
+        synthetic_spec,
+        seed=f"{synthetic_spec.seed}:theirs",
+        message="Their edit",
+        pks=all_pks[1::2],
+    )
+    repo.set_head(branch)
+    commit_edits(
+        repo,
+        synthetic_spec,
+        seed=f"{synthetic_spec.seed}:ours",
+        message="Our edit",
+        pks=all_pks[0::2],
+    )
+    return repo.path
+
+
+def test_do_merge(measure, synthetic_spec, branched_repo, tmp_path):
+    paths = _round_paths(tmp_path, "merge")
+
+    def setup():
+        path = next(paths)
+        shutil.copytree(branched_repo, path)
+        return (pygit2.Repository(str(path)),), {}
+
+    def merge(repo):
+        return do_merge(
+            repo,
+            ff=True,
+            ff_only=False,
+            dry_run=False,
+            commit="theirs",
+            commit_message="Merge",
+            quiet=True,
+        )
+
+    merge_jdict = measure(merge, features=2 * edit_count(synthetic_spec), setup=setup)
+    assert not merge_jdict["conflicts"]
+
+
+def test_spatial_index(measure, synthetic_spec, copy_repo):
+    if not synthetic_spec.vertices:
+        pytest.skip("Synthetic dataset has no geometry")
+
+    def setup():
+        repo = pygit2.Repository(str(copy_repo()))
+        return (repo, _dataset_at(repo, "HEAD")), {}
+
+    measure(get_spatial_index, features=synthetic_spec.rows, setup=setup)
+
+
+@pytest.mark.parametrize("args", [["--help"], ["log", "-n", "1"], ["status"]])
+def test_cli_startup(measure, synthetic_repo, args):
+    """
+    Runs a quick command in a new process, the way scripts call sno over and over -
+    the time taken is mostly spent starting up and importing modules.
+    """
+    cmd = [sys.executable, "-m", "sno.cli", "-C", str(synthetic_repo)] + args
+
+    def run():
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+
+    measure(run)
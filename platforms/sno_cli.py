@@ -1,4 +1,8 @@
+import multiprocessing
+
 import sno.cli
 
 if __name__ == "__main__":
+    # Needed for worker processes (eg `sno import --jobs`) in a frozen executable.
+    multiprocessing.freeze_support()
     sno.cli.cli()
@@ -7,6 +7,7 @@ __all__ = (
     "prefix",
 )
 
+import importlib.abc
 import os
 import platform
 import sys
@@ -62,11 +63,49 @@ if not is_windows:
     os.environ["PROJ_LIB"] = os.path.join(prefix, "share", "proj")
 
 # GDAL Error Handling
-from osgeo import gdal, ogr, osr
+# GDAL is slow to load, so it is only imported by the modules that use it, rather than here.
+# Whenever it is imported, GDAL exceptions are turned on before anything else can use it.
+GDAL_MODULES = ("osgeo.gdal", "osgeo.ogr", "osgeo.osr")
 
-gdal.UseExceptions()
-ogr.UseExceptions()
-osr.UseExceptions()
+
+class _GDALExceptionsLoader(importlib.abc.Loader):
+    """Wraps the loader of a GDAL module, and turns on exceptions once the module is loaded."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        module.UseExceptions()
+
+
+class _GDALExceptionsFinder(importlib.abc.MetaPathFinder):
+    """Finds GDAL modules using the other finders, and wraps their loaders with _GDALExceptionsLoader."""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in GDAL_MODULES:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if hasattr(spec.loader, "exec_module"):
+                    spec.loader = _GDALExceptionsLoader(spec.loader)
+                return spec
+        return None
+
+
+for _name in GDAL_MODULES:
+    if _name in sys.modules:
+        sys.modules[_name].UseExceptions()
+sys.meta_path.insert(0, _GDALExceptionsFinder())
 
 # Libgit2 TLS CA Certificates
 # We build libgit2 to prefer the OS certificate store on Windows/macOS, but Linux doesn't have one.
@@ -1,11 +1,11 @@
 import copy
-import json
 from datetime import datetime
 
 import click
 
 import pygit2
 
+from .binary_patch import BINARY_PATCH_MAGIC, BinaryPatchReader
 from .git_util import author_signature
 from .exceptions import (
     NO_CHANGES,
@@ -15,8 +15,9 @@ from .exceptions import (
     NotYetImplemented,
     InvalidOperation,
 )
-from .diff_structs import RepoDiff, DeltaDiff, Delta
+from .diff_structs import DatasetDiff, DeltaDiff, DeltaStream, Delta
 from .geometry import hex_wkb_to_gpkg_geom
+from .json_patch import JsonPatchReader
 from .schema import Schema
 from .structure import RepositoryStructure
 from .timestamps import iso8601_utc_to_datetime, iso8601_tz_to_timedelta
@@ -42,8 +43,7 @@ class MetaChangeType:
     META_UPDATE = "+/-"
 
 
-def _meta_change_type(ds_diff_dict):
-    meta_diff = ds_diff_dict.get("meta", {})
+def _meta_change_type(meta_diff):
     if not meta_diff:
         return None
     schema_diff = meta_diff.get("schema.json", {})
@@ -95,12 +95,20 @@ def unjson_feature(geom_column_name, f):
     return f
 
 
+def _open_patch(patch_file):
+    """
+    Opens a JSON patch or a binary patch, from patch_file - a binary file-like object.
+    Returns a JsonPatchReader or a BinaryPatchReader, which read the patch as it is iterated over.
+    """
+    head = patch_file.read(len(BINARY_PATCH_MAGIC))
+    if head == BINARY_PATCH_MAGIC:
+        return BinaryPatchReader(patch_file)
+    return JsonPatchReader(patch_file, head)
+
+
 def apply_patch(*, repo, commit, patch_file, allow_empty, **kwargs):
-    try:
-        patch = json.load(patch_file)
-        json_diff = patch['sno.diff/v1+hexwkb']
-    except (KeyError, json.JSONDecodeError) as e:
-        raise click.FileError("Failed to parse JSON patch file") from e
+    patch_reader = _open_patch(patch_file)
+    hex_wkb_geometries = isinstance(patch_reader, JsonPatchReader)
 
     rs = RepositoryStructure(repo)
     wc = WorkingCopy.get(repo)
@@ -111,14 +119,16 @@ def apply_patch(*, repo, commit, patch_file, allow_empty, **kwargs):
     if wc:
         wc.check_not_dirty()
 
-    repo_diff = RepoDiff()
-    for ds_path, ds_diff_dict in json_diff.items():
+    # Each dataset is applied to the tree as it is read from the patch, a feature at a time -
+    # so the whole patch is never held in memory.
+    tree = rs.tree
+    num_changes = 0
+    for ds_path, meta_changes, feature_changes in patch_reader.datasets():
         dataset = rs.get(ds_path)
-        meta_change_type = _meta_change_type(ds_diff_dict)
+        meta_change_type = _meta_change_type(meta_changes)
         check_change_supported(rs.version, dataset, ds_path, meta_change_type, commit)
 
-        meta_changes = ds_diff_dict.get('meta', {})
-
+        ds_diff = DatasetDiff()
         if meta_changes:
             meta_diff = DeltaDiff(
                 Delta(
@@ -127,7 +137,8 @@ def apply_patch(*, repo, commit, patch_file, allow_empty, **kwargs):
                 )
                 for (k, v) in meta_changes.items()
             )
-            repo_diff.recursive_set([ds_path, "meta"], meta_diff)
+            ds_diff["meta"] = meta_diff
+            num_changes += len(meta_diff)
 
         if dataset is not None:
             pk_name = dataset.primary_key
@@ -138,31 +149,25 @@ def apply_patch(*, repo, commit, patch_file, allow_empty, **kwargs):
             geom_columns = schema.geometry_columns
             geom_column_name = geom_columns[0].name if geom_columns else None
 
-        feature_changes = ds_diff_dict.get('feature', [])
-
         def extract_key(feature):
             if feature is None:
                 return None
+            if hex_wkb_geometries:
+                feature = unjson_feature(geom_column_name, feature)
             return str(feature[pk_name]), feature
 
-        def parse_delta(change):
-            return Delta(
-                extract_key(unjson_feature(geom_column_name, change.get('-'))),
-                extract_key(unjson_feature(geom_column_name, change.get('+'))),
-            )
-
-        if feature_changes:
-            feature_diff = DeltaDiff(
-                (parse_delta(change) for change in feature_changes)
-            )
-            repo_diff.recursive_set([ds_path, "feature"], feature_diff)
+        feature_stream = DeltaStream(
+            Delta(extract_key(old), extract_key(new)) for old, new in feature_changes
+        )
+        ds_diff["feature"] = feature_stream
+        tree = repo[dataset.write_to_new_tree(ds_diff, repo, orig_tree=tree)]
+        num_changes += feature_stream.count()
 
+    metadata = patch_reader.metadata
     if commit:
-        if not repo_diff and not allow_empty:
+        if not num_changes and not allow_empty:
             raise NotFound("No changes to commit", exit_code=NO_CHANGES)
-        try:
-            metadata = patch['sno.patch/v1']
-        except KeyError:
+        if metadata is None:
             # Not all diffs are patches. If we're given a raw diff, we can't commit it properly
             raise click.UsageError(
                 "Patch contains no author information, and --no-commit was not supplied"
@@ -189,13 +194,11 @@ def apply_patch(*, repo, commit, patch_file, allow_empty, **kwargs):
             )
 
         author = author_signature(repo, **author_kwargs)
-        oid = rs.commit(
-            repo_diff, metadata['message'], author=author, allow_empty=allow_empty,
-        )
+        oid = rs.commit_tree(tree.id, metadata['message'], author=author)
         click.echo(f"Commit {oid.hex}")
 
     else:
-        oid = rs.create_tree_from_diff(repo_diff)
+        oid = tree.id
 
     if wc:
         # oid refers to either a commit or tree
@@ -219,9 +222,10 @@ def apply_patch(*, repo, commit, patch_file, allow_empty, **kwargs):
         "such a commit. This option bypasses the safety"
     ),
 )
-@click.argument("patch_file", type=click.File('r', encoding="utf-8"))
+@click.argument("patch_file", type=click.File('rb'))
 def apply(ctx, **kwargs):
     """
-    Applies and commits the given JSON patch (as created by `sno show -o json`)
+    Applies and commits the given JSON patch (as created by `sno show -o json`),
+    or binary patch (as created by `sno create-patch -o msgpack`)
     """
     apply_patch(repo=ctx.obj.repo, **kwargs)
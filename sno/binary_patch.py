@@ -0,0 +1,193 @@
+import click
+
+from .exceptions import InvalidOperation
+from .serialise_util import msg_packer, msg_unpacker
+
+
+# A binary patch is an alternative to a JSON patch which is much smaller, and much faster to write and read -
+# it is written and read a record at a time, so it never needs to be held in memory all at once.
+#
+# It starts with BINARY_PATCH_MAGIC and then a single byte, COMPRESSION_NONE or COMPRESSION_ZSTD.
+# The rest of the patch is a stream of msgpack records - zstd-compressed, if COMPRESSION_ZSTD.
+# Each record is a list, starting with the record type:
+#   ["patch", {...}] - the commit metadata, same as "sno.patch/v1" in a JSON patch. Always the first record.
+#   ["dataset", path, {key: {"-": old_value, "+": new_value}, ...}] - starts the changes to the dataset at path,
+#       and contains its meta changes, same as "meta" in a JSON patch.
+#   ["columns", "-" or "+", [name, ...]] - the column names of the old ("-") or new ("+") features that follow,
+#       in the current dataset.
+#   ["feature", old_values, new_values] - a change to a feature in the current dataset. Each of old_values and
+#       new_values is a list of values, one for each of the current columns - or None, for an insert or delete.
+#       Geometries are GPKG geometries, exactly as they are stored - not hex WKB, as in a JSON patch.
+#   ["end"] - always the last record, so that a truncated patch can be detected.
+
+BINARY_PATCH_MAGIC = b"SNOPATCH\x01"
+
+COMPRESSION_NONE = b"\x00"
+COMPRESSION_ZSTD = b"\x01"
+
+_READ_SIZE = 1024 * 1024
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise InvalidOperation(
+            "zstd compressed patches need the zstandard Python package, which is not installed"
+        )
+    return zstandard
+
+
+def _invalid_patch(reason):
+    return click.FileError("Failed to parse binary patch file", hint=reason)
+
+
+class BinaryPatchWriter:
+    """
+    Writes a binary patch to fp, a binary file-like object.
+    Call write_dataset_diff for each dataset in the patch, and then close - which doesn't close fp.
+    """
+
+    def __init__(self, fp, metadata, *, compress=False):
+        self.fp = fp
+        self._packer = msg_packer()
+        fp.write(BINARY_PATCH_MAGIC)
+        if compress:
+            fp.write(COMPRESSION_ZSTD)
+            self._compressor = _import_zstandard().ZstdCompressor().compressobj()
+        else:
+            fp.write(COMPRESSION_NONE)
+            self._compressor = None
+        self._write_record("patch", metadata)
+
+    def _write_record(self, *record):
+        data = self._packer.pack(record)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self.fp.write(data)
+
+    def write_dataset_diff(self, ds_path, meta_deltas, feature_deltas):
+        """
+        Writes the changes to the dataset at ds_path.
+        meta_deltas - (key, delta) for each meta change.
+        feature_deltas - (key, delta) for each feature change - each feature is read once it's needed.
+        """
+        meta_changes = {}
+        for key, delta in meta_deltas:
+            meta_changes[key] = {}
+            if delta.old:
+                meta_changes[key]["-"] = delta.old.get_lazy_value()
+            if delta.new:
+                meta_changes[key]["+"] = delta.new.get_lazy_value()
+        self._write_record("dataset", ds_path, meta_changes)
+
+        columns = {"-": None, "+": None}
+
+        def _feature_values(sign, key_value):
+            if not key_value:
+                return None
+            feature = key_value.get_lazy_value()
+            feature_columns = list(feature.keys())
+            if feature_columns != columns[sign]:
+                self._write_record("columns", sign, feature_columns)
+                columns[sign] = feature_columns
+            return list(feature.values())
+
+        for key, delta in feature_deltas:
+            old_values = _feature_values("-", delta.old)
+            new_values = _feature_values("+", delta.new)
+            self._write_record("feature", old_values, new_values)
+
+    def close(self):
+        self._write_record("end")
+        if self._compressor is not None:
+            self.fp.write(self._compressor.flush())
+        self.fp.flush()
+
+
+class BinaryPatchReader:
+    """
+    Reads a binary patch from fp, a binary file-like object which has already been read up to the end of
+    BINARY_PATCH_MAGIC - the caller reads the magic bytes to find out which kind of patch it has.
+    The patch is read a record at a time, as the datasets and features are iterated over.
+    """
+
+    def __init__(self, fp):
+        self._records = self._read_records(fp)
+        record = self._next_record()
+        if record[0] != "patch":
+            raise _invalid_patch("Patch metadata not found")
+        self.metadata = record[1]
+        self._record = self._next_record()
+
+    def _read_records(self, fp):
+        compression = fp.read(1)
+        if compression == COMPRESSION_ZSTD:
+            zstandard = _import_zstandard()
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            errors = (ValueError, zstandard.ZstdError)
+        elif compression == COMPRESSION_NONE:
+            decompressor = None
+            errors = (ValueError,)
+        else:
+            raise _invalid_patch("Unsupported compression")
+
+        unpacker = msg_unpacker()
+        try:
+            while True:
+                data = fp.read(_READ_SIZE)
+                if not data:
+                    break
+                if decompressor is not None:
+                    data = decompressor.decompress(data)
+                unpacker.feed(data)
+                for record in unpacker:
+                    if not isinstance(record, list) or not record:
+                        raise _invalid_patch("Unexpected data")
+                    yield record
+        except errors as e:
+            raise _invalid_patch(str(e)) from e
+
+    def _next_record(self):
+        try:
+            return next(self._records)
+        except StopIteration:
+            raise _invalid_patch("Patch file is truncated")
+
+    def datasets(self):
+        """
+        Yields (ds_path, meta_changes, feature_changes) for each dataset in the patch -
+        meta_changes is a dict, {key: {"-": old_value, "+": new_value}}, and feature_changes yields (old, new)
+        for each feature change, where old and new are each a dict or None.
+        Each dataset's feature_changes are skipped if they haven't been iterated over before the next dataset.
+        """
+        while self._record[0] == "dataset":
+            _, ds_path, meta_changes = self._record
+            feature_changes = self._feature_changes()
+            yield ds_path, meta_changes, feature_changes
+            for change in feature_changes:
+                pass
+        if self._record[0] != "end":
+            raise _invalid_patch(f"Unexpected record: {self._record[0]}")
+
+    def _feature_changes(self):
+        columns = {"-": None, "+": None}
+
+        def _feature(sign, values):
+            if values is None:
+                return None
+            if columns[sign] is None:
+                raise _invalid_patch("Feature found before its columns")
+            return dict(zip(columns[sign], values))
+
+        while True:
+            self._record = self._next_record()
+            record_type = self._record[0]
+            if record_type == "columns":
+                _, sign, names = self._record
+                columns[sign] = names
+            elif record_type == "feature":
+                _, old_values, new_values = self._record
+                yield _feature("-", old_values), _feature("+", new_values)
+            else:
+                return
@@ -245,9 +245,17 @@ def restore(ctx, source, pathspec):
     is_flag=True,
     help="Discard local changes in working copy if necessary",
 )
+@click.option(
+    "--wal/--no-wal",
+    default=None,
+    help=(
+        "Use a write-ahead log, so that other programs (eg map servers) can keep reading the working copy "
+        "while sno writes to it. Defaults to the current setting."
+    ),
+)
 @click.argument("path", nargs=1, type=click.Path(dir_okay=False), required=False)
 @click.argument("version", nargs=1, type=int, required=False)
-def create_workingcopy(ctx, discard_changes, path, version):
+def create_workingcopy(ctx, discard_changes, wal, path, version):
     """ Create a new working copy - if one already exists it will be deleted """
     if not discard_changes:
         ctx.obj.check_not_dirty(_DISCARD_CHANGES_HELP_MESSAGE)
@@ -264,6 +272,6 @@ def create_workingcopy(ctx, discard_changes, path, version):
     if wc:
         wc.delete()
 
-    WorkingCopy.write_config(repo, path, version)
+    WorkingCopy.write_config(repo, path, version, wal=wal)
     head_commit = repo.head.peel(pygit2.Commit)
     reset_wc_if_needed(repo, head_commit)
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import importlib
 import logging
 import os
 import re
@@ -8,30 +9,42 @@ import click
 import pygit2
 
 from . import core  # noqa
-from . import (
-    apply,
-    branch,
-    checkout,
-    clone,
-    conflicts,
-    commit,
-    data,
-    diff,
-    fsck,
-    init,
-    log,
-    merge,
-    meta,
-    pull,
-    resolve,
-    show,
-    status,
-    query,
-    upgrade,
-)
 from .cli_util import call_and_exit_flag, add_help_subcommand
 from .context import Context
 from .exec import execvp
+from .profiling import profile_command
+from .progress import progress_events
+
+# Commands from modules: {command name: (module name, command attribute)}
+# These modules are only imported when the command is used (or when every command is listed, eg for `sno --help`),
+# since between them they load GDAL, SQLite extensions, etc, which would make every command slow to start.
+MODULE_COMMANDS = {
+    "apply": ("apply", "apply"),
+    "branch": ("branch", "branch"),
+    "checkout": ("checkout", "checkout"),
+    "restore": ("checkout", "restore"),
+    "switch": ("checkout", "switch"),
+    "create-workingcopy": ("checkout", "create_workingcopy"),
+    "clone": ("clone", "clone"),
+    "conflicts": ("conflicts", "conflicts"),
+    "commit": ("commit", "commit"),
+    "data": ("data", "data"),
+    "diff": ("diff", "diff"),
+    "fsck": ("fsck", "fsck"),
+    "import": ("init", "import_table"),
+    "init": ("init", "init"),
+    "log": ("log", "log"),
+    "merge": ("merge", "merge"),
+    "meta": ("meta", "meta"),
+    "pull": ("pull", "pull"),
+    "resolve": ("resolve", "resolve"),
+    "create-patch": ("show", "create_patch"),
+    "show": ("show", "show"),
+    "status": ("status", "status"),
+    "query": ("query", "query"),
+    "serve": ("serve", "serve"),
+    "upgrade": ("upgrade", "upgrade"),
+}
 
 
 def print_version(ctx):
@@ -90,11 +103,20 @@ def print_version(ctx):
 
 
 class SnoGroup(click.Group):
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | MODULE_COMMANDS.keys())
+
     def get_command(self, ctx, cmd_name):
         rv = super().get_command(ctx, cmd_name)
         if rv is not None:
             return rv
 
+        if cmd_name in MODULE_COMMANDS:
+            module_name, attr = MODULE_COMMANDS[cmd_name]
+            rv = getattr(importlib.import_module(f"sno.{module_name}"), attr)
+            self.add_command(rv, cmd_name)
+            return rv
+
         # typo? Suggest similar commands.
         import difflib
 
@@ -119,14 +141,28 @@ class SnoGroup(click.Group):
             # ipdb is only installed in dev venvs, not releases
             import pdb
 
-        if ctx.params.get('post_mortem'):
-            try:
+        from .serve import run_using_server
+
+        exit_code = run_using_server(ctx)
+        if exit_code is not None:
+            ctx.exit(exit_code)
+
+        with profile_command(
+            profile_path=ctx.params.get('profile_path'),
+            timings=ctx.params.get('timings'),
+            trace_memory=ctx.params.get('trace_memory'),
+        ), progress_events(
+            progress_format=ctx.params.get('progress_format'),
+            progress_fd=ctx.params.get('progress_fd'),
+        ):
+            if ctx.params.get('post_mortem'):
+                try:
+                    return super().invoke(ctx)
+                except Exception:
+                    pdb.post_mortem()
+                    raise
+            else:
                 return super().invoke(ctx)
-            except Exception:
-                pdb.post_mortem()
-                raise
-        else:
-            return super().invoke(ctx)
 
 
 @add_help_subcommand
@@ -150,8 +186,51 @@ class SnoGroup(click.Group):
     hidden=True,
     help="Interactively debug uncaught exceptions",
 )
+# NOTE: these options aren't used in `cli` either, they are used in `SnoGroup.invoke` above.
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False, writable=True),
+    metavar="PATH",
+    help="Profile the command, write the profile to PATH, and show the time spent in each phase.",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    help="Show the time spent in each phase of the command (tree diff, blob decode, SQLite writes, output...)",
+)
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    help="Show the command's peak memory use, and which code allocated it.",
+)
+@click.option(
+    "--progress-format",
+    type=click.Choice(["text", "jsonl"]),
+    default="text",
+    help=(
+        "With jsonl, long operations (import, checkout, reset, upgrade, clone) also report their progress "
+        "as a stream of JSON events, one per line: phase, dataset, items done and total, bytes written, rate."
+    ),
+)
+@click.option(
+    "--progress-fd",
+    type=click.INT,
+    metavar="FD",
+    help="Write --progress-format=jsonl events to this file descriptor, instead of stderr.",
+)
 @click.pass_context
-def cli(ctx, repo_dir, verbose, post_mortem):
+def cli(
+    ctx,
+    repo_dir,
+    verbose,
+    post_mortem,
+    profile_path,
+    timings,
+    trace_memory,
+    progress_format,
+    progress_fd,
+):
     ctx.ensure_object(Context)
     if repo_dir:
         ctx.obj.user_repo_path = repo_dir
@@ -161,33 +240,6 @@ def cli(ctx, repo_dir, verbose, post_mortem):
     logging.basicConfig(level=log_level)
 
 
-# Commands from modules:
-cli.add_command(apply.apply)
-cli.add_command(branch.branch)
-cli.add_command(checkout.checkout)
-cli.add_command(checkout.restore)
-cli.add_command(checkout.switch)
-cli.add_command(checkout.create_workingcopy)
-cli.add_command(clone.clone)
-cli.add_command(conflicts.conflicts)
-cli.add_command(commit.commit)
-cli.add_command(data.data)
-cli.add_command(diff.diff)
-cli.add_command(fsck.fsck)
-cli.add_command(init.import_table)
-cli.add_command(init.init)
-cli.add_command(log.log)
-cli.add_command(merge.merge)
-cli.add_command(meta.meta)
-cli.add_command(pull.pull)
-cli.add_command(resolve.resolve)
-cli.add_command(show.create_patch)
-cli.add_command(show.show)
-cli.add_command(status.status)
-cli.add_command(query.query)
-cli.add_command(upgrade.upgrade)
-
-
 # aliases/shortcuts
 
 
@@ -195,7 +247,9 @@ cli.add_command(upgrade.upgrade)
 @click.pass_context
 def reset(ctx):
     """ Discard changes made in the working copy (ie. reset to HEAD """
-    ctx.invoke(checkout.checkout, discard_changes=True, refish="HEAD")
+    from .checkout import checkout
+
+    ctx.invoke(checkout, discard_changes=True, refish="HEAD")
 
 
 # straight process-replace commands
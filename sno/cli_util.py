@@ -12,7 +12,7 @@ def add_help_subcommand(group):
         if topic is None:
             print(ctx.parent.get_help())
         else:
-            print(group.commands[topic].get_help(ctx))
+            print(group.get_command(ctx, topic).get_help(ctx))
 
     return group
 
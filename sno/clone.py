@@ -8,7 +8,7 @@ from urllib.parse import urlsplit
 import click
 import pygit2
 
-from . import checkout
+from . import checkout, progress
 from .exceptions import translate_subprocess_exit_code
 from .repository_version import get_repo_version
 from .working_copy import WorkingCopy
@@ -84,7 +84,7 @@ def clone(ctx, bare, wc_path, wc_version, do_progress, depth, url, directory):
     try:
         # we use subprocess because it deals with credentials much better & consistently than we can do at the moment.
         # pygit2.clone_repository() works fine except for that
-        subprocess.check_call(args)
+        progress.check_call_git(args)
     except subprocess.CalledProcessError as e:
         sys.exit(translate_subprocess_exit_code(e.returncode))
 
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta, timezone
 import click
 import pygit2
 
+from . import status
 from .cli_util import StringFromFile
 from .core import check_git_user
 from .exceptions import (
@@ -22,12 +23,6 @@ from .repo_files import (
     read_repo_file,
     user_edit_repo_file,
 )
-from .status import (
-    get_branch_status_message,
-    get_diff_status_message,
-    get_diff_status_json,
-    diff_status_to_text,
-)
 from .timestamps import (
     datetime_to_iso8601_utc,
     timedelta_to_iso8601_tz,
@@ -123,14 +118,14 @@ def get_commit_message(repo, diff, draft_message="", quiet=False):
         "# Please enter the commit message for your changes. Lines starting",
         "# with '#' will be ignored, and an empty message aborts the commit.",
         "#",
-        re.sub(r"^", "# ", get_branch_status_message(repo), flags=re.MULTILINE),
+        re.sub(r"^", "# ", status.get_branch_status_message(repo), flags=re.MULTILINE),
         "#",
         "# Changes to be committed:",
         "#",
         re.sub(
             r"^",
             "# ",
-            (get_diff_status_message(diff) or "  No changes (empty commit)"),
+            (status.get_diff_status_message(diff) or "  No changes (empty commit)"),
             flags=re.MULTILINE,
         ),
         "#",
@@ -164,7 +159,7 @@ def commit_obj_to_json(commit, repo, wc_diff):
             "committer": commit.committer.email,
             "branch": branch,
             "message": commit.message,
-            "changes": get_diff_status_json(wc_diff),
+            "changes": status.get_diff_status_json(wc_diff),
             "commitTime": datetime_to_iso8601_utc(commit_time),
             "commitTimeOffset": timedelta_to_iso8601_tz(commit_time_offset),
         }
@@ -176,6 +171,6 @@ def commit_json_to_text(jdict):
     branch = jdict["branch"]
     commit = jdict["abbrevCommit"]
     message = jdict["message"].replace("\n", " ")
-    diff = diff_status_to_text(jdict["changes"])
+    diff = status.diff_status_to_text(jdict["changes"])
     datetime = commit_time_to_text(jdict["commitTime"], jdict["commitTimeOffset"])
     return f"[{branch} {commit}] {message}\n{diff}\n  Date: {datetime}"
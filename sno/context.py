@@ -4,7 +4,6 @@ import pygit2
 
 from .exceptions import NotFound, NO_REPOSITORY
 from .repo_files import RepoState
-from .working_copy import WorkingCopy
 
 
 class Context(object):
@@ -78,6 +77,9 @@ class Context(object):
         return self._repo
 
     def check_not_dirty(self, help_message=None):
+        # Imported here, since the working copy loads GDAL and SQLite extensions - slow, and not needed by all commands.
+        from .working_copy import WorkingCopy
+
         repo = self.get_repo(allowed_states=RepoState.ALL_STATES)
         working_copy = WorkingCopy.get(repo)
         if working_copy:
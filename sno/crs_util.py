@@ -1,10 +1,10 @@
-from osgeo.osr import SpatialReference
-
-
 def get_identifier(crs):
     """
     Given a CRS, generate a unique idenfier for it. Eg: "EPSG:2193"
     """
+    # GDAL is slow to load - see geometry.py
+    from osgeo.osr import SpatialReference
+
     if isinstance(crs, str):
         crs = SpatialReference(crs)
     if isinstance(crs, SpatialReference):
@@ -9,7 +9,8 @@ import msgpack
 import pygit2
 
 from . import gpkg_adapter
-from .geometry import Geometry
+from .decode_cache import field_map_cache
+from .geometry import Geometry, geom_envelope
 from .structure import DatasetStructure, IntegrityError
 
 
@@ -80,8 +81,14 @@ class Dataset1(DatasetStructure):
     @property
     @functools.lru_cache(maxsize=1)
     def cid_field_map(self):
+        fields_tree = self.meta_tree / "fields"
+        return field_map_cache.get(
+            fields_tree.id, lambda: self._load_cid_field_map(fields_tree)
+        )
+
+    def _load_cid_field_map(self, fields_tree):
         cid_map = {}
-        for te in self.meta_tree / "fields":
+        for te in fields_tree:
             if not isinstance(te, pygit2.Blob):
                 self.L.warn(
                     "cid_field_map: Unexpected TreeEntry type=%s @ meta/fields/%s",
@@ -226,6 +233,23 @@ class Dataset1(DatasetStructure):
 
         return tupleizer
 
+    def envelope_reader(self):
+        """
+        Returns a function that reads the 2D envelope of a feature's geometry from its blob,
+        as (min_x, max_x, min_y, max_y) - or None if that feature has no geometry.
+        Returns None if this dataset has no geometry column.
+        """
+        if not self.has_geometry:
+            return None
+        geom_cid = self.field_cid_map[self.geom_column_name]
+
+        def _read_envelope(blob):
+            bin_feature = msgpack.unpackb(blob.data, raw=False, use_list=False)
+            geom = bin_feature.get(geom_cid)
+            return geom_envelope(geom.data) if geom is not None else None
+
+        return _read_envelope
+
     def _iter_feature_blobs(self, fast=False):
         """
         Iterates over all the features in self.tree that match the expected
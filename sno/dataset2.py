@@ -1,11 +1,16 @@
 import functools
+import operator
 import os
 
 import pygit2
 
 from . import gpkg_adapter
+from .decode_cache import legend_cache, schema_cache
+from .feature_summary import envelope_union, get_stored_feature_summary
+from .geometry import geom_envelope
 from .meta_items import META_ITEM_NAMES
-from .structure import DatasetStructure
+from .structure import DatasetStructure, FeatureBatch
+from .utils import iter_threaded
 from .schema import Legend, Schema
 from .serialise_util import (
     msg_pack,
@@ -79,6 +84,11 @@ class Dataset2(DatasetStructure):
     METADATA_PATH = META_PATH + "metadata/"
     DATASET_METADATA_PATH = METADATA_PATH + "dataset.json"
 
+    def __init__(self, tree, path, repo=None):
+        super().__init__(tree, path, repo=repo)
+        # {legend hash: RowCodec}
+        self._row_codecs = {}
+
     @property
     def version(self):
         return 2
@@ -153,8 +163,8 @@ class Dataset2(DatasetStructure):
     @functools.lru_cache()
     def get_legend(self, legend_hash):
         """Load the legend with the given hash from this dataset."""
-        path = self.LEGEND_PATH + legend_hash
-        return Legend.loads(self.get_data_at(path))
+        blob = self._get_meta_blob(self.LEGEND_PATH + legend_hash)
+        return legend_cache.get(blob.id, lambda: Legend.loads(blob.data))
 
     def encode_legend(self, legend):
         """
@@ -168,7 +178,18 @@ class Dataset2(DatasetStructure):
     @functools.lru_cache(maxsize=1)
     def schema(self):
         """Load the current schema from this dataset."""
-        return Schema.loads(self.get_data_at(self.SCHEMA_PATH))
+        blob = self._get_meta_blob(self.SCHEMA_PATH)
+        return schema_cache.get(blob.id, lambda: Schema.loads(blob.data))
+
+    def _get_meta_blob(self, rel_path):
+        leaf = None
+        try:
+            leaf = self.tree / rel_path
+        except KeyError:
+            pass
+        if leaf is None or leaf.type_str != 'blob':
+            raise KeyError(f"No data found at rel-path {rel_path}, type={type(leaf)}")
+        return leaf
 
     @property
     @functools.lru_cache(maxsize=1)
@@ -225,8 +246,34 @@ class Dataset2(DatasetStructure):
         The result is either a dict of values keyed by column name (if keys=True)
         or a tuple of values in schema order (if keys=False).
         """
-        raw_dict = self.get_raw_feature_dict(pk_values=pk_values, path=path, data=data)
-        return self.schema.feature_from_raw_dict(raw_dict, keys=keys)
+        # Same as get_raw_feature_dict, followed by Schema.feature_from_raw_dict - but without the raw dict.
+        if pk_values is None and path is None:
+            raise ValueError("Either <pk_values> or <path> must be supplied")
+
+        if pk_values is not None:
+            pk_values = self.schema.sanitise_pks(pk_values)
+        else:
+            pk_values = self.decode_path_to_pks(path)
+
+        if data is None:
+            if path is not None:
+                rel_path = self.ensure_rel_path(path)
+            else:
+                rel_path = self.encode_pks_to_path(pk_values, relative=True)
+            data = self.get_data_at(rel_path, as_memoryview=True)
+
+        legend_hash, non_pk_values = msg_unpack(data)
+        return self.row_codec(legend_hash).decode(pk_values, non_pk_values, keys=keys)
+
+    def row_codec(self, legend_hash):
+        """Returns the RowCodec for reading features stored with the given legend as features of the current schema."""
+        try:
+            return self._row_codecs[legend_hash]
+        except KeyError:
+            codec = self._row_codecs[legend_hash] = self.schema.row_codec(
+                self.get_legend(legend_hash)
+            )
+            return codec
 
     def features(self, keys=True, fast=None):
         """
@@ -244,11 +291,155 @@ class Dataset2(DatasetStructure):
                 path=blob.name, data=blob.data, keys=keys
             ),
 
+    def features_batched(
+        self, col_names, batch_size=10000, *, num_threads=1, tree_summaries=None
+    ):
+        """
+        Optimised feature iterator yielding FeatureBatch objects of up to batch_size features each,
+        with values ordered by the columns from col_names. Unlike get_feature, this doesn't build a dict
+        per feature - the positions of the requested columns are worked out once per legend.
+        If num_threads > 1, the top-level subtrees of the feature tree are read concurrently, and
+        batches are yielded in whatever order they are read.
+        If tree_summaries is a list, (tree, count, envelope) is appended to it for the feature tree and each of its
+        subtrees once they have been read - see feature_summary.store_feature_summaries.
+        """
+        if self.FEATURE_PATH not in self.tree:
+            return
+
+        col_ids_by_name = {c.name: c.id for c in self.schema.columns}
+        col_ids = [col_ids_by_name.get(name) for name in col_names]
+        geom_col_id = None
+        if tree_summaries is not None and self.schema.geometry_columns:
+            geom_col_id = self.schema.geometry_columns[0].id
+
+        def _batches(tree):
+            return self._iter_feature_batches(
+                tree, col_names, col_ids, batch_size, geom_col_id, tree_summaries
+            )
+
+        if num_threads > 1:
+            yield from iter_threaded(
+                _batches, self.feature_tree, num_threads=num_threads
+            )
+            if tree_summaries is not None:
+                # Every top-level subtree has been read, so the whole feature tree can be summarised.
+                summaries_by_id = {t.id: (c, e) for t, c, e in tree_summaries}
+                count, envelope = 0, None
+                for tree in self.feature_tree:
+                    tree_count, tree_envelope = summaries_by_id[tree.id]
+                    count += tree_count
+                    envelope = envelope_union(envelope, tree_envelope)
+                tree_summaries.append((self.feature_tree, count, envelope))
+        else:
+            yield from _batches(self.feature_tree)
+
+    def _iter_feature_batches(
+        self, tree, col_names, col_ids, batch_size, geom_col_id, tree_summaries
+    ):
+        getters = {}
+
+        def _row_getter(legend_hash):
+            """Returns (row getter, index of the geometry value or None) for the given legend."""
+            legend = self.get_legend(legend_hash)
+            all_ids = legend.pk_columns + legend.non_pk_columns
+            positions = {col_id: i for i, col_id in enumerate(all_ids)}
+            geom_index = positions.get(geom_col_id)
+            # Columns that aren't in the legend are read from a trailing None.
+            indexes = [positions.get(col_id, len(all_ids)) for col_id in col_ids]
+            if len(indexes) == 1:
+                index = indexes[0]
+                return (lambda values: (values[index],)), geom_index
+            return operator.itemgetter(*indexes), geom_index
+
+        batch = []
+
+        def _read_tree(tree, max_depth):
+            """Adds the features in tree to the batch, yielding each full batch. Returns (count, envelope)."""
+            nonlocal batch
+            count, envelope = 0, None
+            for entry in tree:
+                if isinstance(entry, pygit2.Blob):
+                    pk_values = msg_unpack(b64decode_str(entry.name))
+                    legend_hash, non_pk_values = msg_unpack(_blob_to_memoryview(entry))
+                    try:
+                        getter, geom_index = getters[legend_hash]
+                    except KeyError:
+                        getter, geom_index = getters[legend_hash] = _row_getter(
+                            legend_hash
+                        )
+
+                    values = pk_values + non_pk_values + [None]
+                    batch.append(getter(values))
+                    count += 1
+                    if geom_index is not None:
+                        envelope = envelope_union(
+                            envelope, geom_envelope(values[geom_index])
+                        )
+                    if len(batch) >= batch_size:
+                        yield FeatureBatch(col_names, batch)
+                        batch = []
+                elif max_depth > 0:
+                    subtree_count, subtree_envelope = yield from _read_tree(
+                        entry, max_depth - 1
+                    )
+                    count += subtree_count
+                    envelope = envelope_union(envelope, subtree_envelope)
+
+            if tree_summaries is not None:
+                tree_summaries.append((tree, count, envelope))
+            return count, envelope
+
+        yield from _read_tree(tree, 4)
+        if batch:
+            yield FeatureBatch(col_names, batch)
+
+    def feature_tuples(self, col_names, **kwargs):
+        """ Optimised feature iterator yielding tuples, ordered by the columns from col_names """
+        for batch in self.features_batched(col_names):
+            yield from batch.rows
+
     def feature_count(self, fast=None):
+        """
+        Returns the number of features in this dataset - from its stored summary if there is one (see
+        feature_summary.py), otherwise by counting them. Summarising the dataset would mean reading every feature.
+        """
         if self.FEATURE_PATH not in self.tree:
             return 0
+        if self.repo is not None:
+            summary = get_stored_feature_summary(self.repo, self)
+            if summary is not None:
+                return summary.count
         return sum(1 for blob in find_blobs_in_tree(self.tree / self.FEATURE_PATH))
 
+    def envelope_reader(self):
+        """
+        Returns a function that reads the 2D envelope of a feature's geometry from its blob,
+        as (min_x, max_x, min_y, max_y) - or None if that feature has no geometry.
+        Returns None if this dataset has no geometry column.
+        """
+        geom_columns = self.schema.geometry_columns
+        if not geom_columns:
+            return None
+        geom_column_id = geom_columns[0].id
+        geom_indexes = {}
+
+        def _read_envelope(blob):
+            legend_hash, non_pk_values = msg_unpack(memoryview(blob))
+            try:
+                geom_index = geom_indexes[legend_hash]
+            except KeyError:
+                non_pk_columns = self.get_legend(legend_hash).non_pk_columns
+                geom_index = geom_indexes[legend_hash] = (
+                    non_pk_columns.index(geom_column_id)
+                    if geom_column_id in non_pk_columns
+                    else None
+                )
+            if geom_index is None:
+                return None
+            return geom_envelope(non_pk_values[geom_index])
+
+        return _read_envelope
+
     @classmethod
     def decode_path_to_pks(cls, path):
         """Given a feature path, returns the pk values encoded in it."""
@@ -281,8 +472,8 @@ class Dataset2(DatasetStructure):
         """
         if schema is None:
             schema = self.schema
-        raw_dict = schema.feature_to_raw_dict(feature)
-        return self.encode_raw_feature_dict(raw_dict, schema.legend)
+        pk_values, data = schema.row_codec().encode(feature)
+        return self.encode_pks_to_path(pk_values), data
 
     def encode_pks_to_path(self, pk_values, relative=False):
         """
@@ -296,10 +487,15 @@ class Dataset2(DatasetStructure):
         return rel_path if relative else self.full_path(rel_path)
 
     def encode_1pk_to_path(self, pk_value, relative=False):
-        """Given a feature's only pk value, returns the path the feature should be written to."""
+        """
+        Given a feature's only pk value, returns the path the feature should be written to.
+        Like Dataset1, the pk value is cast to an int first if the pk column is an integer.
+        """
         if isinstance(pk_value, (list, tuple)):
             raise ValueError(f"Expected a single pk value, got {pk_value}")
-        return self.encode_pks_to_path((pk_value,), relative=relative)
+        return self.encode_pks_to_path(
+            self.schema.sanitise_pks(pk_value), relative=relative
+        )
 
     def import_iter_meta_blobs(self, repo, source):
         schema = source.schema
@@ -333,40 +529,69 @@ class Dataset2(DatasetStructure):
                 blob.data,
             )
 
+    def legend_column_ids(self):
+        """
+        Returns the IDs of every column in any legend in this dataset - features may have values for these columns,
+        even if they are no longer in the schema.
+        """
+        result = set()
+        for blob in self.meta_tree / "legend":
+            legend = self.get_legend(blob.name)
+            result.update(legend.pk_columns)
+            result.update(legend.non_pk_columns)
+        return result
+
     def import_iter_feature_blobs(self, resultset, source, replacing_dataset=None):
-        schema = source.schema
-        if replacing_dataset is not None and replacing_dataset.schema != source.schema:
-            # Optimisation: Try to avoid rewriting features for compatible schema changes.
-            change_types = replacing_dataset.schema.diff_type_counts(source.schema)
-            if not change_types["pk_updates"]:
-                # We can probably avoid rewriting all features.
-                for feature in resultset:
-                    pk_values = (feature[replacing_dataset.primary_key],)
-                    rel_path = self.encode_pks_to_path(pk_values, relative=True)
-                    try:
-                        existing_data = replacing_dataset.get_data_at(
-                            rel_path, as_memoryview=True
-                        )
-                    except KeyError:
-                        # this feature isn't in the dataset we're replacing
-                        yield self.encode_feature(feature, schema)
-                        continue
+        yield from self.encode_features_for_import(
+            resultset, source.schema, replacing_dataset=replacing_dataset
+        )
+
+    def encode_features_for_import(self, resultset, schema, replacing_dataset=None):
+        """
+        Generates (full_path, blob_data) tuples for each feature in resultset, encoded using the given schema.
+        Unlike import_iter_feature_blobs, this doesn't need an ImportSource - so it can be used in a worker process.
+        If replacing_dataset is given, features which are unchanged in replacing_dataset are skipped -
+        the caller is expected to keep the existing blobs for those features, rather than deleting them.
+        """
+        if replacing_dataset is None:
+            for feature in resultset:
+                yield self.encode_feature(feature, schema)
+            return
+
+        # Optimisation: Try to avoid rewriting features for compatible schema changes.
+        compare_decoded = False
+        if replacing_dataset.schema != schema:
+            change_types = replacing_dataset.schema.diff_type_counts(schema)
+            compare_decoded = not change_types["pk_updates"]
 
-                    existing_feature_raw_dict = replacing_dataset.get_raw_feature_dict(
-                        pk_values, data=existing_data
-                    )
-                    # This adapts the existing feature to the new schema
-                    existing_feature = schema.feature_from_raw_dict(
-                        existing_feature_raw_dict
-                    )
-                    if existing_feature == feature:
-                        # Nothing changed? No need to rewrite the feature blob
-                        yield self.encode_pks_to_path(pk_values), existing_data
-                    else:
-                        yield self.encode_feature(feature, schema)
-                return
         for feature in resultset:
-            yield self.encode_feature(feature, schema)
+            path, data = self.encode_feature(feature, schema)
+            rel_path = self.rel_path(path)
+            try:
+                existing_blob = replacing_dataset.tree / rel_path
+            except KeyError:
+                # this feature isn't in the dataset we're replacing
+                yield path, data
+                continue
+
+            # Comparing the hash of the encoded feature to the existing blob ID means
+            # we don't need to read or decode the existing feature at all.
+            if pygit2.hash(data) == existing_blob.id:
+                continue
+
+            if compare_decoded:
+                existing_feature_raw_dict = replacing_dataset.get_raw_feature_dict(
+                    path=rel_path, data=_blob_to_memoryview(existing_blob)
+                )
+                # This adapts the existing feature to the new schema
+                existing_feature = schema.feature_from_raw_dict(
+                    existing_feature_raw_dict
+                )
+                if existing_feature == feature:
+                    # Nothing changed? No need to rewrite the feature blob
+                    continue
+
+            yield path, data
 
     @property
     def primary_key(self):
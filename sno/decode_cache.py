@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+
+class DecodeCache:
+    """
+    A process-wide cache of objects decoded from git objects, keyed by the ID of the git object they were decoded from.
+    Since git objects are content-addressed, a cached value never needs to be invalidated - the same ID always decodes
+    to the same value. Values must be treated as immutable, since they are shared by every caller.
+    The cache holds at most maxsize values, the least recently used values are evicted first.
+    """
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, oid, decode):
+        """
+        Returns the cached value for the given git object ID, or, calls decode() to load the value and caches that.
+        """
+        with self._lock:
+            try:
+                value = self._values[oid]
+            except KeyError:
+                self.misses += 1
+            else:
+                self._values.move_to_end(oid)
+                self.hits += 1
+                return value
+
+        value = decode()
+        with self._lock:
+            self._values[oid] = value
+            if len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "size": len(self._values),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __repr__(self):
+        return f"<DecodeCache {self.name}: {len(self._values)} items, {self.hits} hits, {self.misses} misses>"
+
+
+# Legends and schemas are shared by every feature in a dataset, and rarely change between commits.
+legend_cache = DecodeCache("legend", maxsize=1024)
+schema_cache = DecodeCache("schema", maxsize=256)
+# Dataset V1 meta/fields trees - decoded to a dict of {column_id: field_name}
+field_map_cache = DecodeCache("fields", maxsize=256)
+
+ALL_CACHES = (legend_cache, schema_cache, field_map_cache)
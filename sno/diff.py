@@ -4,17 +4,18 @@ import sys
 from pathlib import Path
 
 import click
-from osgeo import osr
 
 from .cli_util import StringFromFile
 from .diff_output import (  # noqa - used from globals()
     diff_output_text,
     diff_output_json,
     diff_output_geojson,
+    diff_output_geojsonseq,
     diff_output_quiet,
     diff_output_html,
+    HTML_MAX_FEATURES,
 )
-from .diff_structs import RepoDiff, DatasetDiff
+from .diff_structs import RepoDiff, DatasetDiff, DeltaStream
 from .exceptions import (
     InvalidOperation,
     NotFound,
@@ -23,6 +24,7 @@ from .exceptions import (
 )
 from .filter_util import build_feature_filter, UNFILTERED
 from .geometry import make_crs
+from .profiling import phase
 from .repo_files import RepoState
 from .structure import RepositoryStructure
 
@@ -62,6 +64,52 @@ def get_dataset_diff(
     return diff
 
 
+def get_dataset_diff_stream(
+    base_rs, target_rs, working_copy, dataset_path, ds_filter=UNFILTERED
+):
+    """
+    Like get_dataset_diff, but where possible the feature changes are returned as a DeltaStream,
+    so that they can be written out without holding every changed feature in memory at once.
+    This is possible whenever there is only one diff to generate - base<>target, or target<>working_copy.
+    """
+    if base_rs != target_rs and working_copy:
+        # The two diffs need to be concatenated, feature by feature - so they can't be streamed.
+        return get_dataset_diff(
+            base_rs, target_rs, working_copy, dataset_path, ds_filter=ds_filter
+        )
+
+    diff = DatasetDiff()
+    if base_rs != target_rs:
+        base_ds = base_rs.get(dataset_path)
+        target_ds = target_rs.get(dataset_path)
+
+        params = {}
+        if not base_ds:
+            base_ds, target_ds = target_ds, base_ds
+            params["reverse"] = True
+
+        meta_diff = base_ds.diff_meta(target_ds, **params)
+        deltas = base_ds.iter_feature_deltas(target_ds, ds_filter=ds_filter, **params)
+
+    elif working_copy:
+        target_ds = target_rs.get(dataset_path)
+        meta_diff = working_copy.diff_db_to_tree_meta(target_ds)
+        deltas = working_copy.iter_feature_deltas_db_to_tree(
+            target_ds,
+            ds_filter=ds_filter,
+            find_renames=working_copy.can_find_renames(meta_diff),
+            compare_blob_ids=working_copy.can_compare_blob_ids(meta_diff),
+        )
+
+    else:
+        return diff
+
+    if meta_diff:
+        diff["meta"] = meta_diff
+    diff["feature"] = DeltaStream(deltas)
+    return diff
+
+
 def get_repo_diff(base_rs, target_rs, feature_filter=UNFILTERED):
     """Generates a Diff for every dataset in both RepositoryStructures."""
     all_datasets = {ds.path for ds in base_rs} | {ds.path for ds in target_rs}
@@ -104,6 +152,7 @@ def diff_with_writer(
     commit_spec,
     filters,
     target_crs=None,
+    html_max_features=None,
 ):
     """
     Calculates the appropriate diff from the arguments,
@@ -119,6 +168,7 @@ def diff_with_writer(
       commit_spec: The commit-ref or -refs to diff.
       filters:     Limit the diff to certain datasets or features.
       target_crs:  An osr.SpatialReference object, or None
+      html_max_features: The maximum number of changed features per dataset to show in HTML output, or None
     """
     from .working_copy import WorkingCopy
 
@@ -168,6 +218,8 @@ def diff_with_writer(
 
         dataset_geometry_transforms = {}
         if target_crs is not None:
+            from osgeo import osr
+
             for dataset_path in all_datasets:
                 dataset = base_rs.get(dataset_path) or target_rs.get(dataset_path)
                 crs_wkt = dataset.crs_wkt
@@ -190,6 +242,7 @@ def diff_with_writer(
             "dataset_count": len(all_datasets),
             "json_style": json_style,
             "dataset_geometry_transforms": dataset_geometry_transforms,
+            "html_max_features": html_max_features,
         }
 
         L.debug(
@@ -202,7 +255,7 @@ def diff_with_writer(
         num_changes = 0
         with diff_writer(**writer_params) as w:
             for dataset_path in all_datasets:
-                diff = get_dataset_diff(
+                diff = get_dataset_diff_stream(
                     base_rs,
                     target_rs,
                     working_copy,
@@ -210,9 +263,10 @@ def diff_with_writer(
                     feature_filter[dataset_path],
                 )
                 dataset = base_rs.get(dataset_path) or target_rs.get(dataset_path)
-                num_changes += len(diff)
                 L.debug("overall diff (%s): %s", dataset_path, repr(diff))
-                w(dataset, diff)
+                with phase("output"):
+                    w(dataset, diff)
+                num_changes += _count_changes(diff)
 
     except click.ClickException as e:
         L.debug("Caught ClickException: %s", e)
@@ -231,6 +285,14 @@ def diff_with_writer(
             sys.exit(1)
 
 
+def _count_changes(ds_diff):
+    """Counts the changes in a DatasetDiff - once it has been written, if it contains a DeltaStream."""
+    num_changes = 0
+    for part in ds_diff.values():
+        num_changes += part.count() if isinstance(part, DeltaStream) else len(part)
+    return num_changes
+
+
 class CoordinateReferenceString(StringFromFile):
     def convert(self, value, param, ctx):
         value = super().convert(value, param, ctx)
@@ -248,10 +310,11 @@ class CoordinateReferenceString(StringFromFile):
 @click.option(
     "--output-format",
     "-o",
-    type=click.Choice(["text", "json", "geojson", "quiet", "html"]),
+    type=click.Choice(["text", "json", "geojson", "geojsonseq", "quiet", "html"]),
     default="text",
     help=(
         "Output format. 'quiet' disables all output and implies --exit-code.\n"
+        "'geojsonseq' writes newline-delimited GeoJSON features.\n"
         "'html' attempts to open a browser unless writing to stdout ( --output=- )"
     ),
 )
@@ -275,12 +338,29 @@ class CoordinateReferenceString(StringFromFile):
     "--json-style",
     type=click.Choice(["extracompact", "compact", "pretty"]),
     default="pretty",
-    help="How to format the output. Only used with -o json or -o geojson",
+    help="How to format the output. Only used with -o json, -o geojson or -o geojsonseq",
+)
+@click.option(
+    "--html-max-features",
+    type=click.IntRange(min=1),
+    default=HTML_MAX_FEATURES,
+    help=(
+        "The most changed features to show for each dataset. If there are more, an evenly spaced sample of them "
+        f"is shown. Only used with -o html. Default: {HTML_MAX_FEATURES}"
+    ),
 )
 @click.argument("commit_spec", required=False, nargs=1)
 @click.argument("filters", nargs=-1)
 def diff(
-    ctx, output_format, crs, output_path, exit_code, json_style, commit_spec, filters
+    ctx,
+    output_format,
+    crs,
+    output_path,
+    exit_code,
+    json_style,
+    html_max_features,
+    commit_spec,
+    filters,
 ):
     """
     Show changes between two commits, or between a commit and the working copy.
@@ -312,4 +392,5 @@ def diff(
         commit_spec=commit_spec,
         filters=filters,
         target_crs=crs,
+        html_max_features=html_max_features,
     )
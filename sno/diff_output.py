@@ -2,19 +2,17 @@ import contextlib
 import io
 import itertools
 import json
-import os
 import re
 import string
 import sys
-import tempfile
 import webbrowser
 from pathlib import Path
 
 import click
 
 from .exceptions import InvalidOperation
-from .geometry import Geometry, gpkg_geom_to_ogr, ogr_to_hex_wkb
-from .output_util import dump_json_output, resolve_output_path
+from .geometry import Geometry, gpkg_geom_summary, ogr_to_hex_wkb
+from .output_util import JsonWriter, dump_json_output, resolve_output_path
 from .schema import Schema
 from .utils import ungenerator
 
@@ -39,6 +37,28 @@ def diff_output_quiet(**kwargs):
 
 _NULL = object()
 
+# The HTML diff shows at most this many changed features from each dataset, by default - browsers struggle to show
+# many more than this on a map and in a table, so if there are more, an evenly spaced sample of them is shown.
+HTML_MAX_FEATURES = 100000
+
+
+def _sorted_feature_deltas(ds_diff):
+    """
+    Yields (key, delta) for each feature change in the given DatasetDiff, sorted by key.
+    The feature changes may be a DeltaStream, in which case they can only be iterated once.
+    """
+    if "feature" in ds_diff:
+        yield from ds_diff["feature"].sorted_items()
+
+
+def _feature_deltas(ds_diff):
+    """
+    Yields (key, delta) for each feature change in the given DatasetDiff, in no particular order.
+    Unlike _sorted_feature_deltas, a DeltaStream is read a delta at a time, rather than up front.
+    """
+    if "feature" in ds_diff:
+        yield from ds_diff["feature"].items()
+
 
 @contextlib.contextmanager
 def diff_output_text(*, output_path, **kwargs):
@@ -97,7 +117,7 @@ def diff_output_text(*, output_path, **kwargs):
         pk_field = dataset.primary_key
         repr_excl = [pk_field]
         prefix = f"{path}:feature:"
-        for key, delta in sorted(diff.get("feature", {}).items()):
+        for key, delta in _sorted_feature_deltas(diff):
             old_pk = delta.old_key
             new_pk = delta.new_key
             old_feature = delta.old_value
@@ -306,18 +326,105 @@ def text_row_field(row, key, prefix):
     val = row[key]
 
     if isinstance(val, bytes):
-        g = gpkg_geom_to_ogr(val)
-        geom_typ = g.GetGeometryName()
-        if g.IsEmpty():
-            val = f"{geom_typ} EMPTY"
-        else:
-            val = f"{geom_typ}(...)"
-        del g
+        val = gpkg_geom_summary(val)
 
     val = "␀" if val is None else val
     return f"{prefix}{key:>40} = {val}"
 
 
+def _check_output_dir(output_path, dataset_count, suffix, option_name):
+    """
+    Checks the output path is suitable for writing a file per dataset - see diff_output_geojson.
+    If it's a directory, any files with the given suffix already in it are deleted.
+    """
+    if dataset_count > 1:
+        # output_path needs to be a directory
+        if not output_path:
+            raise click.BadParameter(
+                f"Need to specify a directory via --output for {option_name} with >1 dataset",
+                param_hint="--output",
+            )
+        elif output_path == "-" or output_path.is_file():
+            raise click.BadParameter(
+                f"A file is not valid for --output + {option_name} with >1 dataset",
+                param_hint="--output",
+            )
+
+        if not output_path.exists():
+            output_path.mkdir()
+        else:
+            for p in output_path.glob(f"*{suffix}"):
+                p.unlink()
+
+
+@contextlib.contextmanager
+def _open_dataset_output(output_path, dataset, suffix):
+    """Opens the file to write the given dataset's output to - see diff_output_geojson."""
+    if not output_path or output_path == "-":
+        yield sys.stdout
+        sys.stdout.flush()
+    elif isinstance(output_path, io.StringIO):
+        yield output_path
+    else:
+        if output_path.is_dir():
+            output_path = output_path / f"{dataset.table_name}{suffix}"
+        with output_path.open("w") as fp:
+            yield fp
+
+
+def _sample_feature_deltas(ds_diff, max_count):
+    """
+    Returns (total, feature_deltas) - the number of feature changes in the given DatasetDiff, and an iterator that
+    yields (key, delta) for at most max_count of them, sorted by key. If there are more than max_count changes,
+    an evenly spaced sample of them is yielded. Like _sorted_feature_deltas, each delta is released once consumed.
+    """
+    deltas = [delta for key, delta in _sorted_feature_deltas(ds_diff)]
+    total = len(deltas)
+    if total > max_count:
+        deltas = [deltas[(i * total) // max_count] for i in range(max_count)]
+    deltas.reverse()
+
+    def _iter_deltas():
+        while deltas:
+            delta = deltas.pop()
+            yield delta.key, delta
+
+    return total, _iter_deltas()
+
+
+def _geojson_features(feature_deltas, geometry_transform=None):
+    """
+    Yields a GeoJSON feature for each of the given (key, delta) feature changes - two features for an update,
+    one for the 'deleted' version of the feature, and one for the 'added' version.
+    """
+    for key, delta in feature_deltas:
+        if delta.old:
+            change_type = "U-" if delta.new else "D"
+            yield geojson_row(
+                delta.old.get_lazy_value(),
+                delta.old.key,
+                change_type,
+                geometry_transform=geometry_transform,
+            )
+        if delta.new:
+            change_type = "U+" if delta.old else "I"
+            yield geojson_row(
+                delta.new.get_lazy_value(),
+                delta.new.key,
+                change_type,
+                geometry_transform=geometry_transform,
+            )
+
+
+def _warn_meta_changes_not_included(diff, output_format):
+    for k in diff.get("meta", {}):
+        click.secho(
+            f"Warning: meta changes aren't included in {output_format} output: {k}",
+            fg="yellow",
+            file=sys.stderr,
+        )
+
+
 @contextlib.contextmanager
 def diff_output_geojson(
     *,
@@ -337,7 +444,7 @@ def diff_output_geojson(
     one for the 'deleted' version of the feature, and one for the 'added' version.
     This is intended for visualising in a map diff.
 
-    On exit, writes the diff as GeoJSON to the given output file.
+    Writes the diff of each dataset as GeoJSON to the given output file - each feature is written as it is generated.
     For repos with more than one dataset, the output path must be a directory.
     In that case:
         * any .geojson files already in that directory will be deleted
@@ -346,83 +453,59 @@ def diff_output_geojson(
     If the output file is stdout and isn't piped anywhere,
     the json is prettified before writing.
     """
-    if dataset_count > 1:
-        # output_path needs to be a directory
-        if not output_path:
-            raise click.BadParameter(
-                "Need to specify a directory via --output for --geojson with >1 dataset",
-                param_hint="--output",
-            )
-        elif output_path == "-" or output_path.is_file():
-            raise click.BadParameter(
-                "A file is not valid for --output + --geojson with >1 dataset",
-                param_hint="--output",
-            )
-
-        if not output_path.exists():
-            output_path.mkdir()
-        else:
-            for p in output_path.glob("*.geojson"):
-                p.unlink()
+    _check_output_dir(output_path, dataset_count, ".geojson", "--geojson")
 
     def _out(dataset, diff):
-        if not output_path or output_path == "-":
-            fp = sys.stdout
-        elif isinstance(output_path, io.StringIO):
-            fp = output_path
-        elif output_path.is_dir():
-            fp = (output_path / f"{dataset.table_name}.geojson").open("w")
-        else:
-            fp = output_path.open("w")
-
-        for k in diff.get("meta", {}):
-            click.secho(
-                f"Warning: meta changes aren't included in GeoJSON output: {k}",
-                fg="yellow",
-                file=sys.stderr,
-            )
-
-        features = []
+        _warn_meta_changes_not_included(diff, "GeoJSON")
         geometry_transform = dataset_geometry_transforms.get(dataset.path)
-        for key, delta in sorted(diff.get("feature", {}).items()):
-            if delta.old:
-                change_type = "U-" if delta.new else "D"
-                features.append(
-                    LazyGeojsonFeatureOutput(
-                        change_type, delta.old, geometry_transform=geometry_transform
-                    )
-                )
-            if delta.new:
-                change_type = "U+" if delta.old else "I"
-                features.append(
-                    LazyGeojsonFeatureOutput(
-                        change_type, delta.new, geometry_transform=geometry_transform
-                    )
-                )
-
-        fc = {"type": "FeatureCollection", "features": features}
-        dump_json_output(fc, fp, json_style=json_style)
+        fc = {
+            "type": "FeatureCollection",
+            "features": _geojson_features(
+                _sorted_feature_deltas(diff), geometry_transform
+            ),
+        }
+        with _open_dataset_output(output_path, dataset, ".geojson") as fp:
+            dump_json_output(fc, fp, json_style=json_style)
 
     yield _out
 
 
-class LazyGeojsonFeatureOutput:
-    """Wrapper of KeyValue that lazily serialises it as GEOJSON when sent to json.dumps"""
+@contextlib.contextmanager
+def diff_output_geojsonseq(
+    *,
+    output_path,
+    dataset_count,
+    json_style="pretty",
+    dataset_geometry_transforms=None,
+    **kwargs,
+):
+    """
+    Contextmanager.
 
-    __slots__ = ("change_type", "key_value", "geometry_transform")
+    Yields a callable which can be called with dataset diffs
+    (see `diff_output_text` docstring for more on that)
 
-    def __init__(self, change_type, key_value, geometry_transform=None):
-        self.change_type = change_type
-        self.key_value = key_value
-        self.geometry_transform = geometry_transform
+    Writes the same features as diff_output_geojson, but as newline-delimited GeoJSON (GeoJSONSeq) -
+    each feature on its own line, with no enclosing FeatureCollection - so the output can be read a feature at a time.
+    Features aren't sorted, so they are written as they are generated.
+    For repos with more than one dataset, the output path must be a directory, and files are written to
+    `{layer_name}.geojsonl` in that directory.
+    """
+    _check_output_dir(output_path, dataset_count, ".geojsonl", "--geojsonseq")
+    # Each feature is written on a single line.
+    if json_style == "pretty":
+        json_style = "compact"
 
-    def __json__(self):
-        return geojson_row(
-            self.key_value.get_lazy_value(),
-            self.key_value.key,
-            self.change_type,
-            geometry_transform=self.geometry_transform,
-        )
+    def _out(dataset, diff):
+        _warn_meta_changes_not_included(diff, "GeoJSONSeq")
+        geometry_transform = dataset_geometry_transforms.get(dataset.path)
+        with _open_dataset_output(output_path, dataset, ".geojsonl") as fp:
+            writer = JsonWriter(fp, json_style=json_style)
+            features = _geojson_features(_feature_deltas(diff), geometry_transform)
+            for feature in features:
+                fp.write(writer.encode(feature) + "\n")
+
+    yield _out
 
 
 def geojson_row(row, pk_value, change=None, geometry_transform=None):
@@ -460,9 +543,8 @@ def geojson_row(row, pk_value, change=None, geometry_transform=None):
 def diff_output_json(
     *,
     output_path,
-    dataset_count,
     json_style="pretty",
-    dump_function=dump_json_output,
+    extra_output=None,
     dataset_geometry_transforms=None,
     **kwargs,
 ):
@@ -471,7 +553,9 @@ def diff_output_json(
     Yields a callable which can be called with dataset diffs
     (see `diff_output_text` docstring for more on that)
 
-    On exit, writes the diff as JSON to the given output file.
+    Writes the diff as JSON to the given output file - each dataset is written when the callable is called,
+    and each feature as it is generated. On exit, the top-level items in extra_output (if any) are written
+    after the diff.
     If the output file is stdout and isn't piped anywhere,
     the json is prettified first.
     """
@@ -503,7 +587,11 @@ def diff_output_json(
             )
         return result
 
-    repo_result = {}
+    fp = resolve_output_path(output_path)
+    writer = JsonWriter(fp, json_style=json_style)
+    writer.begin_object()
+    writer.write_key("sno.diff/v1+hexwkb")
+    writer.begin_object()
 
     def _out(dataset, ds_diff):
         ds_result = {}
@@ -512,19 +600,27 @@ def diff_output_json(
                 key: prepare_meta_delta(delta)
                 for key, delta in sorted(ds_diff["meta"].items())
             }
-        if "feature" in ds_diff:
-            geometry_transform = dataset_geometry_transforms.get(dataset.path)
-            ds_result["feature"] = [
+        geometry_transform = dataset_geometry_transforms.get(dataset.path)
+        feature_deltas = _sorted_feature_deltas(ds_diff)
+        first_delta = next(feature_deltas, None)
+        if first_delta is not None:
+            ds_result["feature"] = (
                 prepare_feature_delta(delta, geometry_transform=geometry_transform)
-                for key, delta in sorted(ds_diff["feature"].items())
-            ]
-        repo_result[dataset.path] = ds_result
+                for key, delta in itertools.chain([first_delta], feature_deltas)
+            )
+        writer.write_key(dataset.path)
+        writer.write(ds_result)
 
     yield _out
 
-    dump_function(
-        {"sno.diff/v1+hexwkb": repo_result}, output_path, json_style=json_style
-    )
+    writer.end_object()
+    for key, value in (extra_output or {}).items():
+        writer.write_key(key)
+        writer.write(value)
+    writer.end_object()
+    fp.write("\n")
+    if fp is not output_path and fp is not sys.stdout:
+        fp.close()
 
 
 class LazyJsonFeatureOutput:
@@ -567,6 +663,16 @@ def json_row(row, pk_value, geometry_transform=None):
         yield k, v
 
 
+class _ScriptSafeWriter:
+    """Writes JSON to fp, escaping any "</" so that the JSON can't end the <script> element that it's written in."""
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, text):
+        self.fp.write(text.replace("</", "<\\/"))
+
+
 @contextlib.contextmanager
 def diff_output_html(
     *,
@@ -576,6 +682,7 @@ def diff_output_html(
     target,
     dataset_count,
     dataset_geometry_transforms=None,
+    html_max_features=None,
     **kwargs,
 ):
     """
@@ -583,8 +690,10 @@ def diff_output_html(
     Yields a callable which can be called with dataset diffs
     (see `diff_output_text` docstring for more on that)
 
-    On exit, writes an HTML diff to the given output file
-    (defaults to 'DIFF.html' in the repo directory).
+    Writes an HTML diff to the given output file (defaults to 'DIFF.html' in the repo directory) -
+    the features of each dataset are written into the page as GeoJSON as they are generated.
+    If a dataset has more than html_max_features changed features, an evenly spaced sample of them is shown.
+    On exit, opens the diff in a web browser.
 
     If `-` is given as the output file, the HTML is written to stdout,
     and no web browser is opened.
@@ -594,40 +703,36 @@ def diff_output_html(
             raise click.BadParameter(
                 "Directory is not valid for --output with --html", param_hint="--output"
             )
+    max_features = html_max_features or HTML_MAX_FEATURES
     with open(
         Path(__file__).resolve().with_name("diff-view.html"), "r", encoding="utf8"
     ) as ft:
-        template = string.Template(ft.read())
+        template_head, template_tail = ft.read().split("${geojson_data}")
 
     title = f"{Path(repo.path).name}: {base.short_id} .. {target.short_id if target else 'working-copy'}"
 
-    with tempfile.TemporaryDirectory() as tempdir:
-        tempdir = Path(tempdir)
-        # Write a bunch of geojson files to a temporary directory
-        with diff_output_geojson(
-            output_path=tempdir,
-            dataset_count=dataset_count,
-            json_style="extracompact",
-            dataset_geometry_transforms=dataset_geometry_transforms,
-        ) as json_writer:
-            yield json_writer
+    if not output_path:
+        output_path = Path(repo.path) / "DIFF.html"
+    fo = resolve_output_path(output_path)
+    fo.write(string.Template(template_head).substitute({"title": title}))
+    writer = JsonWriter(_ScriptSafeWriter(fo), json_style="extracompact")
+    writer.begin_object()
 
-        if not output_path:
-            output_path = Path(repo.path) / "DIFF.html"
-        fo = resolve_output_path(output_path)
-
-        # Read all the geojson back in, and stick them in a dict
-        all_datasets_geojson = {}
-        for filename in os.listdir(tempdir):
-            with open(tempdir / filename) as json_file:
-                all_datasets_geojson[os.path.splitext(filename)[0]] = json.load(
-                    json_file
-                )
-        fo.write(
-            template.substitute(
-                {"title": title, "geojson_data": json.dumps(all_datasets_geojson)}
-            )
-        )
+    def _out(dataset, diff):
+        _warn_meta_changes_not_included(diff, "HTML")
+        geometry_transform = dataset_geometry_transforms.get(dataset.path)
+        total, feature_deltas = _sample_feature_deltas(diff, max_features)
+        fc = {"type": "FeatureCollection"}
+        if total > max_features:
+            fc["sampled"] = {"count": max_features, "total": total}
+        fc["features"] = _geojson_features(feature_deltas, geometry_transform)
+        writer.write_key(dataset.table_name)
+        writer.write(fc)
+
+    yield _out
+
+    writer.end_object()
+    fo.write(string.Template(template_tail).substitute({"title": title}))
     if fo != sys.stdout:
         fo.close()
         webbrowser.open_new(f"file://{output_path.resolve()}")
@@ -314,6 +314,11 @@ class DeltaDiff(Diff):
         """Add the given delta at the appropriate key."""
         super().__setitem__(delta.key, delta)
 
+    def sorted_items(self):
+        """Yields (key, delta) for every delta, sorted by key."""
+        for key in sorted(self.keys()):
+            yield key, self[key]
+
     def __invert__(self):
         result = self.empty_copy()
         for key, delta in self.items():
@@ -352,11 +357,69 @@ class DeltaDiff(Diff):
         return result
 
 
+class DeltaStream:
+    """
+    A DeltaStream is a one-shot alternative to a DeltaDiff, for diffs that are too big to hold in memory.
+    It wraps an iterable of Deltas, which are generated only as they are consumed, and which are not kept
+    once they have been consumed - so, unlike a DeltaDiff, it can't be modified, concatenated or iterated twice.
+    """
+
+    def __init__(self, deltas):
+        self._deltas = iter(deltas)
+        self._count = 0
+
+    def __iter__(self):
+        for delta in self._deltas:
+            self._count += 1
+            yield delta
+
+    def items(self):
+        """
+        Yields (key, delta) for every delta, in the order they are generated - eg, tree order for a diff between
+        two trees. Each delta is generated only as it is consumed, so only one delta is held at a time.
+        """
+        for delta in self:
+            yield delta.key, delta
+
+    def sorted_items(self):
+        """
+        Yields (key, delta) for every delta, sorted by key.
+        Sorting means every Delta is generated up front - use items() where the order doesn't matter. Values which are promises - eg features read from the
+        repository - are only read as each delta is consumed, and each delta is released once consumed. But values
+        which were read when the Delta was generated are all held in memory until they are consumed - eg, working
+        copy diffs read each edited row to compare it to the repository, so every edited row is held at once.
+        """
+        deltas = sorted(self, key=lambda delta: delta.key, reverse=True)
+        while deltas:
+            delta = deltas.pop()
+            yield delta.key, delta
+
+    def count(self):
+        """
+        Returns the number of deltas in this stream. Any deltas that haven't been consumed yet are consumed
+        (but their values aren't read), so this should be called once the stream is no longer needed.
+        """
+        for delta in self:
+            pass
+        return self._count
+
+    def __repr__(self):
+        return f"DeltaStream(consumed={self._count})"
+
+
 class DatasetDiff(Diff):
-    """A DatasetDiff contains up to two DeltaDiffs, at keys "meta" or "feature"."""
+    """
+    A DatasetDiff contains up to two DeltaDiffs, at keys "meta" or "feature".
+    The feature changes may instead be a DeltaStream - such a DatasetDiff can only be written out, not modified.
+    """
 
     child_type = DeltaDiff
 
+    def ensure_child_type(self, key, value):
+        if key == "feature" and type(value) == DeltaStream:
+            return
+        super().ensure_child_type(key, value)
+
 
 class RepoDiff(Diff):
     """A RepoDiff contains zero or more DatasetDiffs (one for each dataset that has changes)."""
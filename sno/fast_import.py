@@ -1,6 +1,10 @@
+import io
+import itertools
 import logging
+import multiprocessing
 import subprocess
 import time
+from collections import deque
 from enum import Enum, auto
 
 import click
@@ -8,7 +12,10 @@ import pygit2
 
 from . import git_util
 from .exceptions import SubprocessError, InvalidOperation
+from .dataset2 import find_blobs_in_tree
 from .import_source import ImportSource
+from .progress import Progress
+from .schema import Schema
 from .structure import DatasetStructure, RepositoryStructure
 from .repository_version import get_repo_version, extra_blobs_for_version
 from .timestamps import minutes_to_tz_offset
@@ -16,6 +23,9 @@ from .timestamps import minutes_to_tz_offset
 
 L = logging.getLogger("sno.fast_import")
 
+# Number of features sent to a worker process at once when encoding features in parallel.
+ENCODE_CHUNK_SIZE = 5000
+
 
 class ReplaceExisting(Enum):
     # Don't replace any existing datasets.
@@ -42,6 +52,7 @@ def fast_import_tables(
     max_pack_size="2G",
     max_delta_depth=0,
     extra_cmd_args=(),
+    num_processes=1,
 ):
     """
     Imports all of the given sources as new datasets, and commit the result.
@@ -56,6 +67,8 @@ def fast_import_tables(
     max_pack_size - maximum size of pack files. Affects performance.
     max_delta_depth - maximum depth of delta-compression chains. Affects performance.
     extra_cmd_args - any extra args for the git-fast-import command.
+    num_processes - number of worker processes used to encode features. Source features are still read in this
+        process, and the encoded features are written to git-fast-import in the same order as they were read.
     """
 
     head_tree = None if replace_existing == ReplaceExisting.ALL else get_head_tree(repo)
@@ -78,6 +91,11 @@ def fast_import_tables(
                     f"Cannot import to {source.dest_path}/ - already exists in repository"
                 )
 
+    if num_processes > 1 and repo_version < 2:
+        raise InvalidOperation(
+            f"Importing using multiple processes is not supported for V{repo_version} datasets"
+        )
+
     cmd = [
         "git",
         "fast-import",
@@ -93,32 +111,40 @@ def fast_import_tables(
     if not quiet:
         click.echo("Starting git-fast-import...")
 
+    # Start any worker processes before git-fast-import, so they don't inherit its stdin pipe.
+    pool = multiprocessing.Pool(num_processes) if num_processes > 1 else None
+
     p = subprocess.Popen(cmd, cwd=repo.path, stdin=subprocess.PIPE,)
+    stream = _CountingWriter(p.stdin)
     try:
         if replace_existing != ReplaceExisting.ALL:
             header += f"from {get_head_branch(repo)}^0\n"
-        p.stdin.write(header.encode("utf8"))
+        stream.write(header.encode("utf8"))
 
         # Write any extra blobs supplied by the client or needed for this version.
-        for i, blob_path in write_blobs_to_stream(p.stdin, extra_blobs):
+        for i, blob_path in write_blobs_to_stream(stream, extra_blobs):
             if replace_existing != ReplaceExisting.ALL and blob_path in head_tree:
                 raise ValueError(f"{blob_path} already exists")
 
         for source in sources:
             replacing_dataset = None
             if replace_existing == ReplaceExisting.GIVEN:
-                # Delete the existing dataset, before we re-import it.
-                p.stdin.write(f"D {source.dest_path}\n".encode('utf8'))
-
                 try:
                     replacing_dataset = RepositoryStructure(repo)[source.dest_path]
                 except KeyError:
-                    pass
+                    # Delete anything that isn't a dataset, before we import over it.
+                    stream.write(f"D {source.dest_path}\n".encode('utf8'))
                 else:
-                    # We just deleted the legends, but we still need them to reimport
-                    # data efficiently. Copy them from the original dataset.
+                    # The existing dataset is updated incrementally - only the features that
+                    # have changed are written, and features that are no longer present are deleted.
+                    # The meta items are all rewritten, so delete those.
+                    meta_path = replacing_dataset.full_path(replacing_dataset.META_PATH)
+                    stream.write(f"D {meta_path.rstrip('/')}\n".encode('utf8'))
+
+                    # We just deleted the legends, but existing features still need them.
+                    # Copy them from the original dataset.
                     for x in write_blobs_to_stream(
-                        p.stdin, replacing_dataset.iter_legend_blob_data()
+                        stream, replacing_dataset.iter_legend_blob_data()
                     ):
                         pass
 
@@ -140,26 +166,62 @@ def fast_import_tables(
                     )
 
                 for x in write_blobs_to_stream(
-                    p.stdin, dataset.import_iter_meta_blobs(repo, source)
+                    stream, dataset.import_iter_meta_blobs(repo, source)
                 ):
                     pass
 
-                # features
-                t1 = time.monotonic()
-                src_iterator = source.features()
+                import_progress = Progress(
+                    "import",
+                    dataset=source.dest_path,
+                    total=num_rows,
+                    bytes_written=lambda: stream.bytes_written,
+                )
+                with import_progress:
+                    # features
+                    t1 = time.monotonic()
+                    src_iterator = source.features()
+                    if limit is not None:
+                        src_iterator = itertools.islice(src_iterator, limit)
+                    if not quiet:
+                        src_iterator = _iter_with_progress(src_iterator, t1)
+                    src_iterator = import_progress.iter(src_iterator)
+                    if replacing_dataset is not None:
+                        imported_pk_values = set()
+                        src_iterator = _iter_recording_pk_values(
+                            src_iterator, source.schema, imported_pk_values
+                        )
+
+                    if pool is None:
+                        for x in write_blobs_to_stream(
+                            stream,
+                            dataset.import_iter_feature_blobs(
+                                src_iterator,
+                                source,
+                                replacing_dataset=replacing_dataset,
+                            ),
+                        ):
+                            pass
+                    else:
+                        write_encoded_features_to_stream(
+                            stream,
+                            pool,
+                            repo,
+                            src_iterator,
+                            dataset,
+                            source.schema,
+                            replacing_dataset,
+                            max_pending_chunks=num_processes * 2,
+                        )
+
+                    if limit is not None and source.feature_count >= limit:
+                        click.secho(f"  Stopping at {limit:,d} features", fg="yellow")
 
-                for i, blob_path in write_blobs_to_stream(
-                    p.stdin,
-                    dataset.import_iter_feature_blobs(
-                        src_iterator, source, replacing_dataset=replacing_dataset
-                    ),
-                ):
-                    if i and i % 100000 == 0 and not quiet:
-                        click.echo(f"  {i:,d} features... @{time.monotonic()-t1:.1f}s")
+                    if replacing_dataset is not None:
+                        # Delete any existing features that weren't in the import.
+                        write_feature_deletes_to_stream(
+                            stream, replacing_dataset, imported_pk_values
+                        )
 
-                    if limit is not None and i == (limit - 1):
-                        click.secho(f"  Stopping at {limit:,d} features", fg="yellow")
-                        break
                 t2 = time.monotonic()
                 if not quiet:
                     click.echo(f"Added {num_rows:,d} Features to index in {t2-t1:.1f}s")
@@ -167,13 +229,17 @@ def fast_import_tables(
                         f"Overall rate: {(num_rows/(t2-t1 or 1E-3)):.0f} features/s)"
                     )
 
-        p.stdin.write(b"\ndone\n")
+        stream.write(b"\ndone\n")
     except BrokenPipeError:
         # if git-fast-import dies early, we get an EPIPE here
         # we'll deal with it below
         pass
     else:
         p.stdin.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
     p.wait()
     if p.returncode != 0:
         raise SubprocessError(
@@ -204,6 +270,18 @@ def get_head_branch(repo):
     return repo.head.name if not repo.is_empty else "refs/heads/master"
 
 
+class _CountingWriter:
+    """Wraps a binary stream, and counts the bytes written to it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.stream.write(data)
+
+
 def write_blobs_to_stream(stream, blobs):
     for i, (blob_path, blob_data) in enumerate(blobs):
         stream.write(
@@ -214,6 +292,117 @@ def write_blobs_to_stream(stream, blobs):
         yield i, blob_path
 
 
+def write_encoded_features_to_stream(
+    stream,
+    pool,
+    repo,
+    features,
+    dataset,
+    schema,
+    replacing_dataset=None,
+    *,
+    max_pending_chunks,
+):
+    """
+    Encodes features using the given pool of worker processes, and writes them to the stream as they are
+    encoded, in the same order as they were read. Features are sent to the workers in chunks, and only a few
+    chunks are in-flight at any time, so memory use is bounded no matter how many features there are.
+    """
+    worker_args = (
+        repo.path,
+        dataset.path,
+        schema.to_column_dicts(),
+        str(replacing_dataset.tree.id) if replacing_dataset is not None else None,
+    )
+
+    pending = deque()
+    for chunk in _chunked(features, ENCODE_CHUNK_SIZE):
+        pending.append(pool.apply_async(_encode_feature_chunk, (worker_args, chunk)))
+        if len(pending) >= max_pending_chunks:
+            stream.write(pending.popleft().get())
+    while pending:
+        stream.write(pending.popleft().get())
+
+
+def write_feature_deletes_to_stream(stream, dataset, keep_pk_values):
+    """
+    Writes a delete command for every feature in the dataset, except for those with pk values in keep_pk_values.
+    See _iter_recording_pk_values for how pk values are stored.
+    """
+    if dataset.FEATURE_PATH not in dataset.tree:
+        return
+    for blob in find_blobs_in_tree(dataset.feature_tree):
+        pk_values = dataset.decode_path_to_pks(blob.name)
+        key = pk_values[0] if len(pk_values) == 1 else tuple(pk_values)
+        if key not in keep_pk_values:
+            path = dataset.encode_pks_to_path(pk_values)
+            stream.write(f"D {path}\n".encode("utf8"))
+
+
+def _iter_with_progress(features, start_time):
+    for i, feature in enumerate(features):
+        if i and i % 100000 == 0:
+            click.echo(f"  {i:,d} features... @{time.monotonic()-start_time:.1f}s")
+        yield feature
+
+
+def _iter_recording_pk_values(features, schema, pk_values_set):
+    # Store the pk value itself when there is only one - a set of tuples uses a lot more memory.
+    pk_names = [c.name for c in schema.pk_columns]
+    if len(pk_names) == 1:
+        pk_name = pk_names[0]
+        for feature in features:
+            pk_values_set.add(feature[pk_name])
+            yield feature
+    else:
+        for feature in features:
+            pk_values_set.add(tuple(feature[n] for n in pk_names))
+            yield feature
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Per-worker-process state for _encode_feature_chunk, so it isn't recreated for every chunk.
+_worker_args = None
+_worker_state = None
+
+
+def _encode_feature_chunk(worker_args, features):
+    """
+    Runs in a worker process: encodes the given features and returns the git-fast-import commands to write them.
+    """
+    global _worker_args, _worker_state
+    if worker_args != _worker_args:
+        repo_path, dest_path, schema_dicts, replacing_tree_hex = worker_args
+        dataset_class = DatasetStructure.for_version(2)
+        replacing_dataset = None
+        if replacing_tree_hex is not None:
+            repo = pygit2.Repository(repo_path)
+            replacing_dataset = dataset_class(repo[replacing_tree_hex], dest_path)
+        dataset = dataset_class(tree=None, path=dest_path)
+        schema = Schema.from_column_dicts(schema_dicts)
+        _worker_args = worker_args
+        _worker_state = dataset, schema, replacing_dataset
+
+    dataset, schema, replacing_dataset = _worker_state
+    buf = io.BytesIO()
+    for x in write_blobs_to_stream(
+        buf,
+        dataset.encode_features_for_import(
+            features, schema, replacing_dataset=replacing_dataset
+        ),
+    ):
+        pass
+    return buf.getvalue()
+
+
 def generate_header(repo, sources, message):
     if message is None:
         message = generate_message(sources)
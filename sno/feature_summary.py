@@ -0,0 +1,189 @@
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+
+
+# Stored in the repository's git directory, alongside the git objects it summarises.
+SUMMARY_DB_PATH = Path("sno") / "feature_summary.db"
+
+FeatureSummary = namedtuple("FeatureSummary", ("count", "envelope", "shard_counts"))
+FeatureSummary.__doc__ = """
+A summary of the features in a dataset.
+count - the number of features.
+envelope - the 2D envelope of all the features' geometries, as (min_x, max_x, min_y, max_y),
+    or None if the dataset has no geometry column or no non-empty geometries.
+shard_counts - a dict of {top-level feature subtree name: number of features in that subtree}
+"""
+
+
+def get_feature_summary(repo, dataset):
+    """
+    Returns a FeatureSummary for the given dataset, or None if the dataset can't be summarised (ie, V1 datasets).
+    Summaries are stored in a sidecar database for every subtree of the feature tree, keyed by the subtree's ID.
+    Since most subtrees are unchanged from one commit to the next, summarising a new commit only means
+    reading the features in the few subtrees that have changed since the last summary.
+    """
+    if dataset.version < 2:
+        return None
+    with FeatureSummaryStore(repo) as store:
+        return store.summarise(dataset)
+
+
+def get_stored_feature_summary(repo, dataset):
+    """
+    Like get_feature_summary, but only returns a FeatureSummary if one is already stored for the dataset's feature
+    tree - otherwise, returns None rather than reading every feature to summarise it.
+    """
+    if dataset.version < 2 or not (Path(repo.path) / SUMMARY_DB_PATH).exists():
+        return None
+    with FeatureSummaryStore(repo) as store:
+        return store.summarise(dataset, stored_only=True)
+
+
+def store_feature_summaries(repo, dataset, tree_summaries):
+    """
+    Stores summaries of the dataset's feature tree and subtrees that were worked out while reading its features -
+    tree_summaries is a list of (tree, count, envelope), as made by Dataset2.features_batched.
+    """
+    if dataset.version < 2 or not tree_summaries:
+        return
+    with FeatureSummaryStore(repo) as store:
+        store.store(dataset, tree_summaries)
+
+
+def envelope_union(a, b):
+    """Returns the envelope that contains both of the envelopes a and b, either of which may be None."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+
+
+class FeatureSummaryStore:
+    def __init__(self, repo):
+        self.path = Path(repo.path) / SUMMARY_DB_PATH
+        self._db = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tree_summary (
+                tree_id TEXT NOT NULL,
+                geom_column_id TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                min_x REAL,
+                max_x REAL,
+                min_y REAL,
+                max_y REAL,
+                PRIMARY KEY (tree_id, geom_column_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        return self
+
+    def __exit__(self, *args):
+        self._db.close()
+        self._db = None
+
+    def summarise(self, dataset, stored_only=False):
+        """
+        Returns a FeatureSummary for the given dataset - or if stored_only is True, returns None
+        unless the summary is already stored.
+        """
+        if dataset.FEATURE_PATH not in dataset.tree:
+            return FeatureSummary(0, None, {})
+
+        geom_column_id = self._geom_column_id(dataset)
+        feature_tree = dataset.feature_tree
+
+        if stored_only:
+            stored = self._stored_summary(feature_tree, geom_column_id)
+            if stored is None:
+                return None
+            # Every subtree is stored along with the feature tree.
+            shard_counts = {
+                shard.name: self._stored_summary(shard, geom_column_id)[0]
+                for shard in feature_tree
+                if shard.type_str == "tree"
+            }
+            return FeatureSummary(*stored, shard_counts)
+
+        read_envelope = dataset.envelope_reader()
+        with self._db:
+            count, envelope = self._summarise_tree(
+                feature_tree, geom_column_id, read_envelope
+            )
+            shard_counts = {
+                shard.name: self._summarise_tree(shard, geom_column_id, read_envelope)[
+                    0
+                ]
+                for shard in feature_tree
+                if shard.type_str == "tree"
+            }
+        return FeatureSummary(count, envelope, shard_counts)
+
+    def store(self, dataset, tree_summaries):
+        """Stores (tree, count, envelope) for each of the given subtrees of the dataset's feature tree."""
+        geom_column_id = self._geom_column_id(dataset)
+        with self._db:
+            self._db.executemany(
+                """
+                INSERT OR REPLACE INTO tree_summary (tree_id, geom_column_id, count, min_x, max_x, min_y, max_y)
+                VALUES (?, ?, ?, ?, ?, ?, ?);
+                """,
+                [
+                    (str(tree.id), geom_column_id, count, *(envelope or (None,) * 4))
+                    for tree, count, envelope in tree_summaries
+                ],
+            )
+
+    @staticmethod
+    def _geom_column_id(dataset):
+        geom_columns = dataset.schema.geometry_columns
+        return geom_columns[0].id if geom_columns else ""
+
+    def _stored_summary(self, tree, geom_column_id):
+        """Returns the stored (count, envelope) for the given tree, or None if it hasn't been summarised."""
+        row = self._db.execute(
+            """
+            SELECT count, min_x, max_x, min_y, max_y FROM tree_summary
+            WHERE tree_id=? AND geom_column_id=?;
+            """,
+            (str(tree.id), geom_column_id),
+        ).fetchone()
+        if row is None:
+            return None
+        count, envelope = row[0], row[1:]
+        return count, (envelope if envelope[0] is not None else None)
+
+    def _summarise_tree(self, tree, geom_column_id, read_envelope):
+        """Returns (count, envelope) for the given tree, and stores it for next time."""
+        stored = self._stored_summary(tree, geom_column_id)
+        if stored is not None:
+            return stored
+
+        count = 0
+        envelope = None
+        for entry in tree:
+            if entry.type_str == "tree":
+                child_count, child_envelope = self._summarise_tree(
+                    entry, geom_column_id, read_envelope
+                )
+                count += child_count
+                envelope = envelope_union(envelope, child_envelope)
+            else:
+                count += 1
+                if read_envelope is not None:
+                    envelope = envelope_union(envelope, read_envelope(entry))
+
+        self._db.execute(
+            """
+            INSERT OR REPLACE INTO tree_summary (tree_id, geom_column_id, count, min_x, max_x, min_y, max_y)
+            VALUES (?, ?, ?, ?, ?, ?, ?);
+            """,
+            (str(tree.id), geom_column_id, count, *(envelope or (None,) * 4)),
+        )
+        return count, envelope
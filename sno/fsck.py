@@ -7,6 +7,7 @@ from osgeo import gdal
 
 from . import gpkg
 from .exceptions import NotFound, NO_WORKING_COPY
+from .feature_summary import get_feature_summary
 from .structure import RepositoryStructure
 
 
@@ -100,7 +101,11 @@ def fsck(ctx, reset_datasets, fsck_args):
             dbcur.execute(f"SELECT COUNT(*) FROM {gpkg.ident(table)};")
             wc_count = dbcur.fetchall()[0][0]
             click.echo(f"{wc_count} features in {table}")
-            ds_count = dataset.feature_count(fast=False)
+            summary = get_feature_summary(repo, dataset)
+            if summary is not None:
+                ds_count = summary.count
+            else:
+                ds_count = dataset.feature_count(fast=False)
             if wc_count != ds_count:
                 has_err = True
                 click.secho(
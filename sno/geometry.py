@@ -3,7 +3,11 @@ import json
 import math
 import struct
 
-from osgeo import ogr, osr
+from .wkb import WKB_POINT, WKB_TYPE_NAMES, read_wkb, read_wkb_type
+
+# GDAL is slow to load, and many commands only need the Geometry class - so osgeo is imported by the functions
+# that use it, rather than here. Most conversions are done by reading the WKB directly (see wkb.py), and only fall
+# back to OGR for geometries that can't be read that way.
 
 # http://www.geopackage.org/spec/#gpb_format
 _GPKG_EMPTY_BIT = 0b10000
@@ -55,6 +59,8 @@ def make_crs(crs_text):
     Accepted input is very flexible.
     see https://gdal.org/api/ogrspatialref.html#classOGRSpatialReference_1aec3c6a49533fe457ddc763d699ff8796
     """
+    from osgeo import osr
+
     crs = osr.SpatialReference()
     crs.SetFromUserInput(crs_text)
     crs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
@@ -99,18 +105,6 @@ def gpkg_envelope_size(flags):
         raise ValueError("Invalid envelope contents indicator")
 
 
-def _wkb_endianness_and_geometry_type(buf, wkb_offset=0):
-    """
-    Given a buffer containing some WKB at the given offset,
-    returns a two-tuple:
-        * is_little_endian (bool)
-        * WKB geometry type as an integer.
-    """
-    (is_le,) = struct.unpack_from('b', buf, offset=wkb_offset)
-    (typ,) = struct.unpack_from(f'{"<" if is_le else ">"}I', buf, offset=wkb_offset + 1)
-    return is_le, typ
-
-
 def _desired_gpkg_envelope_type(flags, wkb_buffer, wkb_offset=0):
     """
     Given some GPKG geometry flags and some WKB,
@@ -127,22 +121,17 @@ def _desired_gpkg_envelope_type(flags, wkb_buffer, wkb_offset=0):
         # no need to add envelopes to empties
         return GPKG_ENVELOPE_NONE
 
-    wkb_is_le, geom_type = _wkb_endianness_and_geometry_type(
-        wkb_buffer, wkb_offset=wkb_offset
-    )
-    flat_geom_type = ogr.GT_Flatten(geom_type)
-    if flat_geom_type == ogr.wkbPoint:
+    geom_type, has_z, has_m = read_wkb_type(wkb_buffer, wkb_offset)
+    if geom_type == WKB_POINT:
         # is this a point? if so, we don't *want* an envelope
         # it makes them significantly bigger (29 --> 61 bytes)
         # and is unnecessary - any optimisation that can use a bbox
         # can just trivially parse the point itself
         return GPKG_ENVELOPE_NONE
+    elif has_z:
+        return GPKG_ENVELOPE_XYZ
     else:
-        has_z = ogr.GT_HasZ(geom_type)
-        if has_z:
-            return GPKG_ENVELOPE_XYZ
-        else:
-            return GPKG_ENVELOPE_XY
+        return GPKG_ENVELOPE_XY
 
 
 def normalise_gpkg_geom(gpkg_geom):
@@ -162,18 +151,16 @@ def normalise_gpkg_geom(gpkg_geom):
 
     # http://www.geopackage.org/spec/#flags_layout
     is_le = bool(flags & _GPKG_LE_BIT) != 0
+    wkb_offset = 8 + gpkg_envelope_size(flags)
     if is_le:
-        envelope_size = gpkg_envelope_size(flags)
-
-        wkb_offset = 8 + envelope_size
-        wkb_is_le, geom_type = _wkb_endianness_and_geometry_type(
-            gpkg_geom, wkb_offset=wkb_offset
-        )
-        envelope_size = gpkg_envelope_size(flags)
-
-        want_envelope_type = _desired_gpkg_envelope_type(
-            flags, gpkg_geom, wkb_offset=8 + envelope_size
-        )
+        wkb_is_le = gpkg_geom[wkb_offset] == 1
+        try:
+            want_envelope_type = _desired_gpkg_envelope_type(
+                flags, gpkg_geom, wkb_offset=wkb_offset
+            )
+        except ValueError:
+            # Not a geometry type we know about - it's rewritten below.
+            pass
         envelope_type = (flags & _GPKG_ENVELOPE_BITS) >> 1
         if wkb_is_le and envelope_type == want_envelope_type:
             # everything is fine, no need to roundtrip via OGR
@@ -183,6 +170,11 @@ def normalise_gpkg_geom(gpkg_geom):
             else:
                 return Geometry.of(gpkg_geom[:4] + b'\x00\x00\x00\x00' + gpkg_geom[8:])
 
+    try:
+        return _wkb_to_gpkg_geom(gpkg_geom, wkb_offset)
+    except (ValueError, NotImplementedError):
+        pass
+
     # roundtrip it, the envelope and LE-ness are done by ogr_to_gpkg_geom
     return ogr_to_gpkg_geom(
         gpkg_geom_to_ogr(gpkg_geom, parse_crs=True),
@@ -206,6 +198,13 @@ def gpkg_geom_to_wkb(gpkg_geom):
 
     if wkb[0] == 0:
         # Force little-endian
+        try:
+            return read_wkb(gpkg_geom, wkb_offset, to_wkb=True).wkb
+        except (ValueError, NotImplementedError):
+            pass
+
+        from osgeo import ogr
+
         geom = ogr.CreateGeometryFromWkb(wkb)
         wkb = geom.ExportToIsoWkb(ogr.wkbNDR)
     return wkb
@@ -222,11 +221,27 @@ def gpkg_geom_to_hex_wkb(gpkg_geom):
         return binascii.hexlify(wkb).decode("ascii").upper()
 
 
+def gpkg_geom_summary(gpkg_geom):
+    """
+    Returns a short description of the given geometry, eg "MULTIPOLYGON(...)" or "POINT EMPTY".
+    """
+    flags = _validate_gpkg_geom(gpkg_geom)
+    try:
+        geom = read_wkb(gpkg_geom, 8 + gpkg_envelope_size(flags), envelope=True)
+        geom_typ, is_empty = WKB_TYPE_NAMES[geom.geometry_type], geom.envelope is None
+    except (ValueError, NotImplementedError):
+        ogr_geom = gpkg_geom_to_ogr(gpkg_geom)
+        geom_typ, is_empty = ogr_geom.GetGeometryName(), ogr_geom.IsEmpty()
+    return f"{geom_typ} EMPTY" if is_empty else f"{geom_typ}(...)"
+
+
 def gpkg_geom_to_ogr(gpkg_geom, parse_crs=False):
     """
     Parse GeoPackage geometry values to an OGR Geometry object
     http://www.geopackage.org/spec/#gpb_format
     """
+    from osgeo import ogr, osr
+
     if gpkg_geom is None:
         return None
 
@@ -252,7 +267,38 @@ def gpkg_geom_to_ogr(gpkg_geom, parse_crs=False):
     return geom
 
 
+def _wkb_to_gpkg_geom(buf, wkb_offset=0):
+    """
+    Constructs a normalised GPKG geometry value from the WKB at the given offset in buf, without using OGR -
+    the same as ogr_to_gpkg_geom(wkb_to_ogr(wkb)) would, for any geometry that can be read by read_wkb.
+    """
+    geom = read_wkb(buf, wkb_offset, to_wkb=True, envelope=True)
+    flags = _GPKG_LE_BIT
+    envelope = geom.envelope
+    if envelope is None:
+        flags |= _GPKG_EMPTY_BIT
+        envelope = ()
+    elif geom.geometry_type == WKB_POINT:
+        envelope = ()
+    elif len(envelope) == 6:
+        flags |= GPKG_ENVELOPE_XYZ << 1
+    else:
+        flags |= GPKG_ENVELOPE_XY << 1
+
+    header = struct.pack("<ccBBi", b"G", b"P", 0, flags, 0)
+    envelope = struct.pack(f"<{len(envelope)}d", *envelope)
+    return Geometry(header + envelope + geom.wkb)
+
+
 def wkb_to_gpkg_geom(wkb, **kwargs):
+    if not kwargs:
+        try:
+            return _wkb_to_gpkg_geom(wkb)
+        except (ValueError, NotImplementedError):
+            pass
+
+    from osgeo import ogr
+
     ogr_geom = ogr.CreateGeometryFromWkb(wkb)
     return ogr_to_gpkg_geom(ogr_geom, **kwargs)
 
@@ -266,6 +312,8 @@ def hex_wkb_to_gpkg_geom(hex_wkb, **kwargs):
 
 
 def wkb_to_ogr(wkb):
+    from osgeo import ogr
+
     return ogr.CreateGeometryFromWkb(wkb)
 
 
@@ -285,6 +333,8 @@ WKB_POINT_EMPTY_LE = b"\x01\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF8\x7F\x00\
 
 
 def ogr_to_hex_wkb(ogr_geom):
+    from osgeo import ogr
+
     wkb = ogr_geom.ExportToIsoWkb(ogr.wkbNDR)
     return binascii.hexlify(wkb).decode("ascii").upper()
 
@@ -308,6 +358,8 @@ def ogr_to_gpkg_geom(
 
     Underscore-prefixed kwargs are for use by the tests, don't use them elsewhere.
     """
+    from osgeo import ogr
+
     if ogr_geom is None:
         return None
 
@@ -349,6 +401,8 @@ def ogr_to_gpkg_geom(
 
 def geojson_to_gpkg_geom(geojson, **kwargs):
     """Given a GEOJSON geometry, construct a GPKG geometry value."""
+    from osgeo import ogr
+
     if not isinstance(geojson, str):
         json_ogr = json.dumps(geojson)
 
@@ -396,6 +450,12 @@ def geom_envelope(gpkg_geom):
 
     if envelope_typ == 0:
         # parse the full geometry then get it's envelope
+        try:
+            envelope = read_wkb(gpkg_geom, 8, envelope=True).envelope
+            return envelope[:4] if envelope is not None else None
+        except (ValueError, NotImplementedError):
+            pass
+
         ogr_geom = gpkg_geom_to_ogr(gpkg_geom)
         if ogr_geom.IsEmpty():
             # envelope is apparently (0, 0, 0, 0), thanks OGR :/
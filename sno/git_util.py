@@ -49,6 +49,87 @@ def replace_subtree(repo, root_tree, subpath, subtree_or_blob):
         return repo.get(builder.write())
 
 
+def build_tree(repo, root_tree, changes):
+    """
+    Given a root tree, creates a new root tree by applying the given changes -
+    a dict of {path: blob ID}, where a blob ID of None deletes that path.
+
+    Changes are grouped by directory, and each directory containing changes
+    (or containing a directory containing changes, etc) is written exactly once,
+    deepest directories first. If the containing dirs don't exist, they are created.
+
+    Returns the ID of the new root tree.
+    """
+    if not changes:
+        return root_tree.id
+    changes_by_dir = {}
+    for path, blob_id in changes.items():
+        dir_path, _, name = path.rpartition("/")
+        changes_by_dir.setdefault(dir_path, {})[name] = (
+            blob_id,
+            pygit2.GIT_FILEMODE_BLOB,
+        )
+    for dir_path in list(changes_by_dir):
+        while dir_path:
+            dir_path = dir_path.rpartition("/")[0]
+            changes_by_dir.setdefault(dir_path, {})
+
+    def depth(dir_path):
+        return dir_path.count("/") + 1 if dir_path else 0
+
+    for dir_path in sorted(changes_by_dir, key=depth, reverse=True):
+        if dir_path:
+            try:
+                orig_tree = root_tree / dir_path
+            except KeyError:
+                orig_tree = None
+        else:
+            orig_tree = root_tree
+        builder = (
+            repo.TreeBuilder(orig_tree) if orig_tree is not None else repo.TreeBuilder()
+        )
+        for name, (oid, filemode) in changes_by_dir[dir_path].items():
+            if oid is not None:
+                builder.insert(name, oid, filemode)
+            elif builder.get(name) is not None:
+                builder.remove(name)
+        tree_id = builder.write()
+        if not dir_path:
+            return tree_id
+        parent_path, _, name = dir_path.rpartition("/")
+        changes_by_dir[parent_path][name] = (tree_id, pygit2.GIT_FILEMODE_TREE)
+
+
+def blob_id_getter(tree, max_cached_trees=10000):
+    """
+    Returns a function that, given a path, returns the ID of the blob at that path in the given tree, or None.
+    Directories are kept once loaded, so that looking up many paths in the same directories is fast.
+    """
+    dir_trees = {}
+
+    def get_blob_id(path):
+        dir_path, _, name = path.rpartition("/")
+        try:
+            dir_tree = dir_trees[dir_path]
+        except KeyError:
+            if len(dir_trees) >= max_cached_trees:
+                dir_trees.clear()
+            try:
+                dir_tree = tree / dir_path if dir_path else tree
+            except KeyError:
+                dir_tree = None
+            if dir_tree is not None and dir_tree.type_str != "tree":
+                dir_tree = None
+            dir_trees[dir_path] = dir_tree
+
+        if dir_tree is None or name not in dir_tree:
+            return None
+        entry = dir_tree[name]
+        return entry.id if entry.type_str == "blob" else None
+
+    return get_blob_id
+
+
 _GIT_VAR_OUTPUT_RE = re.compile(
     r"^(?P<name>.*) <(?P<email>[^>]*)> (?P<time>\d+) (?P<offset>[+-]?\d+)$"
 )
@@ -1,8 +1,6 @@
 from datetime import datetime
 import re
 
-from osgeo.osr import SpatialReference
-
 from . import crs_util
 from .exceptions import NotYetImplemented
 from .meta_items import META_ITEM_NAMES as V2_META_ITEM_NAMES
@@ -203,6 +201,8 @@ def _gpkg_srs_id(v2_obj):
 
 def wkt_to_gpkg_spatial_ref_sys(wkt):
     """Given a WKT crs definition, generate a gpkg_spatial_ref_sys meta item."""
+    from osgeo.osr import SpatialReference
+
     # TODO: Better support for custom WKT. https://github.com/koordinates/sno/issues/148
     spatial_ref = SpatialReference(wkt)
     spatial_ref.AutoIdentifyEPSG()
@@ -227,11 +227,13 @@ def wkt_to_v2_name(wkt):
 
 def generate_sqlite_table_info(v2_obj):
     """Generate a sqlite_table_info meta item from a dataset."""
-    is_spatial = bool(v2_obj.schema.geometry_columns)
-    return [
-        _column_schema_to_gpkg(i, col, is_spatial)
-        for i, col in enumerate(v2_obj.schema)
-    ]
+    return schema_to_sqlite_table_info(v2_obj.schema)
+
+
+def schema_to_sqlite_table_info(schema):
+    """Generate a sqlite_table_info meta item from a v2 Schema."""
+    is_spatial = bool(schema.geometry_columns)
+    return [_column_schema_to_gpkg(i, col, is_spatial) for i, col in enumerate(schema)]
 
 
 def gpkg_to_v2_schema(
@@ -159,6 +159,14 @@ def temporary_branch(repo):
     type=click.INT,
     help="--depth option to git-fast-import (advanced users only)",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    "num_processes",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes to use for encoding features.",
+)
 def import_table(
     ctx,
     all_tables,
@@ -171,6 +179,7 @@ def import_table(
     table_info,
     replace_existing,
     max_delta_depth,
+    num_processes,
 ):
     """
     Import data into a repository.
@@ -258,6 +267,7 @@ def import_table(
             import_sources,
             message=message,
             max_delta_depth=max_delta_depth,
+            num_processes=num_processes,
             replace_existing=ReplaceExisting.GIVEN
             if replace_existing
             else ReplaceExisting.DONT_REPLACE,
@@ -313,8 +323,24 @@ def import_table(
     type=click.INT,
     help="--depth option to git-fast-import (advanced users only)",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    "num_processes",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes to use for encoding features.",
+)
 def init(
-    ctx, message, directory, repo_version, import_from, bare, wc_path, max_delta_depth,
+    ctx,
+    message,
+    directory,
+    repo_version,
+    import_from,
+    bare,
+    wc_path,
+    max_delta_depth,
+    num_processes,
 ):
     """
     Initialise a new repository and optionally import data.
@@ -347,7 +373,11 @@ def init(
 
     if import_from:
         fast_import_tables(
-            repo, sources, message=message, max_delta_depth=max_delta_depth,
+            repo,
+            sources,
+            message=message,
+            max_delta_depth=max_delta_depth,
+            num_processes=num_processes,
         )
         head_commit = repo.head.peel(pygit2.Commit)
         checkout.reset_wc_if_needed(repo, head_commit)
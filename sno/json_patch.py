@@ -0,0 +1,168 @@
+import codecs
+import json
+import re
+
+import click
+
+
+# JSON patches can be much bigger than the memory available - so, rather than loading the whole patch, it is
+# decoded a value at a time: keys, meta changes and each feature change are decoded using the json module,
+# and only the objects and arrays that contain them are walked here.
+
+_READ_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _invalid_patch(reason=None):
+    return click.FileError("Failed to parse JSON patch file", hint=reason)
+
+
+class JsonPatchReader:
+    """
+    Reads a JSON patch from fp, a binary file-like object - after head, the bytes (if any) that the caller has
+    already read from it. Same interface as BinaryPatchReader, but features have hex WKB geometries, and since the
+    "sno.patch/v1" metadata is usually written after the diff, it is only available once all the datasets have
+    been read. The meta changes to each dataset must come before its feature changes, as sno writes them.
+    """
+
+    def __init__(self, fp, head=b""):
+        self._fp = fp
+        self._utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._add_text(head)
+        self.metadata = None
+        if self._peek() != "{":
+            raise _invalid_patch("Invalid JSON")
+
+    def _add_text(self, data, final=False):
+        try:
+            text = self._utf8_decoder.decode(data, final=final)
+        except UnicodeDecodeError as e:
+            raise _invalid_patch(str(e)) from e
+        self._buf = self._buf[self._pos :] + text
+        self._pos = 0
+
+    def _fill(self, size=_READ_SIZE):
+        """Reads more of the patch into the buffer. Returns False if the whole patch has already been read."""
+        if self._eof:
+            return False
+        data = self._fp.read(size)
+        self._eof = not data
+        self._add_text(data, final=self._eof)
+        return True
+
+    def _peek(self):
+        """Skips any whitespace, and returns the next character - or "" at the end of the patch."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise _invalid_patch(f"Expected {char!r}")
+        self._pos += 1
+
+    def _read_value(self):
+        """Decodes the JSON value at the current position, reading more of the patch until it is complete."""
+        self._peek()
+        size = _READ_SIZE
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                end = None
+            # A value that ends at the end of the buffer could be cut short - eg, a number.
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            if not self._fill(size):
+                raise _invalid_patch("Invalid JSON")
+            size *= 2
+
+    def _object_keys(self):
+        """Yields each key of the object at the current position - the caller must read the value of each key."""
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self._read_value()
+            if not isinstance(key, str):
+                raise _invalid_patch("Expected a key")
+            self._expect(":")
+            yield key
+            separator = self._peek()
+            self._pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise _invalid_patch("Expected ',' or '}'")
+
+    def _array_items(self):
+        """Yields once for each item of the array at the current position - the caller must read each item."""
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            separator = self._peek()
+            self._pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise _invalid_patch("Expected ',' or ']'")
+
+    def datasets(self):
+        """
+        Yields (ds_path, meta_changes, feature_changes) for each dataset in the patch - see BinaryPatchReader.
+        Each dataset's feature_changes are skipped if they haven't been iterated over before the next dataset.
+        """
+        found_diff = False
+        for key in self._object_keys():
+            if key == "sno.diff/v1+hexwkb":
+                found_diff = True
+                yield from self._datasets()
+            elif key == "sno.patch/v1":
+                self.metadata = self._read_value()
+            else:
+                self._read_value()
+        if self._peek() != "":
+            raise _invalid_patch("Unexpected data after the patch")
+        if not found_diff:
+            raise _invalid_patch("No diff found")
+
+    def _datasets(self):
+        for ds_path in self._object_keys():
+            meta_changes = {}
+            feature_changes = None
+            for key in self._object_keys():
+                if key == "meta":
+                    if feature_changes is not None:
+                        raise _invalid_patch(
+                            f"Meta changes to {ds_path} come after its feature changes"
+                        )
+                    meta_changes = self._read_value()
+                elif key == "feature":
+                    feature_changes = self._feature_changes()
+                    yield ds_path, meta_changes, feature_changes
+                    for change in feature_changes:
+                        pass
+                else:
+                    self._read_value()
+            if feature_changes is None:
+                yield ds_path, meta_changes, iter(())
+
+    def _feature_changes(self):
+        for _ in self._array_items():
+            change = self._read_value()
+            if not isinstance(change, dict):
+                raise _invalid_patch("Expected a feature change")
+            yield change.get("-"), change.get("+")
@@ -114,34 +114,116 @@ class ExtendedJsonLexer(JsonLexer, ExtendedRegexLexer):
     pass
 
 
-def dump_json_output(output, output_path, json_style="pretty"):
+class JsonWriter:
     """
-    Dumps the output to JSON in the output file.
+    Writes JSON to a file-like object a piece at a time, formatted exactly as json.dumps would format the whole output.
+    Generators are written as lists, an item at a time as they are generated - so output starts straight away,
+    and the items don't all need to be held in memory at once. Objects can be written an item at a time too,
+    using begin_object(), write_key() and end_object().
+    Pretty JSON written to a terminal is syntax highlighted.
     """
-    fp = resolve_output_path(output_path)
 
-    highlit = json_style == "pretty" and fp == sys.stdout and fp.isatty()
-    json_encoder = ExtendedJsonEncoder(**JSON_PARAMS[json_style])
-    if highlit:
-        ex_json_lexer = ExtendedJsonLexer()
-        # The LexerContext stores the state of the lexer after each call to get_tokens_unprocessed
-        lexer_context = LexerContext("", 0)
-
-        for chunk in json_encoder.iterencode(output):
-            lexer_context.text = chunk
-            lexer_context.pos = 0
-            lexer_context.end = len(chunk)
-            token_generator = (
-                (token_type, value)
-                for (index, token_type, value) in ex_json_lexer.get_tokens_unprocessed(
-                    context=lexer_context
-                )
+    def __init__(self, fp, json_style="pretty"):
+        self.fp = fp
+        self.encoder = ExtendedJsonEncoder(**JSON_PARAMS[json_style])
+        indent = self.encoder.indent
+        self.indent = " " * indent if isinstance(indent, int) else indent
+        # For each object that is being written an item at a time - whether it has any items yet.
+        self._open_objects = []
+
+        self._lexer = None
+        if json_style == "pretty" and fp == sys.stdout and fp.isatty():
+            self._lexer = ExtendedJsonLexer()
+            # The LexerContext stores the state of the lexer after each call to get_tokens_unprocessed
+            self._lexer_context = LexerContext("", 0)
+
+    def _write(self, chunk):
+        if self._lexer is None:
+            self.fp.write(chunk)
+            return
+
+        lexer_context = self._lexer_context
+        lexer_context.text = chunk
+        lexer_context.pos = 0
+        lexer_context.end = len(chunk)
+        token_generator = (
+            (token_type, value)
+            for (index, token_type, value) in self._lexer.get_tokens_unprocessed(
+                context=lexer_context
             )
-            fp.write(pygments.format(token_generator, get_terminal_formatter()))
+        )
+        self.fp.write(pygments.format(token_generator, get_terminal_formatter()))
+
+    def _newline(self, level):
+        return "" if self.indent is None else "\n" + self.indent * level
+
+    def encode(self, obj, level=0):
+        """Encodes obj all at once - formatted as it would be at the given level of nesting."""
+        result = self.encoder.encode(obj)
+        if self.indent and level:
+            result = result.replace("\n", self._newline(level))
+        return result
+
+    def _encode_key(self, key):
+        if not isinstance(key, str):
+            # As json.dumps does for keys which are numbers, booleans or null.
+            key = self.encoder.encode(key)
+        return self.encoder.encode(key) + self.encoder.key_separator
+
+    def _iterencode(self, obj, level):
+        if isinstance(obj, dict):
+            items = ((self._encode_key(k), v) for k, v in obj.items())
+            yield from self._iterencode_items(items, level, "{", "}")
+        elif isinstance(obj, types.GeneratorType):
+            items = (("", v) for v in obj)
+            yield from self._iterencode_items(items, level, "[", "]")
+        else:
+            yield self.encode(obj, level)
+
+    def _iterencode_items(self, items, level, start, end):
+        yield start
+        has_items = False
+        for prefix, value in items:
+            separator = self.encoder.item_separator if has_items else ""
+            yield separator + self._newline(level + 1) + prefix
+            has_items = True
+            if prefix:
+                yield from self._iterencode(value, level + 1)
+            else:
+                # The items of a generator are each encoded all at once.
+                yield self.encode(value, level + 1)
+        yield (self._newline(level) if has_items else "") + end
+
+    def write(self, obj):
+        """Writes obj - either the whole output, or the value for the key that was just written."""
+        for chunk in self._iterencode(obj, len(self._open_objects)):
+            self._write(chunk)
+
+    def begin_object(self):
+        """Starts writing an object an item at a time - each item is written using write_key() and write()."""
+        self._write("{")
+        self._open_objects.append(False)
+
+    def write_key(self, key):
+        """Writes the key of the next item in the object that is being written."""
+        separator = self.encoder.item_separator if self._open_objects[-1] else ""
+        self._open_objects[-1] = True
+        newline = self._newline(len(self._open_objects))
+        self._write(separator + newline + self._encode_key(key))
+
+    def end_object(self):
+        has_items = self._open_objects.pop()
+        newline = self._newline(len(self._open_objects)) if has_items else ""
+        self._write(newline + "}")
 
-    else:
-        for chunk in json_encoder.iterencode(output):
-            fp.write(chunk)
+
+def dump_json_output(output, output_path, json_style="pretty"):
+    """
+    Dumps the output to JSON in the output file.
+    Any generators in the output are written an item at a time, as they are generated - see JsonWriter.
+    """
+    fp = resolve_output_path(output_path)
+    JsonWriter(fp, json_style).write(output)
     fp.write("\n")
 
 
@@ -164,6 +246,19 @@ def resolve_output_path(output_path):
         return output_path.open("w")
 
 
+def resolve_binary_output_path(output_path):
+    """
+    Same as resolve_output_path, but returns a file-like object for writing bytes.
+    A text file-like object is only accepted if it wraps a binary one, as sys.stdout does.
+    """
+    if hasattr(output_path, 'write'):
+        return getattr(output_path, 'buffer', output_path)
+    elif (not output_path) or output_path == "-":
+        return sys.stdout.buffer
+    else:
+        return output_path.open("wb")
+
+
 class InputMode:
     DEFAULT = 0
     INTERACTIVE = 1
@@ -0,0 +1,253 @@
+import contextlib
+import cProfile
+import functools
+import importlib
+import inspect
+import threading
+import time
+import tracemalloc
+
+import click
+
+
+# How many allocators to show with --trace-memory
+TOP_ALLOCATORS = 15
+# Memory use is sampled this often with --trace-memory, so we can show what was using memory at its peak.
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+# Methods that are called once per feature are too hot to instrument unless phase timing is turned on,
+# so they are wrapped only for the duration of a profiled command.
+# (module, class, method, phase)
+INSTRUMENTED_METHODS = (
+    ("sno.dataset1", "Dataset1", "repo_feature_to_dict", "blob decode"),
+    ("sno.dataset1", "Dataset1", "encode_feature", "blob encode"),
+    ("sno.dataset2", "Dataset2", "get_feature", "blob decode"),
+    ("sno.dataset2", "Dataset2", "_iter_feature_batches", "blob decode"),
+    ("sno.dataset2", "Dataset2", "encode_feature", "blob encode"),
+)
+
+# The PhaseTimer for the current command, or None if phases aren't being timed.
+_phase_timer = None
+
+
+class PhaseTimer:
+    """
+    Accumulates how much time is spent in each phase of a command - eg, diffing trees, decoding blobs.
+    Phases can be nested, and times are exclusive - time spent in an inner phase isn't also counted in the outer phase.
+    Each thread has its own stack of phases, so times spent in worker threads are counted too - which means
+    phase times can add up to more than the total time of the command.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.times = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def _accrue(self, name, elapsed, count=0):
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.0) + elapsed
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def enter(self, name):
+        now = time.perf_counter()
+        stack = self._stack()
+        if stack:
+            outer = stack[-1]
+            self._accrue(outer[0], now - outer[1])
+        stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        stack = self._stack()
+        name, resumed_at = stack.pop()
+        self._accrue(name, now - resumed_at, count=1)
+        if stack:
+            stack[-1][1] = now
+
+    def report(self):
+        total = time.perf_counter() - self.start_time
+        click.echo(f"Phase timings ({total:.3f}s total):", err=True)
+        for name, elapsed in sorted(self.times.items(), key=lambda t: -t[1]):
+            click.echo(
+                f"  {name:<16}{elapsed:10.3f}s{elapsed / (total or 1):8.1%}{self.counts[name]:12,d} calls",
+                err=True,
+            )
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Counts the time spent inside this context as being spent in the named phase - if phases are being timed."""
+    timer = _phase_timer
+    if timer is None:
+        yield
+        return
+    timer.enter(name)
+    try:
+        yield
+    finally:
+        timer.exit()
+
+
+def timed_iter(name, iterable):
+    """Iterates over iterable, counting the time spent getting each item as being spent in the named phase."""
+    timer = _phase_timer
+    if timer is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        timer.enter(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timer.exit()
+        yield item
+
+
+def _instrument(func, name):
+    if inspect.isgeneratorfunction(func):
+
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            return timed_iter(name, func(*args, **kwargs))
+
+    else:
+
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+
+    return _wrapper
+
+
+@contextlib.contextmanager
+def _instrumented_methods():
+    originals = []
+    for module_name, class_name, method_name, name in INSTRUMENTED_METHODS:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        func = cls.__dict__[method_name]
+        originals.append((cls, method_name, func))
+        setattr(cls, method_name, _instrument(func, name))
+    try:
+        yield
+    finally:
+        for cls, method_name, func in originals:
+            setattr(cls, method_name, func)
+
+
+@contextlib.contextmanager
+def time_phases():
+    """Times each phase for the duration of this context, and then shows a summary."""
+    global _phase_timer
+    _phase_timer = PhaseTimer()
+    try:
+        with _instrumented_methods():
+            yield
+    finally:
+        timer, _phase_timer = _phase_timer, None
+        timer.report()
+
+
+@contextlib.contextmanager
+def cprofile(path):
+    """Profiles the main thread for the duration of this context, and writes the stats to path."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        click.echo(
+            f"Wrote profile to {path} - view it using `python -m pstats {path}`",
+            err=True,
+        )
+
+
+class _MemorySampler(threading.Thread):
+    """Takes a tracemalloc snapshot whenever memory use is well above the size of the last snapshot."""
+
+    def __init__(self):
+        super().__init__(name="memory-sampler", daemon=True)
+        self.snapshot = None
+        self.snapshot_size = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(MEMORY_SAMPLE_INTERVAL):
+            self.sample(threshold=1.1)
+
+    def sample(self, threshold=1.0):
+        current, peak = tracemalloc.get_traced_memory()
+        if current > self.snapshot_size * threshold:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def memory_trace():
+    """
+    Traces memory allocations for the duration of this context, and then shows the peak memory use
+    and which lines had allocated the most memory when it was sampled closest to that peak.
+    """
+    tracemalloc.start()
+    sampler = _MemorySampler()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        sampler.sample()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = sampler.snapshot
+        tracemalloc.stop()
+
+        click.echo(
+            f"Memory: peak {peak / 2**20:.1f} MiB, {current / 2**20:.1f} MiB at exit",
+            err=True,
+        )
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            click.echo(
+                f"Top allocators at {sampler.snapshot_size / 2**20:.1f} MiB:", err=True
+            )
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATORS]:
+                frame = stat.traceback[0]
+                click.echo(
+                    f"  {stat.size / 2**10:12,.1f} KiB{stat.count:12,d} blocks  {frame.filename}:{frame.lineno}",
+                    err=True,
+                )
+
+
+@contextlib.contextmanager
+def profile_command(*, profile_path=None, timings=False, trace_memory=False):
+    """
+    Profiles a command according to the global --profile, --timings and --trace-memory options.
+    Reports are written to stderr once the command completes, even if it fails.
+    """
+    with contextlib.ExitStack() as stack:
+        if trace_memory:
+            stack.enter_context(memory_trace())
+        if timings or profile_path:
+            stack.enter_context(time_phases())
+        if profile_path:
+            stack.enter_context(cprofile(profile_path))
+        yield
@@ -0,0 +1,225 @@
+import contextlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+# How many items are processed between "progress" events, when iterating using Progress.iter
+EVENT_INTERVAL_ITEMS = 10000
+
+# Git reports its progress many times a second - these are translated into at most one event per interval (in seconds)
+GIT_EVENT_INTERVAL = 0.5
+
+# Matches git's progress reports, eg "Receiving objects:  45% (123/456), 1.20 MiB | 2.00 MiB/s"
+GIT_PROGRESS_PATTERN = re.compile(
+    r"^(?:remote: )?(?P<phase>[A-Za-z ]+):\s+\d+% \((?P<done>\d+)/(?P<total>\d+)\)"
+    r"(?:, (?P<size>[\d.]+) (?P<size_unit>bytes|KiB|MiB|GiB))?"
+)
+GIT_SIZE_UNITS = {"bytes": 1, "KiB": 2 ** 10, "MiB": 2 ** 20, "GiB": 2 ** 30}
+
+# Where JSON-lines progress events are written, or None if they aren't wanted (--progress-format=text).
+_event_stream = None
+
+
+def enabled():
+    """Whether progress events are being written - ie, --progress-format=jsonl was given."""
+    return _event_stream is not None
+
+
+def emit(event, **fields):
+    """
+    Writes a single progress event as a line of JSON - if progress events are enabled.
+    Fields which are None are left out.
+    """
+    stream = _event_stream
+    if stream is None:
+        return
+    record = {"event": event, "time": round(time.time(), 3)}
+    record.update((k, v) for k, v in fields.items() if v is not None)
+    stream.write(json.dumps(record) + "\n")
+    stream.flush()
+
+
+class Progress:
+    """
+    Reports the progress of one phase of a long operation - eg, writing one dataset to the working copy.
+    Used as a context manager, which emits a "start" event on entry and an "end" event on exit (or call start()
+    and end() explicitly), and a "progress" event each time update() is called. Does nothing if progress events aren't enabled.
+
+    Every event includes the phase, the dataset (if any), the number of items done so far, the total number
+    of items (if known), and the bytes written so far (if known, by calling bytes_written()).
+    "progress" events also include the rate - items per second since the previous event - and "end" events
+    include the overall rate.
+    """
+
+    def __init__(
+        self, phase, *, dataset=None, total=None, unit="features", bytes_written=None
+    ):
+        self.phase = phase
+        self.dataset = dataset
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self._bytes_written = bytes_written
+        self._initial_bytes = 0
+        self._start_time = None
+        self._last_time = None
+        self._last_done = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end(error=exc_type.__name__ if exc_type is not None else None)
+
+    def start(self):
+        """Emits a "start" event - called on entering the context."""
+        self._start_time = self._last_time = time.monotonic()
+        self._initial_bytes = self._get_bytes_written() or 0
+        self._emit("start")
+
+    def end(self, error=None):
+        """Emits an "end" event, including the name of the error that ended the phase, if any."""
+        self._emit("end", error=error)
+
+    def _get_bytes_written(self):
+        return self._bytes_written() if self._bytes_written is not None else None
+
+    def _emit(self, event, **fields):
+        if not enabled():
+            return
+        now = time.monotonic()
+        if event == "progress":
+            elapsed = now - self._last_time
+            fields["rate"] = round((self.done - self._last_done) / (elapsed or 1e-3), 1)
+        elif event == "end":
+            elapsed = now - self._start_time
+            fields["rate"] = round(self.done / (elapsed or 1e-3), 1)
+        self._last_time = now
+        self._last_done = self.done
+
+        bytes_written = self._get_bytes_written()
+        emit(
+            event,
+            phase=self.phase,
+            dataset=self.dataset,
+            unit=self.unit,
+            done=self.done,
+            total=self.total,
+            bytes=(
+                bytes_written - self._initial_bytes
+                if bytes_written is not None
+                else None
+            ),
+            elapsed=round(now - self._start_time, 3),
+            **fields,
+        )
+
+    def update(self, count):
+        """Records that count more items are done, and emits a "progress" event."""
+        self.done += count
+        self._emit("progress")
+
+    def iter(self, iterable, every=EVENT_INTERVAL_ITEMS):
+        """
+        Iterates over iterable, counting each item as done, and emitting a "progress" event every so often.
+        If progress events aren't enabled, iterable is returned as-is, so it costs nothing.
+        """
+        if not enabled():
+            return iterable
+        return self._iter(iterable, every)
+
+    def _iter(self, iterable, every):
+        pending = 0
+        for item in iterable:
+            yield item
+            pending += 1
+            if pending == every:
+                self.update(pending)
+                pending = 0
+        self.done += pending
+
+
+def check_call_git(args):
+    """
+    Like subprocess.check_call, for a git command which reports its progress to stderr (eg, git clone --progress).
+    If progress events are enabled, git's progress reports are translated into progress events - anything else
+    git writes to stderr is passed through.
+    """
+    if not enabled():
+        subprocess.check_call(args)
+        return
+
+    # Git ends progress reports with \r rather than \n - universal newlines mode splits lines on either.
+    p = subprocess.Popen(args, stderr=subprocess.PIPE, universal_newlines=True)
+    current = None
+    sizes = {}
+    try:
+        for line in p.stderr:
+            line = line.rstrip("\n")
+            match = GIT_PROGRESS_PATTERN.match(line)
+            if not match:
+                if line:
+                    sys.stderr.write(line + "\n")
+                continue
+
+            phase = match.group("phase").lower()
+            if match.group("size"):
+                sizes[phase] = int(
+                    float(match.group("size"))
+                    * GIT_SIZE_UNITS[match.group("size_unit")]
+                )
+            if current is None or current.phase != phase:
+                if current is not None:
+                    current.end()
+                current = Progress(
+                    phase,
+                    total=int(match.group("total")),
+                    unit="objects",
+                    bytes_written=lambda phase=phase: sizes.get(phase),
+                )
+                current.start()
+                last_event_time = 0
+
+            done = int(match.group("done"))
+            now = time.monotonic()
+            if done > current.done and now - last_event_time >= GIT_EVENT_INTERVAL:
+                current.update(done - current.done)
+                last_event_time = now
+            else:
+                current.done = done
+    finally:
+        if current is not None:
+            current.end()
+        p.wait()
+
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, args)
+
+
+@contextlib.contextmanager
+def progress_events(progress_format="text", progress_fd=None):
+    """
+    Enables progress events for the duration of this context, according to the global --progress-format and
+    --progress-fd options. Events are written to stderr, or to file descriptor progress_fd if given.
+    """
+    global _event_stream
+    if progress_format != "jsonl":
+        yield
+        return
+
+    if progress_fd is None:
+        stream = sys.stderr
+    else:
+        stream = os.fdopen(progress_fd, "w", buffering=1, closefd=False)
+    _event_stream = stream
+    try:
+        yield
+    finally:
+        _event_stream = None
+        if stream is not sys.stderr:
+            stream.close()
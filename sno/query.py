@@ -6,15 +6,36 @@ import time
 import click
 
 from . import structure
-from .exceptions import NotFound
+from .exceptions import InvalidOperation, NotFound
 from .output_util import dump_json_output
+from .spatial_index import get_spatial_index
 
 
 L = logging.getLogger("sno.query")
 
 
+def _parse_envelope(param, usage, allow_point=False):
+    """Parses X0,Y0,X1,Y1 (or X,Y if allow_point) to an envelope (min_x, max_x, min_y, max_y)"""
+    try:
+        coordinates = [float(c) for c in re.split(r"[ ,]", param)]
+    except ValueError:
+        raise click.BadParameter(usage)
+    if allow_point and len(coordinates) == 2:
+        coordinates *= 2
+    if len(coordinates) != 4:
+        raise click.BadParameter(usage)
+    x0, y0, x1, y1 = coordinates
+    return (min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1))
+
+
 @click.command("query", hidden=True)
 @click.pass_context
+@click.option(
+    "--ref",
+    default="HEAD",
+    help="Query the dataset as it is at the given commit or tree",
+    show_default=True,
+)
 @click.argument("path")
 @click.argument(
     "command",
@@ -22,30 +43,20 @@ L = logging.getLogger("sno.query")
     required=True,
 )
 @click.argument("params", nargs=-1, required=False)
-def query(ctx, path, command, params):
+def query(ctx, ref, path, command, params):
     """
     Find features in a Dataset
 
-    WARNING: Spatial indexing is a proof of concept.
-    Significantly, indexes don't update when the repo changes in any way.
+    Spatial indexes are created as needed, and stored in the repository. Each
+    index is specific to one version of the dataset - when a dataset changes, a
+    new index is created by updating the most recently used index.
     """
     repo = ctx.obj.repo
-    rs = structure.RepositoryStructure(repo)
-    dataset = rs[path]
-
-    if command == "index":
-        USAGE = "index"
-
-        t0 = time.monotonic()
-        dataset.build_spatial_index(dataset.table_name)
-        t1 = time.monotonic()
-        L.debug("Indexed {dataset} in %0.3fs", t1 - t0)
-        return
-
+    rs = structure.RepositoryStructure.lookup(repo, ref)
     try:
-        dataset.get_spatial_index(dataset.table_name)
-    except OSError:
-        raise NotFound("No spatial index found. Run `sno query {path} index`")
+        dataset = rs[path]
+    except KeyError:
+        raise NotFound(f"No dataset found at {path} in {ref}")
 
     if command == "get":
         USAGE = "get PK"
@@ -61,55 +72,61 @@ def query(ctx, path, command, params):
         t0 = time.monotonic()
         results = dataset.get_feature(lookup)
         t1 = time.monotonic()
+        L.debug("Results in %0.3fs", t1 - t0)
+        dump_json_output(results, sys.stdout)
+        return
 
-    elif command == "geo-nearest":
-        USAGE = "geo-nearest X0,Y0[,X1,Y1] [LIMIT]"
-        if len(params) < 1 or len(params) > 2:
-            raise click.BadParameter(USAGE)
-        elif len(params) > 1:
-            limit = int(params[1])
-        else:
-            limit = 1
+    if not dataset.has_geometry:
+        raise InvalidOperation(f"{path} has no geometry to index")
 
-        coordinates = [float(c) for c in re.split(r"[ ,]", params[0])]
-        if len(coordinates) not in (2, 4):
-            raise click.BadParameter(USAGE)
+    t0 = time.monotonic()
+    index = get_spatial_index(repo, dataset)
+    L.debug("Spatial index ready in %0.3fs", time.monotonic() - t0)
 
-        index = dataset.get_spatial_index(path)
-        t0 = time.monotonic()
-        results = [dataset.get_feature(pk) for pk in index.nearest(coordinates, limit)]
-        t1 = time.monotonic()
+    with index:
+        if command == "index":
+            click.echo(f"Indexed {index.count()} features ({index.bounds()})")
+            return
 
-    elif command == "geo-intersects":
-        USAGE = "geo-intersects X0,Y0,X1,Y1"
-        if len(params) != 1:
-            raise click.BadParameter(USAGE)
+        elif command == "geo-nearest":
+            USAGE = "geo-nearest X0,Y0[,X1,Y1] [LIMIT]"
+            if len(params) < 1 or len(params) > 2:
+                raise click.BadParameter(USAGE)
+            elif len(params) > 1:
+                limit = int(params[1])
+            else:
+                limit = 1
 
-        coordinates = [float(c) for c in re.split(r"[ ,]", params[0])]
-        if len(coordinates) != 4:
-            raise click.BadParameter(USAGE)
+            envelope = _parse_envelope(params[0], USAGE, allow_point=True)
 
-        index = dataset.get_spatial_index(path)
-        t0 = time.monotonic()
-        results = [dataset.get_feature(pk) for pk in index.intersection(coordinates)]
-        t1 = time.monotonic()
+            t0 = time.monotonic()
+            results = [dataset.get_feature(pk) for pk in index.nearest(envelope, limit)]
+            t1 = time.monotonic()
 
-    elif command == "geo-count":
-        USAGE = "geo-count X0,Y0,X1,Y1"
-        if len(params) != 1:
-            raise click.BadParameter(USAGE)
+        elif command == "geo-intersects":
+            USAGE = "geo-intersects X0,Y0,X1,Y1"
+            if len(params) != 1:
+                raise click.BadParameter(USAGE)
 
-        coordinates = [float(c) for c in re.split(r"[ ,]", params[0])]
-        if len(coordinates) != 4:
-            raise click.BadParameter(USAGE)
+            envelope = _parse_envelope(params[0], USAGE)
 
-        index = dataset.get_spatial_index(path)
-        t0 = time.monotonic()
-        results = index.count(coordinates)
-        t1 = time.monotonic()
+            t0 = time.monotonic()
+            results = [dataset.get_feature(pk) for pk in index.intersection(envelope)]
+            t1 = time.monotonic()
+
+        elif command == "geo-count":
+            USAGE = "geo-count X0,Y0,X1,Y1"
+            if len(params) != 1:
+                raise click.BadParameter(USAGE)
 
-    else:
-        raise NotImplementedError(f"Unknown command: {command}")
+            envelope = _parse_envelope(params[0], USAGE)
+
+            t0 = time.monotonic()
+            results = index.count(envelope)
+            t1 = time.monotonic()
+
+        else:
+            raise NotImplementedError(f"Unknown command: {command}")
 
     L.debug("Results in %0.3fs", t1 - t0)
     t2 = time.monotonic()
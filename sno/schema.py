@@ -1,5 +1,6 @@
 from collections import namedtuple
 import functools
+import operator
 import uuid
 
 from .serialise_util import (
@@ -40,6 +41,7 @@ class Legend:
         """
         self._pk_columns = tuple(pk_columns)
         self._non_pk_columns = tuple(non_pk_columns)
+        self._hexhash = None
 
     @property
     def pk_columns(self):
@@ -95,7 +97,83 @@ class Legend:
 
     def hexhash(self):
         """Like __hash__ but with platform-independent, 160-bit hex strings."""
-        return hexhash(self.dumps())
+        # Legends are immutable, so this only needs to be calculated once.
+        if self._hexhash is None:
+            self._hexhash = hexhash(self.dumps())
+        return self._hexhash
+
+
+def _tuple_getter(keys):
+    """Like operator.itemgetter(*keys), but always returns a tuple - even if there is only one key (or none)."""
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda obj: (obj[key],)
+    if not keys:
+        return lambda obj: ()
+    return operator.itemgetter(*keys)
+
+
+class RowCodec:
+    """
+    Converts rows between the form they are stored in - primary key values, plus a blob containing the legend hash
+    and the non primary key values - and the form they are used in, which is either a dict keyed by column name,
+    or a tuple in schema order. Equivalent to going via a "raw" dict (see Legend and Schema), but the positions of
+    each column are worked out once per (legend, schema) pair, rather than once per row.
+    Use Schema.row_codec to get one.
+    """
+
+    def __init__(self, legend, schema):
+        self.legend = legend
+        self.schema = schema
+        self.legend_hash = legend.hexhash()
+        self._names = tuple(c.name for c in schema.columns)
+
+        # Decoding: values are read from the pk values, then the non pk values, then a trailing None
+        # for any columns that are in the schema but not in the legend.
+        legend_ids = legend.pk_columns + legend.non_pk_columns
+        positions = {col_id: i for i, col_id in enumerate(legend_ids)}
+        self._decode = _tuple_getter(
+            [positions.get(c.id, len(legend_ids)) for c in schema.columns]
+        )
+
+        # Encoding: only possible if every column in the legend is in the schema.
+        schema_positions = {c.id: i for i, c in enumerate(schema.columns)}
+        self.can_encode = all(col_id in schema_positions for col_id in legend_ids)
+        if self.can_encode:
+            pk_positions = [schema_positions[c] for c in legend.pk_columns]
+            non_pk_positions = [schema_positions[c] for c in legend.non_pk_columns]
+            self._pks_by_position = _tuple_getter(pk_positions)
+            self._non_pks_by_position = _tuple_getter(non_pk_positions)
+            self._pks_by_name = _tuple_getter([self._names[i] for i in pk_positions])
+            self._non_pks_by_name = _tuple_getter(
+                [self._names[i] for i in non_pk_positions]
+            )
+
+    def decode(self, pk_values, non_pk_values, keys=True):
+        """
+        Given a feature's pk values and non pk values, as stored using this codec's legend, returns either
+        a dict of values keyed by column name (if keys=True) or a tuple of values in schema order (if keys=False).
+        """
+        values = self._decode([*pk_values, *non_pk_values, None])
+        return dict(zip(self._names, values)) if keys else values
+
+    def encode(self, feature):
+        """
+        Given a feature - either a dict of values keyed by column name (or a DB row that is subscriptable by name),
+        or a list / tuple of values in schema order - returns (pk_values, data) where data is the feature blob.
+        """
+        if not self.can_encode:
+            raise ValueError(
+                "Can't encode features using a legend that doesn't match the schema"
+            )
+        if isinstance(feature, dict) or hasattr(feature, "keys"):
+            pk_values = self._pks_by_name(feature)
+            non_pk_values = self._non_pks_by_name(feature)
+        else:
+            assert len(feature) == len(self._names)
+            pk_values = self._pks_by_position(feature)
+            non_pk_values = self._non_pks_by_position(feature)
+        return pk_values, msg_pack([self.legend_hash, non_pk_values])
 
 
 def pk_index_ordering(column):
@@ -203,6 +281,7 @@ class Schema:
             c for c in sorted(columns, key=pk_index_ordering) if c.pk_index is not None
         )
         self._hash = hash(self._columns)
+        self._row_codecs = {}
 
     @property
     def columns(self):
@@ -289,14 +368,25 @@ class Schema:
                 raw_dict[column.id] = value
         return raw_dict
 
+    def row_codec(self, legend=None):
+        """
+        Returns a RowCodec for converting between rows of this schema and rows stored using the given legend.
+        Defaults to this schema's own legend, which is the legend that new features are written with.
+        """
+        if legend is None:
+            legend = self._legend
+        try:
+            return self._row_codecs[legend]
+        except KeyError:
+            codec = self._row_codecs[legend] = RowCodec(legend, self)
+            return codec
+
     def encode_feature_blob(self, feature):
         """
         Given a feature, encodes it using this schema.
         Doesn't encode a path, so primary key values are not encoded.
         """
-        raw_dict = self.feature_to_raw_dict(feature)
-        pk_values, non_pk_values = self.legend.raw_dict_to_value_tuples(raw_dict)
-        data = msg_pack([self.legend.hexhash(), non_pk_values])
+        pk_values, data = self.row_codec().encode(feature)
         return data
 
     def _to_legend(self):
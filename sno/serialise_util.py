@@ -44,6 +44,24 @@ def msg_unpack(bytestring_or_memoryview):
     )
 
 
+def msg_packer():
+    """Returns a msgpack.Packer for packing many items in turn - packer.pack(data) -> bytes"""
+    return msgpack.Packer(
+        use_bin_type=True, strict_types=True, default=_msg_pack_default,
+    )
+
+
+def msg_unpacker():
+    """
+    Returns a msgpack.Unpacker for unpacking a stream of items - feed it bytes with unpacker.feed(bytestring),
+    then iterate over it to get the data (any type) that has been completely fed so far.
+    """
+    # Without max_buffer_size, older versions of msgpack limit each item to 1MiB.
+    return msgpack.Unpacker(
+        raw=False, ext_hook=_msg_unpack_ext_hook, max_buffer_size=2 ** 31 - 1,
+    )
+
+
 # json_pack and json_unpack have the same signature and capabilities as msg_pack and msg_unpack,
 # but their storage format is less compact and more human-readable.
 def json_pack(data):
@@ -0,0 +1,383 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import traceback
+from pathlib import Path
+
+import click
+import pygit2
+
+from .context import Context
+from .exceptions import InvalidOperation, NotYetImplemented, UNCATEGORIZED_ERROR
+from .repo_files import RepoState
+
+
+L = logging.getLogger("sno.serve")
+
+# Commands which are sent to the server, if one is running for the repository.
+SERVED_COMMANDS = ("status", "diff", "log", "query", "commit")
+
+# Set this environment variable to run commands in-process, even when a server is running.
+NO_SERVER_ENV = "SNO_NO_SERVER"
+
+# Environment variables which are sent to the server with each command - eg, GIT_AUTHOR_NAME etc, which set the
+# identity used by `commit`. The server runs the command with these instead of its own.
+FORWARDED_ENV_PREFIXES = ("GIT_", "SNO_")
+FORWARDED_ENV_NAMES = ("EMAIL",)
+
+# Output is sent back to the client in chunks of at most this many bytes, as it is written.
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
+# The types of the frames which make up a response - see SnoServer.
+FRAME_STDOUT = b"o"
+FRAME_STDERR = b"e"
+FRAME_EXIT_CODE = b"x"
+_FRAME_HEADER = struct.Struct(">cI")
+
+
+def get_socket_path(repo_path):
+    """The path of the socket of the server for the repository at repo_path."""
+    return Path(repo_path) / "sno" / "serve.sock"
+
+
+class ServeContext(Context):
+    """
+    The context object for commands run by the server.
+    The repository is opened once, and reused by every command.
+    """
+
+    def __init__(self, repo):
+        super().__init__()
+        self._repo = repo
+
+
+def _is_forwarded_env(name):
+    return name.startswith(FORWARDED_ENV_PREFIXES) or name in FORWARDED_ENV_NAMES
+
+
+@contextlib.contextmanager
+def _client_environ(env):
+    """Replaces this process's forwarded environment variables with the client's, for the duration of a command."""
+    orig_environ = os.environ.copy()
+    for name in list(os.environ):
+        if _is_forwarded_env(name) and name not in env:
+            del os.environ[name]
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(orig_environ)
+
+
+class _Response:
+    """Writes the frames of a response to a request - see SnoServer."""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()
+
+    def write_frame(self, frame_type, data):
+        with self._lock:
+            self._wfile.write(_FRAME_HEADER.pack(frame_type, len(data)))
+            self._wfile.write(data)
+            self._wfile.flush()
+
+    def write_exit_code(self, exit_code):
+        self.write_frame(FRAME_EXIT_CODE, str(exit_code).encode("ascii"))
+
+
+class _ResponseOutput(io.RawIOBase):
+    """Sends everything written to it to the client, as frames of the given type."""
+
+    def __init__(self, response, frame_type):
+        self._response = response
+        self._frame_type = frame_type
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = bytes(b)
+        for i in range(0, len(data), OUTPUT_CHUNK_SIZE):
+            self._response.write_frame(
+                self._frame_type, data[i : i + OUTPUT_CHUNK_SIZE]
+            )
+        return len(data)
+
+
+class _ServedOutput(io.TextIOWrapper):
+    """
+    The stdout or stderr of a command run by the server - output is sent to the client in chunks as it is written,
+    rather than being held until the command finishes. Reports itself as a terminal if the client's output is one.
+    """
+
+    def __init__(self, response, frame_type, isatty=False, line_buffering=False):
+        super().__init__(
+            io.BufferedWriter(
+                _ResponseOutput(response, frame_type), buffer_size=OUTPUT_CHUNK_SIZE
+            ),
+            encoding="utf-8",
+            line_buffering=line_buffering,
+        )
+        self._isatty = isatty
+
+    def isatty(self):
+        return self._isatty
+
+    def close_quietly(self):
+        """Sends any remaining output - unless the client has gone away, in which case it is dropped."""
+        try:
+            self.close()
+        except (OSError, ValueError):
+            pass
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        response = _Response(self.wfile)
+        exit_code = self.server.sno_server.run_command(
+            request["args"],
+            request["cwd"],
+            response,
+            isatty=request.get("isatty", False),
+            env=request.get("env", {}),
+            stdin=request.get("stdin"),
+        )
+        with contextlib.suppress(OSError):
+            response.write_exit_code(exit_code)
+
+
+class SnoServer:
+    """
+    Serves requests to run sno commands for a single repository, over a Unix domain socket.
+    Each request is a single line of JSON: {"args": [...], "cwd": "...", "isatty": false, "env": {...}, "stdin": "..."}
+    - env has the client's forwarded environment variables, and stdin is the client's input, if the command reads it.
+    Each response is a series of frames, each of which is a type byte, a 4-byte big-endian length, and then that
+    many bytes - FRAME_STDOUT and FRAME_STDERR frames as the command writes its output, and then one FRAME_EXIT_CODE.
+
+    Commands run in this process, one at a time. The repository stays open between commands, as do the working
+    copy's database connections - and all the schemas, legends etc that have been decoded so far stay cached.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.socket_path = get_socket_path(repo.path)
+        if self.socket_path.exists():
+            if _connect(self.socket_path) is not None:
+                raise InvalidOperation(
+                    f"A server is already running for this repository: {self.socket_path}"
+                )
+            # Left over from a server which didn't shut down cleanly.
+            self.socket_path.unlink()
+        self.socket_path.parent.mkdir(exist_ok=True)
+        self._server = socketserver.UnixStreamServer(
+            str(self.socket_path), _RequestHandler
+        )
+        self._server.sno_server = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """Stops serve_forever - must be called from another thread."""
+        self._server.shutdown()
+
+    def close(self):
+        self._server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            self.socket_path.unlink()
+
+    def run_command(self, args, cwd, response, *, isatty=False, env=None, stdin=None):
+        """
+        Runs the command given by args in this process, with the client's environment variables and input,
+        writes its output to response as it runs, and returns its exit code.
+        """
+        from .cli import cli
+
+        stdout = _ServedOutput(response, FRAME_STDOUT, isatty=isatty)
+        stderr = _ServedOutput(response, FRAME_STDERR, line_buffering=True)
+        orig_cwd = os.getcwd()
+        orig_streams = sys.stdin, sys.stdout, sys.stderr
+        try:
+            os.chdir(cwd)
+            sys.stdin, sys.stdout, sys.stderr = io.StringIO(stdin or ""), stdout, stderr
+            with _client_environ(env or {}):
+                cli.main(
+                    args=["-C", self.repo.path] + list(args),
+                    prog_name="sno",
+                    obj=ServeContext(self.repo),
+                )
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                exit_code = e.code or 0
+            else:
+                exit_code = 1
+        except Exception:
+            with contextlib.suppress(OSError, ValueError):
+                traceback.print_exc(file=stderr)
+            exit_code = UNCATEGORIZED_ERROR
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = orig_streams
+            os.chdir(orig_cwd)
+            stdout.close_quietly()
+            stderr.close_quietly()
+
+        L.info("%s: exit code %s", " ".join(args), exit_code)
+        return exit_code
+
+
+def _connect(socket_path):
+    """Connects to the server at socket_path, or returns None if there isn't one running there."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(socket_path))
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def _reads_stdin(args):
+    """Whether the command given by args reads from stdin - of the served commands, only `commit -m -` does."""
+    if args[0] != "commit":
+        return False
+    messages = []
+    args_iter = iter(args[1:])
+    for arg in args_iter:
+        if arg in ("-m", "--message"):
+            messages.append(next(args_iter, None))
+        elif arg.startswith("--message="):
+            messages.append(arg[len("--message=") :])
+        elif arg.startswith("-m"):
+            messages.append(arg[2:])
+    return any(m in ("-", "@-") for m in messages)
+
+
+def _read_response(f, outputs):
+    """
+    Writes the output of the command from the server's response to outputs - {frame type: binary stream} - as it
+    arrives, and returns its exit code - or None, if the server went away before the command wrote anything.
+    """
+    has_output = False
+    while True:
+        header = f.read(_FRAME_HEADER.size)
+        if len(header) < _FRAME_HEADER.size:
+            break
+        frame_type, size = _FRAME_HEADER.unpack(header)
+        data = f.read(size)
+        if len(data) < size:
+            break
+        if frame_type == FRAME_EXIT_CODE:
+            return int(data)
+        output = outputs[frame_type]
+        output.write(data)
+        output.flush()
+        has_output = True
+
+    if not has_output:
+        return None
+    raise InvalidOperation("Lost connection to the server while running the command")
+
+
+def run_using_server(ctx):
+    """
+    If the command being invoked is one that can be served and a server is running for the repository,
+    sends the command to the server, writes its output, and returns its exit code.
+    Otherwise, returns None - the command should be run as usual.
+    """
+    if not hasattr(socket, "AF_UNIX") or NO_SERVER_ENV in os.environ:
+        return None
+    if isinstance(ctx.obj, ServeContext) or not ctx.protected_args:
+        return None
+    if ctx.protected_args[0] not in SERVED_COMMANDS:
+        return None
+    # Commands with options that affect this process - eg profiling - are always run in this process.
+    global_options = {k: v for k, v in ctx.params.items() if k != "repo_dir"}
+    if any(v not in (None, False, 0, "text") for v in global_options.values()):
+        return None
+    args = ctx.protected_args + ctx.args
+    if args[0] == "commit" and not any(a.startswith(("-m", "--message")) for a in args):
+        # Committing without a message opens an editor, which can only be done here.
+        return None
+
+    repo_path = pygit2.discover_repository(ctx.params.get("repo_dir") or os.getcwd())
+    if repo_path is None:
+        return None
+    client = _connect(get_socket_path(repo_path))
+    if client is None:
+        return None
+
+    request = {
+        "args": args,
+        "cwd": os.getcwd(),
+        "isatty": sys.stdout.isatty(),
+        "env": {k: v for k, v in os.environ.items() if _is_forwarded_env(k)},
+        "stdin": sys.stdin.read() if _reads_stdin(args) else None,
+    }
+    outputs = {
+        FRAME_STDOUT: click.get_binary_stream("stdout"),
+        FRAME_STDERR: click.get_binary_stream("stderr"),
+    }
+    with client, client.makefile("rwb") as f:
+        f.write(json.dumps(request).encode("utf-8") + b"\n")
+        f.flush()
+        exit_code = _read_response(f, outputs)
+    if exit_code is None and request["stdin"] is not None:
+        # The server went away without running the command, so it's run here instead - with the input already read.
+        sys.stdin = io.StringIO(request["stdin"])
+    return exit_code
+
+
+@click.command()
+@click.pass_context
+def serve(ctx):
+    """
+    Serve commands for this repository from a long-running process.
+
+    While the server is running, the status, diff, log, query and commit commands for this repository are sent to
+    it, and run without having to start up, open the repository and working copy, or decode dataset schemas each
+    time - which is much faster when these commands are run often, eg by editor integrations.
+    The server listens on a Unix domain socket at sno/serve.sock in the repository. Stop it with Ctrl+C.
+    Set SNO_NO_SERVER=1 to run commands without using a server.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise NotYetImplemented("Sorry, `sno serve` is not supported on this platform")
+
+    repo = ctx.obj.get_repo(allowed_states=RepoState.ALL_STATES)
+
+    from .working_copy import keep_connections_open
+
+    # Commands which run other programs must not replace the server process.
+    os.environ["_SNO_NO_EXEC"] = "1"
+    keep_connections_open()
+    try:
+        server = SnoServer(repo)
+    except OSError as e:
+        raise InvalidOperation(f"Couldn't start server: {e}")
+
+    click.echo(f"Serving {repo.path} on {server.socket_path}")
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    click.echo("Server stopped")
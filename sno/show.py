@@ -1,10 +1,14 @@
 import contextlib
+import functools
 from datetime import datetime, timezone, timedelta
+from pathlib import Path
 
 import click
 
+from .binary_patch import BinaryPatchWriter
+from .diff_output import _feature_deltas
 from .repo_files import RepoState
-from .output_util import dump_json_output, resolve_output_path
+from .output_util import resolve_binary_output_path, resolve_output_path
 from .structs import CommitWithReference
 from .timestamps import datetime_to_iso8601_utc, timedelta_to_iso8601_tz
 from . import diff
@@ -72,24 +76,55 @@ def show(ctx, *, refish, output_format, crs, json_style, **kwargs):
 
 @click.command(name='create-patch')
 @click.pass_context
+@click.option(
+    "--output-format",
+    "-o",
+    type=click.Choice(["json", "msgpack"]),
+    default="json",
+    help=(
+        "Output format. 'msgpack' writes a binary patch, which is much smaller and faster to apply, "
+        "but isn't human-readable"
+    ),
+)
 @click.option(
     "--json-style",
     type=click.Choice(["extracompact", "compact", "pretty"]),
     default="pretty",
-    help="How to format the output",
+    help="How to format the output. Only used with --output-format=json",
+)
+@click.option(
+    "--zstd",
+    is_flag=True,
+    help=(
+        "Compress the patch with zstd. Only used with --output-format=msgpack. "
+        "Needs the zstandard Python package"
+    ),
+)
+@click.option(
+    "--output",
+    "output_path",
+    help="Output to a specific file instead of stdout.",
+    type=click.Path(writable=True, allow_dash=True),
 )
 # NOTE: this is *required* for now.
 # A future version might create patches from working-copy changes.
 @click.argument("refish")
-def create_patch(ctx, *, refish, json_style, **kwargs):
+def create_patch(
+    ctx, *, refish, output_format, json_style, zstd, output_path, **kwargs
+):
     """
-    Creates a JSON patch from the given ref.
+    Creates a JSON or binary patch from the given ref.
     The patch can be applied with `sno apply`.
     """
+    if output_format == "msgpack":
+        patch_writer = functools.partial(patch_output_msgpack, compress=zstd)
+    else:
+        patch_writer = patch_output
     parent = _get_parent(ctx, refish)
     return diff.diff_with_writer(
         ctx,
-        patch_output,
+        patch_writer,
+        output_path=output_path or "-",
         exit_code=False,
         commit_spec=f"{parent}...{refish}",
         filters=[],
@@ -141,6 +176,20 @@ def show_output_text(*, target, output_path, **kwargs):
         yield diff_writer
 
 
+def _commit_metadata(commit):
+    """The author and message of the given commit, as written in the output of show and create-patch."""
+    author = commit.author
+    author_time = datetime.fromtimestamp(author.time, timezone.utc)
+    author_time_offset = timedelta(minutes=author.offset)
+    return {
+        'authorName': author.name,
+        'authorEmail': author.email,
+        "authorTime": datetime_to_iso8601_utc(author_time),
+        "authorTimeOffset": timedelta_to_iso8601_tz(author_time_offset),
+        "message": commit.message,
+    }
+
+
 @contextlib.contextmanager
 def show_output_json(*, target, output_path, json_style, **kwargs):
     """
@@ -166,25 +215,12 @@ def show_output_json(*, target, output_path, json_style, **kwargs):
     authorTime is always returned in UTC, in Z-suffixed ISO8601 format.
     """
 
-    commit = target.head_commit
-    author = commit.author
-    author_time = datetime.fromtimestamp(author.time, timezone.utc)
-    author_time_offset = timedelta(minutes=author.offset)
-
-    def dump_function(data, *args, **kwargs):
-        data['sno.show/v1'] = {
-            'authorName': author.name,
-            'authorEmail': author.email,
-            "authorTime": datetime_to_iso8601_utc(author_time),
-            "authorTimeOffset": timedelta_to_iso8601_tz(author_time_offset),
-            "message": commit.message,
-        }
-        dump_json_output(data, *args, **kwargs)
+    extra_output = {'sno.show/v1': _commit_metadata(target.head_commit)}
 
     with diff.diff_output_json(
         output_path=output_path,
         json_style=json_style,
-        dump_function=dump_function,
+        extra_output=extra_output,
         **kwargs,
     ) as diff_writer:
         yield diff_writer
@@ -198,25 +234,47 @@ def patch_output(*, target, output_path, json_style, **kwargs):
     This is duplicated for clarity, because all this diff callback stuff is complex enough.
     """
 
-    commit = target.head_commit
-    author = commit.author
-    author_time = datetime.fromtimestamp(author.time, timezone.utc)
-    author_time_offset = timedelta(minutes=author.offset)
-
-    def dump_function(data, *args, **kwargs):
-        data['sno.patch/v1'] = {
-            'authorName': author.name,
-            'authorEmail': author.email,
-            "authorTime": datetime_to_iso8601_utc(author_time),
-            "authorTimeOffset": timedelta_to_iso8601_tz(author_time_offset),
-            "message": commit.message,
-        }
-        dump_json_output(data, *args, **kwargs)
+    extra_output = {'sno.patch/v1': _commit_metadata(target.head_commit)}
 
     with diff.diff_output_json(
         output_path=output_path,
         json_style=json_style,
-        dump_function=dump_function,
+        extra_output=extra_output,
         **kwargs,
     ) as diff_writer:
         yield diff_writer
+
+
+@contextlib.contextmanager
+def patch_output_msgpack(*, target, output_path, compress=False, **kwargs):
+    """
+    Contextmanager.
+
+    Same arguments and usage as `show_output_text`; see that docstring for usage.
+
+    Writes a binary patch to the given output file - see `sno.binary_patch` for the format.
+    It contains the same changes and `sno.patch/v1` metadata as the JSON patch written by `patch_output`,
+    and is written a feature at a time - features aren't sorted, so they are written as they are generated.
+    If compress is True, the patch is compressed with zstd.
+    """
+    if isinstance(output_path, Path):
+        if output_path.is_dir():
+            raise click.BadParameter(
+                "Directory is not valid for --output with --output-format=msgpack",
+                param_hint="--output",
+            )
+
+    fp = resolve_binary_output_path(output_path)
+    writer = BinaryPatchWriter(
+        fp, _commit_metadata(target.head_commit), compress=compress
+    )
+
+    def _out(dataset, ds_diff):
+        meta_deltas = sorted(ds_diff["meta"].items()) if "meta" in ds_diff else []
+        writer.write_dataset_diff(dataset.path, meta_deltas, _feature_deltas(ds_diff))
+
+    yield _out
+
+    writer.close()
+    if isinstance(output_path, Path):
+        fp.close()
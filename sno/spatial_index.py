@@ -0,0 +1,344 @@
+import contextlib
+import logging
+import math
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pygit2
+
+from .git_util import EMPTY_TREE_ID
+
+
+L = logging.getLogger("sno.spatial_index")
+
+# Stored in the repository's git directory, one database per indexed feature tree.
+SPATIAL_INDEX_DIR = Path("sno") / "spatial_index"
+# The least recently used indexes are deleted once there are more than this many.
+MAX_SPATIAL_INDEXES = 10
+
+INSERT_BATCH_SIZE = 10000
+INSERT_FEATURE_SQL = (
+    "INSERT INTO feature (path, min_x, max_x, min_y, max_y) VALUES (?, ?, ?, ?, ?);"
+)
+
+# Features are stored at [hex(pk-hash):2]/[hex(pk-hash):2]/[base64(pk-value)] within the feature tree.
+RE_FEATURE_PATH = re.compile(r"[0-9a-f]{2}/[0-9a-f]{2}/[^/]+$")
+RE_FEATURE_DIR = re.compile(r"[0-9a-f]{2}$")
+
+
+def get_spatial_index(repo, dataset):
+    """
+    Returns a SpatialIndex of the features in the given dataset, creating it if needed.
+    Indexes are keyed by the ID of the dataset's feature tree, so an index never goes out of date.
+    A new index is created by copying the most recently used index of the same dataset,
+    and then updating only the features that differ between the two feature trees.
+    """
+    feature_tree = _feature_tree(repo, dataset)
+    index_dir = Path(repo.path) / SPATIAL_INDEX_DIR
+    index_path = index_dir / f"{feature_tree.id}.db"
+
+    if not index_path.exists():
+        index_dir.mkdir(parents=True, exist_ok=True)
+        _create_index(repo, dataset, feature_tree, index_path)
+        _evict_indexes(index_dir, keep=index_path)
+    else:
+        # Last-modified time tracks when each index was last used.
+        index_path.touch()
+
+    return SpatialIndex(index_path, dataset)
+
+
+def _feature_tree(repo, dataset):
+    """Returns the tree containing the dataset's features, or the empty tree if it has no features."""
+    try:
+        if dataset.version < 2:
+            return dataset.tree / dataset.DATASET_DIRNAME
+        return dataset.feature_tree
+    except KeyError:
+        return repo.get(EMPTY_TREE_ID)
+
+
+def _geometry_column(dataset):
+    """Identifies the indexed geometry column - an index can only be updated if this hasn't changed."""
+    if dataset.version < 2:
+        return dataset.geom_column_name or ""
+    geom_columns = dataset.schema.geometry_columns
+    return geom_columns[0].id if geom_columns else ""
+
+
+def _iter_feature_blobs(tree):
+    """Yields (path, blob) for every feature in the given feature tree."""
+    for dir1 in tree:
+        if dir1.type_str != "tree" or not RE_FEATURE_DIR.match(dir1.name):
+            continue
+        for dir2 in dir1:
+            if dir2.type_str != "tree" or not RE_FEATURE_DIR.match(dir2.name):
+                continue
+            for leaf in dir2:
+                if leaf.type_str == "blob":
+                    yield f"{dir1.name}/{dir2.name}/{leaf.name}", leaf
+
+
+def _find_base_index(repo, index_dir, dataset_path, geometry_column):
+    """
+    Returns (index_path, feature_tree) for the most recently used index of the given dataset,
+    or (None, None) if there is no such index.
+    """
+    candidates = sorted(
+        index_dir.glob("*.db"), key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for index_path in candidates:
+        try:
+            with _connect(index_path) as db:
+                meta = dict(db.execute("SELECT key, value FROM meta;"))
+        except sqlite3.Error:
+            continue
+        if (
+            meta.get("dataset_path") != dataset_path
+            or meta.get("geometry_column") != geometry_column
+        ):
+            continue
+        try:
+            base_tree = repo[meta["tree_id"]]
+        except (KeyError, ValueError):
+            continue
+        return index_path, base_tree
+    return None, None
+
+
+def _create_index(repo, dataset, feature_tree, index_path):
+    geometry_column = _geometry_column(dataset)
+    base_path, base_tree = _find_base_index(
+        repo, index_path.parent, dataset.path, geometry_column
+    )
+
+    # Written to a temporary file, then moved into place, so the index is never seen half-built.
+    fd, tmp_path = tempfile.mkstemp(
+        dir=index_path.parent, prefix=f"{feature_tree.id}.", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        if base_path is not None:
+            L.debug("Updating spatial index %s -> %s", base_tree.id, feature_tree.id)
+            shutil.copyfile(base_path, tmp_path)
+        else:
+            L.debug("Building spatial index %s", feature_tree.id)
+            os.unlink(tmp_path)
+
+        read_envelope = dataset.envelope_reader()
+        with _connect(tmp_path) as db:
+            if base_path is not None:
+                _apply_tree_diff(db, base_tree, feature_tree, read_envelope)
+            else:
+                _create_tables(db)
+                _insert_features(db, _iter_feature_blobs(feature_tree), read_envelope)
+            db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);",
+                [
+                    ("dataset_path", dataset.path),
+                    ("geometry_column", geometry_column),
+                    ("tree_id", str(feature_tree.id)),
+                ],
+            )
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+@contextlib.contextmanager
+def _connect(path):
+    """Connects to the index database at path - changes are committed, and the connection closed, on exit."""
+    db = sqlite3.connect(str(path), timeout=30)
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def _create_tables(db):
+    db.executescript(
+        """
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE feature (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            min_x REAL NOT NULL,
+            max_x REAL NOT NULL,
+            min_y REAL NOT NULL,
+            max_y REAL NOT NULL
+        );
+        CREATE VIRTUAL TABLE feature_rtree USING rtree(id, min_x, max_x, min_y, max_y);
+        """
+    )
+
+
+def _insert_features(db, path_blobs, read_envelope):
+    """Indexes the given (path, blob) features. Features without a geometry aren't indexed."""
+    if read_envelope is None:
+        return
+
+    (max_id,) = db.execute("SELECT IFNULL(MAX(id), 0) FROM feature;").fetchone()
+    rows = []
+    for path, blob in path_blobs:
+        envelope = read_envelope(blob)
+        if envelope is None:
+            continue
+        rows.append((path, *envelope))
+        if len(rows) >= INSERT_BATCH_SIZE:
+            db.executemany(INSERT_FEATURE_SQL, rows)
+            rows = []
+    if rows:
+        db.executemany(INSERT_FEATURE_SQL, rows)
+
+    # The R*Tree stores 32-bit floats - the exact envelopes in the feature table are used to filter results.
+    db.execute(
+        """
+        INSERT INTO feature_rtree (id, min_x, max_x, min_y, max_y)
+        SELECT id, min_x, max_x, min_y, max_y FROM feature WHERE id > ?;
+        """,
+        (max_id,),
+    )
+
+
+def _delete_features(db, paths):
+    ids = [
+        (row[0],)
+        for path in paths
+        for row in db.execute("SELECT id FROM feature WHERE path=?;", (path,))
+    ]
+    db.executemany("DELETE FROM feature_rtree WHERE id=?;", ids)
+    db.executemany("DELETE FROM feature WHERE id=?;", ids)
+
+
+def _apply_tree_diff(db, base_tree, feature_tree, read_envelope):
+    """Updates an index of base_tree so that it indexes feature_tree instead."""
+    deleted_paths = []
+    inserted_paths = []
+    for delta in base_tree.diff_to_tree(feature_tree).deltas:
+        if delta.status in (pygit2.GIT_DELTA_DELETED, pygit2.GIT_DELTA_MODIFIED):
+            if RE_FEATURE_PATH.match(delta.old_file.path):
+                deleted_paths.append(delta.old_file.path)
+        if delta.status in (pygit2.GIT_DELTA_ADDED, pygit2.GIT_DELTA_MODIFIED):
+            if RE_FEATURE_PATH.match(delta.new_file.path):
+                inserted_paths.append(delta.new_file.path)
+
+    L.debug(
+        "Spatial index: %d deletes, %d inserts", len(deleted_paths), len(inserted_paths)
+    )
+    _delete_features(db, deleted_paths)
+    _insert_features(
+        db, ((path, feature_tree / path) for path in inserted_paths), read_envelope
+    )
+
+
+def _evict_indexes(index_dir, keep):
+    indexes = sorted(
+        index_dir.glob("*.db"), key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for index_path in indexes[MAX_SPATIAL_INDEXES:]:
+        if index_path != keep:
+            L.debug("Deleting spatial index %s", index_path.name)
+            index_path.unlink()
+
+
+def _envelope_distance(envelope, query):
+    """The distance between two (min_x, max_x, min_y, max_y) envelopes - zero if they intersect."""
+    dx = max(query[0] - envelope[1], envelope[0] - query[1], 0)
+    dy = max(query[2] - envelope[3], envelope[2] - query[3], 0)
+    return math.hypot(dx, dy)
+
+
+class SpatialIndex:
+    """
+    A spatial index of the features in a single feature tree.
+    Envelopes are given as (min_x, max_x, min_y, max_y), and features are returned as their primary key values.
+    """
+
+    def __init__(self, path, dataset):
+        self.path = Path(path)
+        self.dataset = dataset
+        self._db = None
+
+    def __enter__(self):
+        self._db = sqlite3.connect(str(self.path), timeout=30)
+        return self
+
+    def __exit__(self, *args):
+        self._db.close()
+        self._db = None
+
+    def _pk(self, path):
+        return self.dataset.decode_path_to_1pk(path)
+
+    def bounds(self):
+        """Returns the envelope of every indexed feature, or None if there are none."""
+        row = self._db.execute(
+            "SELECT MIN(min_x), MAX(max_x), MIN(min_y), MAX(max_y) FROM feature;"
+        ).fetchone()
+        return row if row[0] is not None else None
+
+    def _intersecting(self, envelope, columns):
+        min_x, max_x, min_y, max_y = envelope
+        return self._db.execute(
+            f"""
+            SELECT {columns} FROM feature_rtree R JOIN feature F ON R.id = F.id
+            WHERE R.max_x >= :min_x AND R.min_x <= :max_x AND R.max_y >= :min_y AND R.min_y <= :max_y
+            AND F.max_x >= :min_x AND F.min_x <= :max_x AND F.max_y >= :min_y AND F.min_y <= :max_y;
+            """,
+            {"min_x": min_x, "max_x": max_x, "min_y": min_y, "max_y": max_y},
+        )
+
+    def count(self, envelope=None):
+        """Returns the number of features intersecting the envelope, or the number of features if envelope is None."""
+        if envelope is None:
+            return self._db.execute("SELECT COUNT(*) FROM feature;").fetchone()[0]
+        return self._intersecting(envelope, "COUNT(*)").fetchone()[0]
+
+    def intersection(self, envelope):
+        """Yields the primary key values of the features whose envelopes intersect the envelope."""
+        for (path,) in self._intersecting(envelope, "F.path"):
+            yield self._pk(path)
+
+    def nearest(self, envelope, limit=1):
+        """
+        Returns the primary key values of the limit features whose envelopes are nearest to the envelope,
+        nearest first. Searches an expanding window around the envelope until enough features are found.
+        """
+        bounds = self.bounds()
+        if bounds is None or limit < 1:
+            return []
+
+        size = max(bounds[1] - bounds[0], bounds[3] - bounds[2])
+        total = self.count()
+        # Start with a window that would hold about `limit` features if they were spread evenly.
+        radius = max(size * math.sqrt(limit / total) / 2, 1e-9)
+        while True:
+            window = (
+                envelope[0] - radius,
+                envelope[1] + radius,
+                envelope[2] - radius,
+                envelope[3] + radius,
+            )
+            found = [
+                (_envelope_distance(row[1:], envelope), row[0])
+                for row in self._intersecting(
+                    window, "F.path, F.min_x, F.max_x, F.min_y, F.max_y"
+                )
+            ]
+            found.sort()
+            covers_bounds = (
+                window[0] <= bounds[0]
+                and window[1] >= bounds[1]
+                and window[2] <= bounds[2]
+                and window[3] >= bounds[3]
+            )
+            # Features further away than radius might be outside the window, and so not found yet.
+            if covers_bounds or (len(found) >= limit and found[limit - 1][0] <= radius):
+                return [self._pk(path) for distance, path in found[:limit]]
+            radius *= 2
@@ -3,10 +3,10 @@ import sys
 import click
 import pygit2
 
+from . import merge
 from .conflicts import list_conflicts
 from .output_util import dump_json_output
 from .repo_files import RepoState
-from .merge import merge_status_to_text
 from .merge_util import MergeContext, MergeIndex
 from .working_copy import WorkingCopy
 
@@ -16,7 +16,16 @@ from .working_copy import WorkingCopy
 @click.option(
     "--output-format", "-o", type=click.Choice(["text", "json"]), default="text",
 )
-def status(ctx, output_format):
+@click.option(
+    "--exact",
+    is_flag=True,
+    help=(
+        "Compare every changed feature with the repository, rather than counting the changed rows. "
+        "Slower, but doesn't count rows which were changed and then changed back, and counts features "
+        "whose primary key was changed as updates."
+    ),
+)
+def status(ctx, output_format, exact):
     """ Show the working copy status """
     repo = ctx.obj.get_repo(allowed_states=RepoState.ALL_STATES)
     jdict = get_branch_status_json(repo)
@@ -30,7 +39,7 @@ def status(ctx, output_format):
         )
         jdict["state"] = "merging"
     else:
-        jdict["workingCopy"] = get_working_copy_status_json(repo)
+        jdict["workingCopy"] = get_working_copy_status_json(repo, exact=exact)
 
     if output_format == 'json':
         dump_json_output({"sno.status/v1": jdict}, sys.stdout)
@@ -65,7 +74,11 @@ def get_branch_status_json(repo):
     return output
 
 
-def get_working_copy_status_json(repo):
+def get_working_copy_status_json(repo, exact=True):
+    """
+    Returns a JSON object describing the changes in the working copy, or None if there is no working copy.
+    Unless exact is True, the changes are counted using WorkingCopy.diff_to_tree_counts - see feature_change_counts.
+    """
     if repo.is_empty:
         return None
 
@@ -75,9 +88,12 @@ def get_working_copy_status_json(repo):
 
     output = {"path": working_copy.path, "changes": None}
 
-    wc_diff = working_copy.diff_to_tree()
-    if wc_diff:
-        output["changes"] = get_diff_status_json(wc_diff)
+    if exact:
+        wc_diff = working_copy.diff_to_tree()
+        if wc_diff:
+            output["changes"] = get_diff_status_json(wc_diff)
+    else:
+        output["changes"] = working_copy.diff_to_tree_counts() or None
 
     return output
 
@@ -93,7 +109,7 @@ def status_to_text(jdict):
     is_merging = jdict.get("state", None) == RepoState.MERGING
 
     if is_merging:
-        merge_status = merge_status_to_text(jdict, fresh=False)
+        merge_status = merge.merge_status_to_text(jdict, fresh=False)
         return "\n\n".join([branch_status, merge_status])
 
     if not is_empty:
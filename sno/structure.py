@@ -1,13 +1,13 @@
 import functools
 import logging
-import time
 from collections import deque
 
 import click
 import pygit2
 
 from . import core, git_util
-from .diff_structs import DatasetDiff, DeltaDiff, Delta
+from .profiling import phase, timed_iter
+from .diff_structs import DatasetDiff, DeltaDiff, DeltaStream, Delta
 from .exceptions import (
     InvalidOperation,
     NotFound,
@@ -16,7 +16,7 @@ from .exceptions import (
     PATCH_DOES_NOT_APPLY,
 )
 from .filter_util import UNFILTERED
-from .geometry import geom_envelope
+from .progress import Progress
 from .schema import Schema
 from .serialise_util import ensure_bytes, json_pack
 from .repository_version import get_repo_version
@@ -24,6 +24,11 @@ from .repository_version import get_repo_version
 
 L = logging.getLogger("sno.structure")
 
+# Feature changes are written to the tree in batches of (at most) this many blob changes - so however many features
+# are changed, only one batch of blob changes is held in memory. Each batch is written to a new tree, writing each
+# directory (ie, each feature-tree shard) that the batch changes once, before the next batch is worked out.
+FEATURE_TREE_BATCH_SIZE = 200000
+
 
 class RepositoryStructure:
     @staticmethod
@@ -121,7 +126,7 @@ class RepositoryStructure:
             raise
 
         if isinstance(o, pygit2.Tree):
-            ds = DatasetStructure.instantiate(o, path, self.version)
+            ds = DatasetStructure.instantiate(o, path, self.version, repo=self.repo)
             return ds
 
         raise KeyError(f"No valid dataset found at '{path}'")
@@ -150,7 +155,9 @@ class RepositoryStructure:
                         te_path = o.name
 
                     if dataset_dirname in o:
-                        ds = DatasetStructure.instantiate(o, te_path, dataset_version)
+                        ds = DatasetStructure.instantiate(
+                            o, te_path, dataset_version, repo=self.repo
+                        )
                         yield ds
                     else:
                         # examine inside this directory
@@ -224,6 +231,16 @@ class RepositoryStructure:
         responsibility of the caller.
         """
         new_tree_oid = self.create_tree_from_diff(wcdiff)
+        return self.commit_tree(
+            new_tree_oid, message, author=author, committer=committer
+        )
+
+    def commit_tree(self, tree_oid, message, *, author=None, committer=None):
+        """
+        Creates a new commit of the given tree, with HEAD as its parent, and sets HEAD to the new commit.
+        NOTE: Doesn't update working-copy meta or tracking tables, this is the
+        responsibility of the caller.
+        """
         L.info("Committing...")
         # this will also update the ref (branch) to point to the current commit
         new_commit = self.repo.create_commit(
@@ -231,7 +248,7 @@ class RepositoryStructure:
             author or git_util.author_signature(self.repo),
             committer or git_util.committer_signature(self.repo),
             message,  # message
-            new_tree_oid,  # tree
+            tree_oid,  # tree
             [self.repo.head.target],  # parents
         )
         L.info(f"Commit: {new_commit}")
@@ -244,12 +261,39 @@ class IntegrityError(ValueError):
     pass
 
 
+class FeatureBatch:
+    """
+    A batch of features read from a dataset - see DatasetStructure.features_batched.
+    Values are stored row-by-row, ready for DB-API executemany(), but can also be read column-by-column.
+    """
+
+    def __init__(self, col_names, rows):
+        self.col_names = tuple(col_names)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    @functools.lru_cache(maxsize=1)
+    def columns(self):
+        """Returns a dict of {col_name: tuple of values for that column}"""
+        if not self.rows:
+            return {name: () for name in self.col_names}
+        return dict(zip(self.col_names, zip(*self.rows)))
+
+    def column(self, col_name):
+        return self.columns[col_name]
+
+
 class DatasetStructure:
-    def __init__(self, tree, path):
+    def __init__(self, tree, path, repo=None):
         if self.__class__ is DatasetStructure:
             raise TypeError("Use DatasetStructure.instantiate()")
 
         self.tree = tree
+        # The repository that the tree is in, if known - used to look up feature summaries.
+        self.repo = repo
         self.path = path.strip("/")
         self.table_name = self.path.replace("/", "__")
         self.L = logging.getLogger(self.__class__.__qualname__)
@@ -271,7 +315,7 @@ class DatasetStructure:
         raise ValueError(f"No DatasetStructure found for version={version}")
 
     @classmethod
-    def instantiate(cls, tree, path, version):
+    def instantiate(cls, tree, path, version, repo=None):
         """ Load a DatasetStructure from a Tree """
         if not isinstance(tree, pygit2.Tree):
             raise TypeError(f"Expected Tree object, got {type(tree)}")
@@ -281,7 +325,7 @@ class DatasetStructure:
             raise KeyError(f"No dataset at {path} - missing {dataset_dirname} tree")
 
         version_klass = cls.for_version(version)
-        return version_klass(tree, path)
+        return version_klass(tree, path, repo=repo)
 
     @classmethod
     def dataset_dirname(cls, version):
@@ -402,68 +446,24 @@ class DatasetStructure:
         for k, f in self.features():
             yield tuple(f[c] for c in col_names)
 
-    RTREE_INDEX_EXTENSIONS = ("sno-idxd", "sno-idxi")
-
-    def build_spatial_index(self, path):
-        """
-        Internal proof-of-concept method for building a spatial index across the repository.
-
-        Uses Rtree (libspatialindex underneath): http://toblerity.org/rtree/index.html
-        """
-        import rtree
-
-        if not self.has_geometry:
-            raise ValueError("No geometry to index")
-
-        def _indexer():
-            t0 = time.monotonic()
-
-            c = 0
-            for (pk, geom) in self.feature_tuples(
-                [self.primary_key, self.geom_column_name]
-            ):
-                c += 1
-                if geom is None:
-                    continue
-
-                e = geom_envelope(geom)
-                yield (pk, e, None)
-
-                if c % 50000 == 0:
-                    print(f"  {c} features... @{time.monotonic()-t0:.1f}s")
-
-        p = rtree.index.Property()
-        p.dat_extension = self.RTREE_INDEX_EXTENSIONS[0]
-        p.idx_extension = self.RTREE_INDEX_EXTENSIONS[1]
-        p.leaf_capacity = 1000
-        p.fill_factor = 0.9
-        p.overwrite = True
-        p.dimensionality = 2
-
-        t0 = time.monotonic()
-        idx = rtree.index.Index(path, _indexer(), properties=p, interleaved=False)
-        t1 = time.monotonic()
-        b = idx.bounds
-        c = idx.count(b)
-        del idx
-        t2 = time.monotonic()
-        print(f"Indexed {c} features ({b}) in {t1-t0:.1f}s; flushed in {t2-t1:.1f}s")
-
-    def get_spatial_index(self, path):
+    def features_batched(
+        self, col_names, batch_size=10000, *, num_threads=1, tree_summaries=None
+    ):
         """
-        Retrieve a spatial index built with build_spatial_index().
-
-        Query with .nearest(coords), .intersection(coords), .count(coords)
-        http://toblerity.org/rtree/index.html
+        Feature iterator yielding FeatureBatch objects of up to batch_size features each,
+        with values ordered by the columns from col_names.
+        Subclasses may use num_threads to read features concurrently, in which case batches are yielded in any order.
+        Subclasses that can be summarised append the summaries of the trees they read to tree_summaries, if given.
         """
-        import rtree
-
-        p = rtree.index.Property()
-        p.dat_extension = self.RTREE_INDEX_EXTENSIONS[0]
-        p.idx_extension = self.RTREE_INDEX_EXTENSIONS[1]
-
-        idx = rtree.index.Index(path, properties=p)
-        return idx
+        # Subclasses should override this if there is a faster way to read whole batches.
+        batch = []
+        for row in self.feature_tuples(col_names):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield FeatureBatch(col_names, batch)
+                batch = []
+        if batch:
+            yield FeatureBatch(col_names, batch)
 
     _INSERT_UPDATE_DELETE = (
         pygit2.GIT_DELTA_ADDED,
@@ -478,10 +478,19 @@ class DatasetStructure:
         Generates a Diff from self -> other.
         If reverse is true, generates a diff from other -> self.
         """
-
         ds_diff = DatasetDiff()
         ds_diff["meta"] = self.diff_meta(other, reverse=reverse)
+        ds_diff["feature"] = DeltaDiff(
+            self.iter_feature_deltas(other, ds_filter=ds_filter, reverse=reverse)
+        )
+        return ds_diff
 
+    def iter_feature_deltas(self, other, ds_filter=UNFILTERED, reverse=False):
+        """
+        Yields a Delta for each feature that differs from self -> other, in no particular order.
+        If reverse is true, yields deltas from other -> self.
+        The features themselves are only read when the deltas' values are accessed.
+        """
         ds_filter = ds_filter or UNFILTERED
         pk_filter = ds_filter.get("feature", ())
 
@@ -490,7 +499,8 @@ class DatasetStructure:
             params = {"swap": True}
 
         if other is None:
-            diff_index = self.tree.diff_to_tree(**params)
+            with phase("tree diff"):
+                diff_index = self.tree.diff_to_tree(**params)
             self.L.debug(
                 "diff (%s -> None / %s): %s changes",
                 self.tree.id,
@@ -498,7 +508,8 @@ class DatasetStructure:
                 len(diff_index),
             )
         else:
-            diff_index = self.tree.diff_to_tree(other.tree, **params)
+            with phase("tree diff"):
+                diff_index = self.tree.diff_to_tree(other.tree, **params)
             self.L.debug(
                 "diff (%s -> %s / %s): %s changes",
                 self.tree.id,
@@ -513,9 +524,7 @@ class DatasetStructure:
         else:
             old, new = self, other
 
-        feature_diff = DeltaDiff()
-
-        for d in diff_index.deltas:
+        for d in timed_iter("tree diff", diff_index.deltas):
             self.L.debug(
                 "diff(): %s %s %s", d.status_char(), d.old_file.path, d.new_file.path
             )
@@ -571,7 +580,7 @@ class DatasetStructure:
                 else:
                     new_half_delta = None
 
-                feature_diff.add_delta(Delta(old_half_delta, new_half_delta))
+                yield Delta(old_half_delta, new_half_delta)
 
             else:
                 # GIT_DELTA_RENAMED
@@ -585,9 +594,6 @@ class DatasetStructure:
 
         # TODO - detect renames by comparing blob ID
 
-        ds_diff["feature"] = feature_diff
-        return ds_diff
-
     def diff_meta(self, other, reverse=False):
         """
         Generates a diff from self -> other, but only for meta items.
@@ -602,106 +608,89 @@ class DatasetStructure:
         meta_new = dict(new.meta_items()) if new else {}
         return DeltaDiff.diff_dicts(meta_old, meta_new)
 
-    def _recursive_build_feature_tree(
-        self, *, repo, orig_tree, deltas_dict, encode_kwargs, pk_field, geom_column_name
+    def _feature_blob_changes(
+        self, repo, orig_tree, deltas, encode_kwargs, max_changes=None
     ):
         """
-        Recursively builds a new tree object by applying deltas to the orig_tree.
+        Works out which feature blobs need to be written or deleted to apply the given feature deltas to orig_tree.
+        New blobs are created in the repo. Returns ({full_path: blob ID or None}, conflicts).
+        Deltas are checked against orig_tree by blob ID where possible, so existing features aren't read unless
+        the old value of an update doesn't encode to the same blob as the existing feature.
+        If max_changes is given, stops taking deltas from the deltas iterator once there are that many blob changes.
         """
+        get_blob_id = git_util.blob_id_getter(orig_tree)
+        blob_changes = {}
         conflicts = False
-        if orig_tree is None:
-            builder = repo.TreeBuilder()
-        else:
-            builder = repo.TreeBuilder(orig_tree)
-        for k, v in deltas_dict.items():
-            if isinstance(v, dict):
-                orig_subtree = None
-                if orig_tree is not None:
-                    try:
-                        orig_subtree = orig_tree / k
-                    except KeyError:
-                        pass
-
-                new_subtree, new_conflicts = self._recursive_build_feature_tree(
-                    repo=repo,
-                    orig_tree=orig_subtree,
-                    deltas_dict=v,
-                    encode_kwargs=encode_kwargs,
-                    pk_field=pk_field,
-                    geom_column_name=geom_column_name,
+
+        for delta in deltas:
+            if delta.type == "delete":
+                old_path = self.encode_1pk_to_path(delta.old_key)
+                if get_blob_id(old_path) is None:
+                    conflicts = True
+                    click.echo(
+                        f"{self.path}: Trying to delete nonexistent feature: {delta.old_key}"
+                    )
+                    continue
+                blob_changes[old_path] = None
+
+            elif delta.type == "insert":
+                new_path, new_data = self.encode_feature(
+                    delta.new_value, **encode_kwargs
                 )
-                conflicts = conflicts or new_conflicts
-                if new_subtree != orig_subtree:
-                    if orig_tree is not None and k in orig_tree:
-                        builder.remove(k)
-                    builder.insert(k, new_subtree, pygit2.GIT_FILEMODE_TREE)
-            else:
-                # actually apply blob deltas
-                delta = v
-                if delta.type == "delete":
-                    if (not orig_tree) or k not in orig_tree:
-                        conflicts = True
-                        pk = delta.old.value[pk_field]
-                        click.echo(
-                            f"{self.path}: Trying to delete nonexistent feature: {pk}"
-                        )
-                        continue
-                    builder.remove(k)
+                if get_blob_id(new_path) is not None:
+                    conflicts = True
+                    click.echo(
+                        f"{self.path}: Trying to create feature that already exists: {delta.new_key}"
+                    )
+                    continue
+                blob_changes[new_path] = repo.create_blob(new_data)
 
-                elif delta.type == "insert":
-                    feature_path, feature_data = self.encode_feature(
-                        delta.new.value, **encode_kwargs
+            elif delta.type == "update":
+                old_path = self.encode_1pk_to_path(delta.old_key)
+                existing_blob_id = get_blob_id(old_path)
+                if existing_blob_id is None:
+                    conflicts = True
+                    click.echo(
+                        f"{self.path}: Trying to update nonexistent feature: {delta.old_key}"
                     )
-                    if orig_tree and k in orig_tree:
-                        conflicts = True
-                        pk = delta.new.value[pk_field]
-                        click.echo(
-                            f"{self.path}: Trying to create feature that already exists: {pk}"
-                        )
-                        continue
-                    blob_id = repo.create_blob(feature_data)
-                    builder.insert(k, blob_id, pygit2.GIT_FILEMODE_BLOB)
-
-                elif delta.type == "update":
-                    pk = self.decode_path_to_1pk(k)
-                    old_pk = delta.old.value[pk_field]
-                    if pk == old_pk:
-                        # k refers to the *old* object
-                        # (it *may* also be the new object if this isn't a rename)
-                        if (not orig_tree) or k not in orig_tree:
-                            conflicts = True
-                            click.echo(
-                                f"{self.path}: Trying to update nonexistent feature: {old_pk}"
-                            )
-                            continue
-                        actual_existing_feature = self.get_feature(old_pk)
-                        old_feature = delta.old.value
-                        if geom_column_name:
-                            # FIXME: actually compare the geometries here.
-                            # Turns out this is quite hard - geometries are hard to compare sanely.
-                            # Even if we add hacks to ignore endianness, WKB seems to vary a bit,
-                            # and ogr_geometry.Equal(other) can return false for seemingly-identical geometries...
-                            actual_existing_feature.pop(geom_column_name)
-                            old_feature = old_feature.copy()
-                            old_feature.pop(geom_column_name)
-                        if actual_existing_feature != old_feature:
-                            conflicts = True
-                            click.echo(
-                                f"{self.path}: Trying to update already-changed feature: {old_pk}"
-                            )
-                            continue
-                        builder.remove(k)
-
-                    new_pk = delta.new.value[pk_field]
-                    if pk == new_pk:
-                        # k refers to the *old* object
-                        # (it *may* also be the old object if this isn't a rename)
-                        new_feature_path, new_feature_data = self.encode_feature(
-                            delta.new.value, **encode_kwargs
-                        )
-                        blob_id = repo.create_blob(new_feature_data)
-                        builder.insert(k, blob_id, pygit2.GIT_FILEMODE_BLOB)
-        return builder.write(), conflicts
+                    continue
+                if not self._is_existing_feature(existing_blob_id, delta.old_value):
+                    conflicts = True
+                    click.echo(
+                        f"{self.path}: Trying to update already-changed feature: {delta.old_key}"
+                    )
+                    continue
+                blob_changes[old_path] = None
+                new_path, new_data = self.encode_feature(
+                    delta.new_value, **encode_kwargs
+                )
+                blob_changes[new_path] = repo.create_blob(new_data)
+
+            if max_changes is not None and len(blob_changes) >= max_changes:
+                break
+
+        return blob_changes, conflicts
+
+    def _is_existing_feature(self, existing_blob_id, feature):
+        """Returns True if the given feature is the same as the existing feature stored in the given blob."""
+        try:
+            if pygit2.hash(self.encode_feature(feature)[1]) == existing_blob_id:
+                return True
+        except (KeyError, TypeError, ValueError):
+            pass  # Can't be encoded using the current schema.
+
+        # The feature might still be the same, but encoded differently - eg, using an older schema.
+        actual_existing_feature = self.get_feature(feature[self.primary_key])
+        geom_column_name = self.geom_column_name
+        if geom_column_name:
+            # FIXME: actually compare the geometries here.
+            # Turns out this is quite hard - geometries are hard to compare sanely.
+            # Even if we add hacks to ignore endianness, WKB seems to vary a bit,
+            # and ogr_geometry.Equal(other) can return false for seemingly-identical geometries...
+            actual_existing_feature.pop(geom_column_name)
+            feature = feature.copy()
+            feature.pop(geom_column_name)
+        return actual_existing_feature == feature
 
     def write_to_new_tree(self, dataset_diff, repo, *, orig_tree):
         """
@@ -711,8 +700,6 @@ class DatasetStructure:
         """
         # TODO - support multiple primary keys.
         # TODO - support writing new schemas
-        pk_field = self.primary_key
-
         conflicts = False
         encode_kwargs = {}
 
@@ -785,37 +772,32 @@ class DatasetStructure:
                     blob_id = repo.create_blob(data)
                     meta_tree = git_util.replace_subtree(repo, meta_tree, path, blob_id)
 
-        orig_tree = git_util.replace_subtree(repo, orig_tree, meta_path, meta_tree)
+        new_tree = git_util.replace_subtree(repo, orig_tree, meta_path, meta_tree)
 
-        geom_column_name = self.geom_column_name
-        deltas_by_directory = {}
-        for delta in dataset_diff.get("feature", {}).values():
-            if delta.type == "delete":
-                pks = {delta.old.value[pk_field]}
-            elif delta.type == "insert":
-                pks = {delta.new.value[pk_field]}
-            elif delta.type == "update":
-                pks = {delta.old.value[pk_field], delta.new.value[pk_field]}
-
-            for pk in pks:
-                feature_path = self.encode_1pk_to_path(pk)
-                pieces = feature_path.rsplit('/')
-                dir_ = deltas_by_directory
-                for piece in pieces[:-1]:
-                    dir_ = dir_.setdefault(piece, {})
-                dir_[pieces[-1]] = delta
-
-        new_tree, conflicts = self._recursive_build_feature_tree(
-            orig_tree=orig_tree,
-            repo=repo,
-            deltas_dict=deltas_by_directory,
-            encode_kwargs=encode_kwargs,
-            pk_field=pk_field,
-            geom_column_name=geom_column_name,
-        )
+        feature_diff = dataset_diff.get("feature", {})
+        if isinstance(feature_diff, DeltaStream):
+            deltas, total = iter(feature_diff), None
+        else:
+            deltas, total = iter(feature_diff.values()), len(feature_diff)
+
+        with Progress("write", dataset=self.path, total=total) as progress:
+            deltas = progress.iter(deltas)
+            while True:
+                blob_changes, feature_conflicts = self._feature_blob_changes(
+                    repo,
+                    new_tree,
+                    deltas,
+                    encode_kwargs,
+                    max_changes=FEATURE_TREE_BATCH_SIZE,
+                )
+                conflicts = conflicts or feature_conflicts
+                with phase("tree write"):
+                    new_tree = repo[git_util.build_tree(repo, new_tree, blob_changes)]
+                if len(blob_changes) < FEATURE_TREE_BATCH_SIZE:
+                    break
 
         if conflicts:
             raise InvalidOperation(
                 "Patch does not apply", exit_code=PATCH_DOES_NOT_APPLY,
             )
-        return new_tree
+        return new_tree.id
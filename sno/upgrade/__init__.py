@@ -10,6 +10,7 @@ from . import upgrade_v0, upgrade_v1
 from sno import checkout, context
 from sno.exceptions import InvalidOperation
 from sno.fast_import import fast_import_tables, ReplaceExisting
+from sno.progress import Progress
 from sno.repository_version import get_repo_version, write_repo_version_config
 from sno.timestamps import minutes_to_tz_offset
 
@@ -62,25 +63,29 @@ def upgrade(ctx, source, dest):
     commit_map = {}
 
     click.secho("\nWriting new commits ...", bold=True)
-    for i, source_commit in enumerate(source_walker):
-        dest_parents = []
-        for parent_id in source_commit.parent_ids:
-            try:
-                dest_parents.append(commit_map[parent_id.hex])
-            except KeyError:
-                raise ValueError(
-                    f"Commit {i} ({source_commit.id}): Haven't seen parent ({parent_id})"
-                )
-
-        _upgrade_commit(
-            i,
-            source_repo,
-            source_commit,
-            source_version,
-            dest_parents,
-            dest_repo,
-            commit_map,
-        )
+    source_commits = list(source_walker)
+    upgrade_progress = Progress("upgrade", total=len(source_commits), unit="commits")
+    with upgrade_progress:
+        for i, source_commit in enumerate(source_commits):
+            dest_parents = []
+            for parent_id in source_commit.parent_ids:
+                try:
+                    dest_parents.append(commit_map[parent_id.hex])
+                except KeyError:
+                    raise ValueError(
+                        f"Commit {i} ({source_commit.id}): Haven't seen parent ({parent_id})"
+                    )
+
+            _upgrade_commit(
+                i,
+                source_repo,
+                source_commit,
+                source_version,
+                dest_parents,
+                dest_repo,
+                commit_map,
+            )
+            upgrade_progress.update(1)
 
     click.echo(f"{i+1} commits processed.")
 
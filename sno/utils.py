@@ -1,4 +1,6 @@
 import functools
+import queue
+import threading
 
 
 def ungenerator(cast_function):
@@ -23,3 +25,75 @@ def ungenerator(cast_function):
         return wrapper
 
     return decorator
+
+
+_DONE = object()
+
+
+def iter_threaded(generator_func, items, *, num_threads, max_queue_size=None):
+    """
+    Calls generator_func(item) for each of the given items, using num_threads worker threads, and yields
+    everything that the generators yield, in whatever order it is produced. At most max_queue_size results
+    (default: twice num_threads) are waiting to be consumed at any time, so memory use stays bounded.
+    Any exception raised by a worker is re-raised in the consuming thread.
+    Only helps if generator_func spends much of its time in code that releases the GIL - eg libgit2 or sqlite.
+    """
+    if max_queue_size is None:
+        max_queue_size = num_threads * 2
+
+    item_queue = queue.Queue()
+    for item in items:
+        item_queue.put(item)
+    result_queue = queue.Queue(maxsize=max_queue_size)
+    stopping = threading.Event()
+
+    def _put(result):
+        # Don't block forever if the consumer has gone away.
+        while not stopping.is_set():
+            try:
+                result_queue.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _worker():
+        try:
+            while not stopping.is_set():
+                try:
+                    item = item_queue.get_nowait()
+                except queue.Empty:
+                    break
+                for result in generator_func(item):
+                    if not _put(result):
+                        return
+        except Exception as e:
+            _put(_WorkerError(e))
+        finally:
+            _put(_DONE)
+
+    threads = [
+        threading.Thread(target=_worker, daemon=True) for i in range(num_threads)
+    ]
+    for t in threads:
+        t.start()
+
+    try:
+        num_running = len(threads)
+        while num_running:
+            result = result_queue.get()
+            if result is _DONE:
+                num_running -= 1
+            elif isinstance(result, _WorkerError):
+                raise result.error
+            else:
+                yield result
+    finally:
+        stopping.set()
+        for t in threads:
+            t.join()
+
+
+class _WorkerError:
+    def __init__(self, error):
+        self.error = error
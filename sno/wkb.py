@@ -0,0 +1,240 @@
+import math
+import struct
+import sys
+from array import array
+from collections import namedtuple
+
+# Reads WKB directly, without creating OGR geometries - which is much faster when it's done once per feature,
+# eg to find a geometry's envelope or to make it little-endian. Anything that can't be read here raises ValueError
+# (or NotImplementedError), and callers should then fall back to OGR.
+
+# https://www.ogc.org/standards/sfa - ISO geometry type codes.
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTIPOINT = 4
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+WKB_GEOMETRYCOLLECTION = 7
+WKB_CIRCULARSTRING = 8
+WKB_COMPOUNDCURVE = 9
+WKB_CURVEPOLYGON = 10
+WKB_MULTICURVE = 11
+WKB_MULTISURFACE = 12
+WKB_POLYHEDRALSURFACE = 15
+WKB_TIN = 16
+WKB_TRIANGLE = 17
+
+# As returned by OGR's Geometry.GetGeometryName()
+WKB_TYPE_NAMES = {
+    WKB_POINT: "POINT",
+    WKB_LINESTRING: "LINESTRING",
+    WKB_POLYGON: "POLYGON",
+    WKB_MULTIPOINT: "MULTIPOINT",
+    WKB_MULTILINESTRING: "MULTILINESTRING",
+    WKB_MULTIPOLYGON: "MULTIPOLYGON",
+    WKB_GEOMETRYCOLLECTION: "GEOMETRYCOLLECTION",
+    WKB_CIRCULARSTRING: "CIRCULARSTRING",
+    WKB_COMPOUNDCURVE: "COMPOUNDCURVE",
+    WKB_CURVEPOLYGON: "CURVEPOLYGON",
+    WKB_MULTICURVE: "MULTICURVE",
+    WKB_MULTISURFACE: "MULTISURFACE",
+    WKB_POLYHEDRALSURFACE: "POLYHEDRALSURFACE",
+    WKB_TIN: "TIN",
+    WKB_TRIANGLE: "TRIANGLE",
+}
+
+# Geometry types which are a sequence of points.
+_POINT_SEQUENCE_TYPES = {WKB_LINESTRING, WKB_CIRCULARSTRING}
+# Geometry types which are a sequence of rings, each of which is a sequence of points.
+_RING_SEQUENCE_TYPES = {WKB_POLYGON, WKB_TRIANGLE}
+# Geometry types which are a sequence of other geometries, each with its own WKB header.
+_COLLECTION_TYPES = {
+    WKB_MULTIPOINT,
+    WKB_MULTILINESTRING,
+    WKB_MULTIPOLYGON,
+    WKB_GEOMETRYCOLLECTION,
+    WKB_COMPOUNDCURVE,
+    WKB_CURVEPOLYGON,
+    WKB_MULTICURVE,
+    WKB_MULTISURFACE,
+    WKB_POLYHEDRALSURFACE,
+    WKB_TIN,
+}
+# Geometry types with arcs - the envelope of an arc isn't the envelope of its points.
+_CURVE_TYPES = {WKB_CIRCULARSTRING}
+
+# Flags used by OGR's (and PostGIS') extended WKB, rather than ISO WKB.
+_EWKB_Z_BIT = 0x80000000
+_EWKB_M_BIT = 0x40000000
+_EWKB_SRID_BIT = 0x20000000
+
+_NATIVE_LE = sys.byteorder == "little"
+
+_UINT32_LE = struct.Struct("<I")
+_UINT32_BE = struct.Struct(">I")
+
+
+WKBGeometry = namedtuple(
+    "WKBGeometry", ("geometry_type", "has_z", "has_m", "wkb", "envelope")
+)
+WKBGeometry.__doc__ = """
+The result of read_wkb.
+geometry_type - the ISO geometry type code, without dimensions - eg WKB_POLYGON for a POLYGON ZM.
+has_z, has_m - whether the geometry has Z and M coordinates.
+wkb - the geometry as little-endian ISO WKB, if requested.
+envelope - (minx, maxx, miny, maxy) or, if the geometry has Z coordinates, (minx, maxx, miny, maxy, minz, maxz)
+    if requested - this is None if the geometry is empty.
+"""
+
+
+def _decode_geometry_type(type_code):
+    """Returns (geometry_type, has_z, has_m) for an ISO WKB or extended WKB geometry type code."""
+    if type_code & _EWKB_SRID_BIT:
+        raise ValueError("WKB with an embedded SRID is not supported")
+    has_z = bool(type_code & _EWKB_Z_BIT)
+    has_m = bool(type_code & _EWKB_M_BIT)
+    dims, geometry_type = divmod(type_code & 0x0FFFFFFF, 1000)
+    if dims > 3 or geometry_type not in WKB_TYPE_NAMES:
+        raise ValueError(f"Unsupported WKB geometry type: {type_code}")
+    has_z = has_z or dims in (1, 3)
+    has_m = has_m or dims in (2, 3)
+    return geometry_type, has_z, has_m
+
+
+def read_wkb_type(buf, offset=0):
+    """
+    Reads only the header of the WKB at the given offset in buf.
+    Returns (geometry_type, has_z, has_m) - see WKBGeometry.
+    """
+    byte_order = buf[offset]
+    if byte_order == 1:
+        (type_code,) = _UINT32_LE.unpack_from(buf, offset + 1)
+    elif byte_order == 0:
+        (type_code,) = _UINT32_BE.unpack_from(buf, offset + 1)
+    else:
+        raise ValueError("Invalid WKB byte order")
+    return _decode_geometry_type(type_code)
+
+
+def read_wkb(buf, offset=0, *, to_wkb=False, envelope=False):
+    """
+    Reads the WKB geometry at the given offset in buf - eg, a GeoPackage geometry, after its header and envelope.
+    If to_wkb is True, the geometry is rewritten as little-endian ISO WKB - every part of it, and whatever the
+    byte order of each part was. If envelope is True, the envelope of the geometry is calculated.
+    Returns a WKBGeometry.
+    """
+    reader = _WKBReader(buf, to_wkb=to_wkb, envelope=envelope)
+    _, (geometry_type, has_z, has_m) = reader.read_geometry(offset)
+    return WKBGeometry(
+        geometry_type,
+        has_z,
+        has_m,
+        b"".join(reader.out) if to_wkb else None,
+        reader.get_envelope(has_z) if envelope else None,
+    )
+
+
+class _WKBReader:
+    """
+    Walks a WKB geometry once. Coordinates are read in bulk into arrays, which are byte-swapped and sliced
+    in C - rather than a point at a time in Python.
+    """
+
+    def __init__(self, buf, *, to_wkb, envelope):
+        self.buf = memoryview(buf)
+        self.out = [] if to_wkb else None
+        self.envelope = envelope
+        self.has_curves = False
+        self.ranges = [math.inf, -math.inf] * 3
+
+    def get_envelope(self, has_z):
+        ranges = self.ranges
+        if ranges[0] > ranges[1]:
+            return None
+        if self.has_curves:
+            raise NotImplementedError("Envelopes of curved geometries aren't supported")
+        return tuple(ranges) if has_z else tuple(ranges[:4])
+
+    def read_uint32(self, offset, is_le):
+        return (_UINT32_LE if is_le else _UINT32_BE).unpack_from(self.buf, offset)[0]
+
+    def read_count(self, offset, is_le):
+        count = self.read_uint32(offset, is_le)
+        if self.out is not None:
+            self.out.append(_UINT32_LE.pack(count))
+        return count, offset + 4
+
+    def read_geometry(self, offset):
+        """Reads the geometry at offset. Returns the offset after it, and (geometry_type, has_z, has_m)."""
+        byte_order = self.buf[offset]
+        if byte_order not in (0, 1):
+            raise ValueError("Invalid WKB byte order")
+        is_le = byte_order == 1
+        geometry_type, has_z, has_m = _decode_geometry_type(
+            self.read_uint32(offset + 1, is_le)
+        )
+        if self.out is not None:
+            iso_type_code = geometry_type + 1000 * has_z + 2000 * has_m
+            self.out.append(b"\x01" + _UINT32_LE.pack(iso_type_code))
+        if geometry_type in _CURVE_TYPES:
+            self.has_curves = True
+
+        ndims = 2 + has_z + has_m
+        offset += 5
+        if geometry_type == WKB_POINT:
+            offset = self.read_points(offset, 1, ndims, is_le, has_z)
+        elif geometry_type in _POINT_SEQUENCE_TYPES:
+            count, offset = self.read_count(offset, is_le)
+            offset = self.read_points(offset, count, ndims, is_le, has_z)
+        elif geometry_type in _RING_SEQUENCE_TYPES:
+            ring_count, offset = self.read_count(offset, is_le)
+            for i in range(ring_count):
+                count, offset = self.read_count(offset, is_le)
+                offset = self.read_points(offset, count, ndims, is_le, has_z)
+        elif geometry_type in _COLLECTION_TYPES:
+            count, offset = self.read_count(offset, is_le)
+            for i in range(count):
+                offset, part_type = self.read_geometry(offset)
+        else:
+            raise ValueError(f"Unsupported WKB geometry type: {geometry_type}")
+
+        return offset, (geometry_type, has_z, has_m)
+
+    def read_points(self, offset, count, ndims, is_le, has_z):
+        end = offset + 8 * ndims * count
+        if end > len(self.buf):
+            raise ValueError("WKB is truncated")
+        if not count:
+            return end
+
+        raw = self.buf[offset:end]
+        if is_le and not self.envelope:
+            if self.out is not None:
+                self.out.append(raw)
+            return end
+
+        coords = array("d")
+        coords.frombytes(raw)
+        if is_le != _NATIVE_LE:
+            coords.byteswap()
+        if self.out is not None:
+            if is_le:
+                self.out.append(raw)
+            elif _NATIVE_LE:
+                self.out.append(coords.tobytes())
+            else:
+                le_coords = array("d", coords)
+                le_coords.byteswap()
+                self.out.append(le_coords.tobytes())
+
+        if self.envelope:
+            if count == 1 and math.isnan(coords[0]) and math.isnan(coords[1]):
+                # POINT EMPTY is stored as POINT(nan nan).
+                return end
+            ranges = self.ranges
+            for axis in range(3 if has_z else 2):
+                values = coords[axis::ndims]
+                ranges[2 * axis] = min(ranges[2 * axis], min(values))
+                ranges[2 * axis + 1] = max(ranges[2 * axis + 1], max(values))
+        return end
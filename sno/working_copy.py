@@ -1,26 +1,112 @@
 import contextlib
+import functools
 import itertools
 import logging
+import math
 import os
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
 from enum import Enum
 
+import apsw
 import pygit2
-from osgeo import gdal
 
-from . import gpkg, gpkg_adapter
+from . import git_util, gpkg, gpkg_adapter
 from .diff_structs import RepoDiff, DatasetDiff, DeltaDiff, Delta
 from .exceptions import InvalidOperation, NotYetImplemented
+from .feature_summary import (
+    get_feature_summary,
+    get_stored_feature_summary,
+    store_feature_summaries,
+)
 from .filter_util import UNFILTERED
 from .geometry import Geometry, normalise_gpkg_geom
+from .profiling import phase, timed_iter
+from .progress import Progress
 from .schema import Schema
+from .serialise_util import msg_unpack
 from .structure import RepositoryStructure
 from .repository_version import get_repo_version
 
 L = logging.getLogger("sno.working_copy")
 
+# When writing a whole dataset to the working copy, features are read from the repository using this many threads,
+# while the main thread writes them to the working copy.
+WRITE_FULL_READ_THREADS = min(8, os.cpu_count() or 1)
+
+# When resetting a table changes at least this many features, and at least this proportion of the table,
+# the spatial index isn't updated as each feature is written - it is rebuilt afterwards instead.
+SPATIAL_INDEX_REBUILD_MIN_CHANGES = 10000
+SPATIAL_INDEX_REBUILD_MIN_RATIO = 0.05
+# How many entries fit in each node of a GeoPackage spatial index (4KiB pages, 24 bytes per 2D entry)
+RTREE_NODE_CAPACITY = 168
+
+# In WAL mode, how long a session waits for another process to finish writing to the working copy, in milliseconds.
+WAL_BUSY_TIMEOUT = 60000
+# How long a checkpoint after a bulk write waits for readers of older versions of the working copy, in milliseconds.
+WAL_CHECKPOINT_BUSY_TIMEOUT = 5000
+
+# Working copy connections which are kept open between sessions, by path - or None if connections
+# are closed at the end of each session (the default). See keep_connections_open()
+_open_connections = None
+_open_connections_lock = threading.Lock()
+
+
+def keep_connections_open():
+    """
+    Keeps working copy connections open at the end of each session, to be reused by the next session
+    for the same working copy - used by `sno serve`, which runs many commands in one process.
+    """
+    global _open_connections
+    if _open_connections is None:
+        _open_connections = {}
+
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_dev, stat.st_ino)
+
+
+def _connect(path):
+    """Opens a connection to the working copy at path, or reuses one kept open by keep_connections_open()."""
+    if _open_connections is None:
+        return gpkg.db(path)
+    identity = _file_identity(path)
+    with _open_connections_lock:
+        pool = _open_connections.get(str(path), [])
+        while pool:
+            pooled_identity, db = pool.pop()
+            if identity is not None and pooled_identity == identity:
+                return db
+            # The working copy has since been deleted or replaced.
+            db.close()
+    return gpkg.db(path)
+
+
+def _disconnect(path, db):
+    """Closes the connection, unless it should be kept open for reuse."""
+    identity = _file_identity(path) if _open_connections is not None else None
+    if identity is None:
+        db.close()
+        return
+    with _open_connections_lock:
+        _open_connections.setdefault(str(path), []).append((identity, db))
+
+
+def _close_connections(path):
+    """Closes any connections to the working copy at path that were kept open for reuse."""
+    if _open_connections is None:
+        return
+    with _open_connections_lock:
+        pool = _open_connections.pop(str(path), [])
+    for identity, db in pool:
+        db.close()
+
 
 class WorkingCopyDirty(Exception):
     pass
@@ -66,7 +152,7 @@ class WorkingCopy:
             cls.write_config(repo, path)
 
     @classmethod
-    def write_config(cls, repo, path=None, bare=False):
+    def write_config(cls, repo, path=None, bare=False, wal=None):
         repo_cfg = repo.config
 
         def del_repo_cfg(key):
@@ -81,6 +167,8 @@ class WorkingCopy:
         path = path or f"{Path(repo.path).resolve().stem}.gpkg"
         repo_cfg["sno.workingcopy.path"] = str(path)
         del_repo_cfg("sno.workingcopy.bare")
+        if wal is not None:
+            repo_cfg["sno.workingcopy.wal"] = wal
 
     class Mismatch(ValueError):
         def __init__(self, working_copy_tree_id, match_tree_id):
@@ -138,30 +226,61 @@ class WorkingCopyGPKG(WorkingCopy):
             n += "_" + suffix
         return gpkg.ident(n)
 
+    @property
+    def use_wal(self):
+        """
+        Whether the working copy is in WAL mode - see `sno create-workingcopy --wal`. In WAL mode other processes,
+        eg map servers, can keep reading the working copy while sno writes to it.
+        """
+        repo_cfg = self.repo.config
+        return "sno.workingcopy.wal" in repo_cfg and repo_cfg.get_bool(
+            "sno.workingcopy.wal"
+        )
+
+    @property
+    def _session_state(self):
+        # Each thread has its own session.
+        try:
+            return self.__dict__["_session_local"]
+        except KeyError:
+            return self.__dict__.setdefault("_session_local", threading.local())
+
     @contextlib.contextmanager
     def session(self, bulk=0):
         """
         Context manager for GeoPackage DB sessions, yields a connection object inside a transaction
 
-        Calling again yields the _same_ connection, the transaction/etc only happen in the outer one.
+        Calling again (from the same thread) yields the _same_ connection, the transaction/etc only happen in the
+        outer one. Each thread has its own session.
 
         @bulk controls bulk-loading operating mode:
             0: default, no bulk operations (normal)
             1: synchronous, larger cache (bulk changes)
             2: exclusive locking, memory journal (bulk load)
+
+        In WAL mode, bulk sessions don't lock out readers: they wait for any other writer and then take the write
+        lock up front, and the WAL is checkpointed once they are done - rather than every 1000 pages as they write.
         """
         L = logging.getLogger(f"{self.__class__.__qualname__}.session")
+        state = self._session_state
 
-        if hasattr(self, "_db"):
+        if getattr(state, "db", None) is not None:
             # inner - reuse
             L.debug(f"session(bulk={bulk}): existing...")
-            with self._db:
-                yield self._db
+            with state.db:
+                yield state.db
             L.debug(f"session(bulk={bulk}): existing/done")
         else:
             L.debug(f"session(bulk={bulk}): new...")
-            self._db = gpkg.db(self.full_path,)
-            dbcur = self._db.cursor()
+            db = state.db = _connect(self.full_path)
+            dbcur = db.cursor()
+
+            wal = self.use_wal
+            if wal:
+                db.setbusytimeout(WAL_BUSY_TIMEOUT)
+                (journal,) = dbcur.execute("PRAGMA journal_mode;").fetchall()[0]
+                if journal.lower() != "wal":
+                    dbcur.execute("PRAGMA journal_mode = WAL;").fetchall()
 
             if bulk:
                 L.debug("Invoking bulk mode %s", bulk)
@@ -171,15 +290,28 @@ class WorkingCopyGPKG(WorkingCopy):
                 dbcur.execute("PRAGMA synchronous = OFF;")
                 dbcur.execute("PRAGMA cache_size = -1048576;")  # -KiB => 1GiB
 
-                if bulk >= 2:
+                if wal:
+                    orig_autocheckpoint = dbcur.execute(
+                        "PRAGMA wal_autocheckpoint;"
+                    ).fetchone()[0]
+                    dbcur.execute("PRAGMA wal_autocheckpoint = 0;").fetchall()
+                elif bulk >= 2:
                     dbcur.execute("PRAGMA journal_mode = MEMORY;")
                     dbcur.execute("PRAGMA locking_mode = EXCLUSIVE;")
 
             try:
-                with self._db:
-                    yield self._db
-            except Exception:
-                raise
+                if wal and bulk:
+                    dbcur.execute("BEGIN IMMEDIATE;")
+                    try:
+                        with db:
+                            yield db
+                    except BaseException:
+                        dbcur.execute("ROLLBACK;")
+                        raise
+                    dbcur.execute("COMMIT;")
+                else:
+                    with db:
+                        yield db
             finally:
                 if bulk:
                     L.debug(
@@ -191,7 +323,12 @@ class WorkingCopyGPKG(WorkingCopy):
                     dbcur.execute("PRAGMA synchronous = ON;")
                     dbcur.execute("PRAGMA cache_size = -2000;")  # default
 
-                    if bulk >= 2:
+                    if wal:
+                        dbcur.execute(
+                            f"PRAGMA wal_autocheckpoint = {orig_autocheckpoint};"
+                        ).fetchall()
+                        self._checkpoint(dbcur)
+                    elif bulk >= 2:
                         dbcur.execute(f"PRAGMA locking_mode = {orig_locking};")
                         dbcur.execute(
                             "SELECT name FROM sqlite_master LIMIT 1;"
@@ -199,10 +336,32 @@ class WorkingCopyGPKG(WorkingCopy):
                         dbcur.execute(f"PRAGMA journal_mode = {orig_journal};")
 
                 del dbcur
-                self._db.close()
-                del self._db
+                state.db = None
+                _disconnect(self.full_path, db)
                 L.debug(f"session(bulk={bulk}): new/done")
 
+    def _checkpoint(self, dbcur):
+        """
+        Copies everything in the WAL back into the working copy, and truncates the WAL - waiting a little while
+        for any readers that are still using the WAL to finish. If they don't, the rest of the WAL is copied
+        back by a later checkpoint.
+        """
+        db = dbcur.getconnection()
+        db.setbusytimeout(WAL_CHECKPOINT_BUSY_TIMEOUT)
+        try:
+            with phase("sqlite write"):
+                busy, wal_pages, done_pages = dbcur.execute(
+                    "PRAGMA wal_checkpoint(TRUNCATE);"
+                ).fetchone()
+        finally:
+            db.setbusytimeout(WAL_BUSY_TIMEOUT)
+        if busy:
+            L.info(
+                "Checkpointed %d/%d WAL pages - the working copy is still being read",
+                done_pages,
+                wal_pages,
+            )
+
     def is_dirty(self):
         """
         Returns True if there are uncommitted changes in the working copy,
@@ -224,9 +383,15 @@ class WorkingCopyGPKG(WorkingCopy):
             )
 
     def _get_columns(self, dataset):
+        return self._sqlite_column_specs(
+            dataset.get_gpkg_meta_item("sqlite_table_info")
+        )
+
+    def _sqlite_column_specs(self, sqlite_table_info):
+        """Returns the SQL definition of each column in sqlite_table_info, by name - and the primary key column."""
         pk_field = None
         cols = {}
-        for col in dataset.get_gpkg_meta_item("sqlite_table_info"):
+        for col in sqlite_table_info:
             col_spec = f"{gpkg.ident(col['name'])} {col['type']}"
             if col["pk"]:
                 col_spec += " PRIMARY KEY"
@@ -243,6 +408,7 @@ class WorkingCopyGPKG(WorkingCopy):
 
     def delete(self):
         """ Delete the working copy files """
+        _close_connections(self.full_path)
         self.full_path.unlink()
 
         # for sqlite this might include wal/journal/etc files
@@ -255,6 +421,9 @@ class WorkingCopyGPKG(WorkingCopy):
         return self.full_path.is_file()
 
     def create(self):
+        # GDAL is slow to load, and is only needed to create the working copy and its spatial indexes.
+        from osgeo import gdal
+
         # GDAL: Create GeoPackage
         # GDAL: Add metadata/etc
         gdal_driver = gdal.GetDriverByName("GPKG")
@@ -452,6 +621,8 @@ class WorkingCopyGPKG(WorkingCopy):
         )
 
     def _create_spatial_index(self, dataset):
+        from osgeo import gdal
+
         L = logging.getLogger(f"{self.__class__.__qualname__}.write_full")
 
         geom_col = dataset.geom_column_name
@@ -467,11 +638,14 @@ class WorkingCopyGPKG(WorkingCopy):
         L.debug(
             "Creating spatial index for %s.%s: %s", dataset.table_name, geom_col, sql
         )
-        gdal_ds.ExecuteSQL(sql)
+        with phase("sqlite write"):
+            gdal_ds.ExecuteSQL(sql)
         del gdal_ds
         L.info("Created spatial index in %ss", time.monotonic() - t0)
 
     def _drop_spatial_index(self, dataset):
+        from osgeo import gdal
+
         L = logging.getLogger(f"{self.__class__.__qualname__}.write_full")
 
         geom_col = dataset.geom_column_name
@@ -508,13 +682,106 @@ class WorkingCopyGPKG(WorkingCopy):
         finally:
             self._create_triggers(dbcur, table)
 
+    @contextlib.contextmanager
+    def _suspend_spatial_index(self, dbcur, dataset):
+        """
+        Drops the triggers which keep the GeoPackage spatial index of the dataset's table up to date, for the
+        duration of this context - and then rebuilds the whole index and restores the triggers.
+        Does nothing if the table has no spatial index.
+        """
+        table = dataset.table_name
+        geom_col = dataset.geom_column_name
+        rtree = f"rtree_{table}_{geom_col}"
+        dbcur.execute(
+            """
+            SELECT COUNT(*) FROM gpkg_extensions
+            WHERE table_name=? AND column_name=? AND extension_name='gpkg_rtree_index';
+            """,
+            (table, geom_col),
+        )
+        if not dbcur.fetchone()[0]:
+            yield
+            return
+
+        dbcur.execute(
+            """
+            SELECT name, sql FROM sqlite_master
+            WHERE type='trigger' AND tbl_name=? AND substr(name, 1, ?)=?;
+            """,
+            (table, len(rtree) + 1, f"{rtree}_"),
+        )
+        triggers = dbcur.fetchall()
+        for name, sql in triggers:
+            dbcur.execute(f"DROP TRIGGER {gpkg.ident(name)};")
+        try:
+            yield
+            self._rebuild_spatial_index(dbcur, dataset, rtree)
+        finally:
+            for name, sql in triggers:
+                dbcur.execute(sql)
+
+    def _rebuild_spatial_index(self, dbcur, dataset, rtree):
+        """
+        Rebuilds the GeoPackage spatial index of the dataset's table from scratch. The entries are inserted in
+        sort-tile-recursive order - sorted into vertical slices by X, and then by Y within each slice - so that
+        neighbouring entries end up in the same nodes of the index.
+        """
+        L = logging.getLogger(f"{self.__class__.__qualname__}._rebuild_spatial_index")
+        t0 = time.monotonic()
+
+        table = gpkg.ident(dataset.table_name)
+        geom = gpkg.ident(dataset.geom_column_name)
+        with phase("sqlite write"):
+            dbcur.execute(f"SELECT COUNT(*) FROM {table};")
+            slices = math.ceil(math.sqrt(dbcur.fetchone()[0] / RTREE_NODE_CAPACITY))
+            dbcur.execute(f"DELETE FROM {gpkg.ident(rtree)};")
+            dbcur.execute(
+                f"""
+                INSERT INTO {gpkg.ident(rtree)} (id, minx, maxx, miny, maxy)
+                SELECT id, minx, maxx, miny, maxy FROM (
+                    SELECT *, NTILE(?) OVER (ORDER BY minx + maxx) AS slice FROM (
+                        SELECT
+                            {gpkg.ident(dataset.primary_key)} AS id,
+                            ST_MinX({geom}) AS minx,
+                            ST_MaxX({geom}) AS maxx,
+                            ST_MinY({geom}) AS miny,
+                            ST_MaxY({geom}) AS maxy
+                        FROM {table}
+                        WHERE {geom} IS NOT NULL AND NOT ST_IsEmpty({geom})
+                    )
+                )
+                ORDER BY slice, miny + maxy;
+                """,
+                (max(slices, 1),),
+            )
+        L.info("Rebuilt spatial index %s in %.1fs", rtree, time.monotonic() - t0)
+
+    def _should_rebuild_spatial_index(self, base_ds, target_ds, change_count):
+        """Whether to rebuild the spatial index after changing this many features, rather than update it as we go."""
+        if not target_ds.has_geometry:
+            return False
+        if base_ds.geom_column_name != target_ds.geom_column_name:
+            return False
+        if change_count < SPATIAL_INDEX_REBUILD_MIN_CHANGES:
+            return False
+        # The table currently has base_ds's features - which were summarised when they were written.
+        return change_count >= SPATIAL_INDEX_REBUILD_MIN_RATIO * base_ds.feature_count()
+
     def update_gpkg_contents(self, dataset, change_time):
         table = dataset.table_name
+        # write_full stores the summary as it reads the features - if it hasn't, the table is scanned instead.
+        summary = get_stored_feature_summary(self.repo, dataset)
 
         with self.session() as db:
             dbcur = db.cursor()
 
-            if dataset.has_geometry:
+            if dataset.has_geometry and summary is not None:
+                # The working copy contains exactly the features in the dataset - no need to scan the table.
+                self._set_gpkg_contents_envelope(dbcur, table, summary.envelope)
+                sql = """
+                    UPDATE gpkg_contents SET last_change=? WHERE table_name=?;
+                """
+            elif dataset.has_geometry:
                 geom_col = dataset.geom_column_name
                 sql = f"""
                     UPDATE gpkg_contents
@@ -681,21 +948,37 @@ class WorkingCopyGPKG(WorkingCopy):
 
                 CHUNK_SIZE = 10000
                 total_features = dataset.feature_count()
-                for rows in self._chunk(dataset.feature_tuples(col_names), CHUNK_SIZE):
-                    dbcur.executemany(sql_insert_features, rows)
-                    feat_progress += len(rows)
-
-                    t0a = time.monotonic()
-                    L.info(
-                        "%.1f%% %d/%d features... @%.1fs (+%.1fs, ~%d F/s)",
-                        feat_progress / total_features * 100,
-                        feat_progress,
-                        total_features,
-                        t0a - t0,
-                        t0a - t0p,
-                        CHUNK_SIZE / (t0a - t0p or 0.001),
-                    )
-                    t0p = t0a
+                checkout_progress = Progress(
+                    "checkout", dataset=dataset.path, total=total_features
+                )
+                # The features are summarised as they are read, so that gpkg_contents can be updated without
+                # scanning the table, and so that the next checkout or reset can reuse the summaries.
+                tree_summaries = []
+                with checkout_progress:
+                    for batch in dataset.features_batched(
+                        col_names,
+                        CHUNK_SIZE,
+                        num_threads=WRITE_FULL_READ_THREADS,
+                        tree_summaries=tree_summaries,
+                    ):
+                        with phase("sqlite write"):
+                            dbcur.executemany(sql_insert_features, batch.rows)
+                        feat_progress += len(batch)
+                        checkout_progress.update(len(batch))
+
+                        t0a = time.monotonic()
+                        L.info(
+                            "%.1f%% %d/%d features... @%.1fs (+%.1fs, ~%d F/s)",
+                            feat_progress / total_features * 100,
+                            feat_progress,
+                            total_features,
+                            t0a - t0,
+                            t0a - t0p,
+                            len(batch) / (t0a - t0p or 0.001),
+                        )
+                        t0p = t0a
+
+                store_feature_summaries(self.repo, dataset, tree_summaries)
 
                 t1 = time.monotonic()
                 L.info("Added %d features to GPKG in %.1fs", feat_progress, t1 - t0)
@@ -741,7 +1024,8 @@ class WorkingCopyGPKG(WorkingCopy):
             ),
             CHUNK_SIZE,
         ):
-            dbcur.executemany(sql_write_feature, rows)
+            with phase("sqlite write"):
+                dbcur.executemany(sql_write_feature, rows)
             feat_count += dbcur.getconnection().changes()
 
         return feat_count
@@ -757,7 +1041,8 @@ class WorkingCopyGPKG(WorkingCopy):
         feat_count = 0
         CHUNK_SIZE = 10000
         for rows in self._chunk(zip(pk_iter), CHUNK_SIZE):
-            dbcur.executemany(sql_del_feature, rows)
+            with phase("sqlite write"):
+                dbcur.executemany(sql_del_feature, rows)
             feat_count += dbcur.getconnection().changes()
 
         return feat_count
@@ -796,6 +1081,54 @@ class WorkingCopyGPKG(WorkingCopy):
 
         Pass a list of PK values to filter results to them
         """
+        ds_diff = DatasetDiff()
+        ds_diff["meta"] = self.diff_db_to_tree_meta(dataset)
+
+        if raise_if_dirty and ds_diff["meta"]:
+            raise WorkingCopyDirty()
+
+        ds_diff["feature"] = DeltaDiff(
+            self.iter_feature_deltas_db_to_tree(
+                dataset,
+                ds_filter=ds_filter,
+                raise_if_dirty=raise_if_dirty,
+                find_renames=self.can_find_renames(ds_diff["meta"]),
+                compare_blob_ids=self.can_compare_blob_ids(ds_diff["meta"]),
+            )
+        )
+        return ds_diff
+
+    def iter_feature_deltas_db_to_tree(
+        self,
+        dataset,
+        ds_filter=UNFILTERED,
+        *,
+        raise_if_dirty=False,
+        find_renames=True,
+        compare_blob_ids=False,
+    ):
+        """
+        Yields a Delta for each feature that differs between a working copy DB and the underlying repository tree,
+        for a single dataset only, in no particular order.
+
+        Pass a list of PK values to filter results to them.
+        If compare_blob_ids is True, features are compared by encoding each working copy row as a blob and comparing
+        its ID to the ID of the blob in the tree, rather than by reading the features from the tree - see
+        can_compare_blob_ids. The old values of updates and deletes are then only read from the tree when needed.
+        """
+        deltas = self._iter_feature_deltas_db_to_tree(
+            dataset,
+            ds_filter=ds_filter,
+            raise_if_dirty=raise_if_dirty,
+            compare_blob_ids=compare_blob_ids,
+        )
+        if find_renames:
+            deltas = self.find_renames(deltas, dataset)
+        yield from deltas
+
+    def _iter_feature_deltas_db_to_tree(
+        self, dataset, ds_filter=UNFILTERED, *, raise_if_dirty=False, compare_blob_ids
+    ):
         ds_filter = ds_filter or UNFILTERED
         pk_filter = ds_filter.get("feature", ())
         with self.session() as db:
@@ -804,13 +1137,6 @@ class WorkingCopyGPKG(WorkingCopy):
             table = dataset.table_name
             pk_field = dataset.primary_key
 
-            ds_diff = DatasetDiff()
-
-            ds_diff["meta"] = self.diff_db_to_tree_meta(dataset)
-
-            if raise_if_dirty and ds_diff["meta"]:
-                raise WorkingCopyDirty()
-
             diff_sql = f"""
                 SELECT
                     {self.TRACKING_TABLE}.pk AS ".__track_pk",
@@ -823,14 +1149,19 @@ class WorkingCopyGPKG(WorkingCopy):
             if pk_filter is not UNFILTERED:
                 diff_sql += f"\nAND {self.TRACKING_TABLE}.pk IN ({','.join(['?']*len(pk_filter))})"
                 params += [str(pk) for pk in pk_filter]
-            dbcur.execute(diff_sql, params)
-
-            feature_diff = DeltaDiff()
-            insert_count = delete_count = 0
+            with phase("sqlite read"):
+                dbcur.execute(diff_sql, params)
 
             geom_col = dataset.geom_column_name
+            if compare_blob_ids:
+                get_feature_delta = functools.partial(
+                    self._feature_delta_by_blob_id,
+                    get_blob_id=git_util.blob_id_getter(dataset.tree),
+                )
+            else:
+                get_feature_delta = self._feature_delta_by_value
 
-            for row in dbcur:
+            for row in timed_iter("sqlite read", dbcur):
                 track_pk = row[0]  # This is always a str
                 db_obj = {k: row[k] for k in row.keys() if k != ".__track_pk"}
 
@@ -844,12 +1175,8 @@ class WorkingCopyGPKG(WorkingCopy):
                         g = normalise_gpkg_geom(g)
                     db_obj[geom_col] = Geometry.of(g)
 
-                try:
-                    repo_obj = dataset.get_feature(track_pk)
-                except KeyError:
-                    repo_obj = None
-
-                if repo_obj == db_obj:
+                delta = get_feature_delta(dataset, track_pk, db_obj)
+                if delta is None:
                     # DB was changed and then changed back - eg INSERT then DELETE.
                     # TODO - maybe delete track_pk from tracking table?
                     continue
@@ -857,26 +1184,74 @@ class WorkingCopyGPKG(WorkingCopy):
                 if raise_if_dirty:
                     raise WorkingCopyDirty()
 
-                if db_obj and not repo_obj:  # INSERT
-                    insert_count += 1
-                    feature_diff.add_delta(Delta.insert((db_obj[pk_field], db_obj)))
+                yield delta
+
+    def _feature_delta_by_value(self, dataset, track_pk, db_obj):
+        """Returns the Delta from the feature in the dataset to the working copy row db_obj, or None if they are equal."""
+        pk_field = dataset.primary_key
+        try:
+            repo_obj = dataset.get_feature(track_pk)
+        except KeyError:
+            repo_obj = None
 
-                elif repo_obj and not db_obj:  # DELETE
-                    delete_count += 1
-                    feature_diff.add_delta(Delta.delete((repo_obj[pk_field], repo_obj)))
+        if repo_obj == db_obj:
+            return None
 
-                else:  # UPDATE
-                    pk = db_obj[pk_field]
-                    feature_diff.add_delta(Delta.update((pk, repo_obj), (pk, db_obj)))
+        if db_obj and not repo_obj:  # INSERT
+            return Delta.insert((db_obj[pk_field], db_obj))
 
-        if (
-            self.can_find_renames(ds_diff["meta"])
-            and (insert_count + delete_count) <= 400
-        ):
-            self.find_renames(feature_diff, dataset)
+        elif repo_obj and not db_obj:  # DELETE
+            return Delta.delete((repo_obj[pk_field], repo_obj))
 
-        ds_diff["feature"] = feature_diff
-        return ds_diff
+        else:  # UPDATE
+            pk = db_obj[pk_field]
+            return Delta.update((pk, repo_obj), (pk, db_obj))
+
+    def _feature_delta_by_blob_id(self, dataset, track_pk, db_obj, *, get_blob_id):
+        """
+        Like _feature_delta_by_value, but compares the working copy row to the feature in the dataset by blob ID.
+        The feature in the dataset is only read if the value of the returned Delta is needed.
+        """
+        if db_obj is not None:
+            pk = db_obj[dataset.primary_key]
+            path, data = dataset.encode_feature(db_obj)
+            repo_blob_id = get_blob_id(dataset.rel_path(path))
+            if repo_blob_id is None:  # INSERT
+                return Delta.insert((pk, db_obj))
+            elif repo_blob_id == pygit2.hash(data):
+                return None
+            elif not self._is_same_legend(dataset, dataset.rel_path(path), data):
+                # The feature might still be the same, but encoded differently - eg, using an older schema.
+                return self._feature_delta_by_value(dataset, track_pk, db_obj)
+            else:  # UPDATE
+                repo_obj_promise = functools.partial(dataset.get_feature, pk)
+                return Delta.update((pk, repo_obj_promise), (pk, db_obj))
+
+        rel_path = dataset.encode_1pk_to_path(track_pk, relative=True)
+        if get_blob_id(rel_path) is None:
+            return None
+        else:  # DELETE
+            pk = dataset.decode_path_to_1pk(rel_path)
+            repo_obj_promise = functools.partial(dataset.get_feature, pk)
+            return Delta.delete((pk, repo_obj_promise))
+
+    def _is_same_legend(self, dataset, rel_path, data):
+        """
+        Returns True if the feature at rel_path in the dataset was encoded using the same legend as the given data.
+        If so, and their blob IDs differ, then the features differ. Dataset1 features don't have legends.
+        """
+        if dataset.version < 2:
+            return True
+        repo_data = dataset.get_data_at(rel_path, as_memoryview=True)
+        return msg_unpack(repo_data)[0] == msg_unpack(data)[0]
+
+    def can_compare_blob_ids(self, meta_diff):
+        """
+        Can we compare features by blob ID? Only if the schema hasn't changed, since working copy rows are encoded
+        using the dataset's schema. Features which were encoded using a different legend - eg, using an older
+        schema - are compared by value instead.
+        """
+        return "schema.json" not in meta_diff
 
     def can_find_renames(self, meta_diff):
         """Can we find a renamed (aka moved) feature? There's no point looking for renames if the schema has changed."""
@@ -895,34 +1270,53 @@ class WorkingCopyGPKG(WorkingCopy):
         dt.pop("type_updates")
         return sum(dt.values()) == 0
 
-    def find_renames(self, feature_diff, dataset):
+    # Renames aren't looked for if there are more than this many inserts + deletes.
+    FIND_RENAMES_MAX_CANDIDATES = 400
+
+    def find_renames(self, deltas, dataset):
         """
         Matches inserts + deletes into renames on a best effort basis.
         changes at most one matching insert and delete into an update per blob-hash.
-        Modifies feature_diff in place.
+        Yields the resulting deltas - updates are yielded straight away, but inserts and deletes
+        are held back until all deltas have been seen, unless there are too many of them to bother matching.
         """
 
         def hash_feature(feature):
             return pygit2.hash(dataset.encode_feature_blob(feature)).hex
 
+        candidates = []
+        deltas = iter(deltas)
+        for delta in deltas:
+            if delta.type == "update":
+                yield delta
+                continue
+            candidates.append(delta)
+            if len(candidates) > self.FIND_RENAMES_MAX_CANDIDATES:
+                yield from candidates
+                yield from deltas
+                return
+
         inserts = {}
         deletes = {}
-
-        for delta in feature_diff.values():
+        for delta in candidates:
             if delta.type == "insert":
                 inserts[hash_feature(delta.new_value)] = delta
             elif delta.type == "delete":
                 deletes[hash_feature(delta.old_value)] = delta
 
+        renamed = set()
         for h in deletes:
             if h in inserts:
                 delete_delta = deletes[h]
                 insert_delta = inserts[h]
-
-                del feature_diff[delete_delta.key]
-                del feature_diff[insert_delta.key]
+                renamed.update((delete_delta.key, insert_delta.key))
                 update_delta = delete_delta + insert_delta
-                feature_diff.add_delta(update_delta)
+                if update_delta is not None:
+                    yield update_delta
+
+        for delta in candidates:
+            if delta.key not in renamed:
+                yield delta
 
     def diff_to_tree(self, repo_filter=UNFILTERED, raise_if_dirty=False):
         """
@@ -944,6 +1338,56 @@ class WorkingCopyGPKG(WorkingCopy):
         repo_diff.prune()
         return repo_diff
 
+    def feature_change_counts(self, dataset):
+        """
+        Counts the features that differ between the working copy and the dataset, by type, without reading or
+        comparing them: each tracked row which has been deleted from the working copy is a delete if the feature is in
+        the dataset, and each other tracked row is an update if the feature is in the dataset, or an insert if not.
+        So unlike diff_db_to_tree, a row which was changed and then changed back is counted as an update, and a
+        feature whose primary key was changed is counted as a delete and an insert, rather than as an update.
+        """
+        get_blob_id = git_util.blob_id_getter(dataset.tree)
+        table = gpkg.ident(dataset.table_name)
+        pk_field = gpkg.ident(dataset.primary_key)
+        counts = {"inserts": 0, "updates": 0, "deletes": 0}
+        with self.session() as db:
+            dbcur = db.cursor()
+            sql = f"""
+                SELECT {self.TRACKING_TABLE}.pk, {table}.{pk_field} IS NOT NULL
+                FROM {self.TRACKING_TABLE} LEFT OUTER JOIN {table}
+                ON ({self.TRACKING_TABLE}.pk = {table}.{pk_field})
+                WHERE ({self.TRACKING_TABLE}.table_name = ?);
+            """
+            with phase("sqlite read"):
+                dbcur.execute(sql, (dataset.table_name,))
+            for track_pk, in_db in timed_iter("sqlite read", dbcur):
+                rel_path = dataset.encode_1pk_to_path(track_pk, relative=True)
+                in_tree = get_blob_id(rel_path) is not None
+                if in_db:
+                    counts["updates" if in_tree else "inserts"] += 1
+                elif in_tree:
+                    counts["deletes"] += 1
+        return {k: v for k, v in counts.items() if v}
+
+    def diff_to_tree_counts(self):
+        """
+        Counts the changes between the working copy and the underlying repository tree, for every dataset -
+        in the same form as RepoDiff.type_counts(), but using feature_change_counts, which is much faster
+        than diff_to_tree when there are many changes, but which can count some features differently.
+        """
+        result = {}
+        for dataset in RepositoryStructure.lookup(self.repo, self.get_db_tree()):
+            ds_counts = {}
+            meta_counts = self.diff_db_to_tree_meta(dataset).type_counts()
+            if meta_counts:
+                ds_counts["meta"] = meta_counts
+            feature_counts = self.feature_change_counts(dataset)
+            if feature_counts:
+                ds_counts["feature"] = feature_counts
+            if ds_counts:
+                result[dataset.path] = ds_counts
+        return result
+
     def reset_tracking_table(self, reset_filter=UNFILTERED):
         reset_filter = reset_filter or UNFILTERED
 
@@ -985,17 +1429,19 @@ class WorkingCopyGPKG(WorkingCopy):
                 db.changes() == 1
             ), f"{self.STATE_TABLE} update: expected 1Δ, got {db.changes()}"
 
-    def _is_meta_update_supported(self, dataset_version, meta_diff):
+    def _is_meta_update_supported(self, dataset, meta_diff):
         """
         Returns True if the given meta-diff is supported *without* dropping and rewriting the table.
         (Any meta change is supported - even in datasets v1 - if we drop and rewrite the table,
         but of course it is less efficient).
+        dataset - the dataset that the working copy table is currently based on - its features are the ones which
+            stay in the table, the rest are rewritten anyway.
         meta_diff - DeltaDiff object containing the meta changes.
         """
         if not meta_diff:
             return True
 
-        if dataset_version < 2:
+        if dataset.version < 2:
             # Dataset1 doesn't support meta changes at all - except by rewriting the entire table.
             return False
 
@@ -1008,10 +1454,35 @@ class WorkingCopyGPKG(WorkingCopy):
 
         old_schema = Schema.from_column_dicts(schema_delta.old_value)
         new_schema = Schema.from_column_dicts(schema_delta.new_value)
-        dt = old_schema.diff_type_counts(new_schema)
-        # We do support name_updates, but we don't support any other type of schema update - except by rewriting the entire table.
-        dt.pop("name_updates")
-        return sum(dt.values()) == 0
+        if not self._is_schema_update_supported(old_schema, new_schema):
+            return False
+        # A column which is added might be being put back after it was deleted - if so, the features still
+        # have values for it, which can only be written by rewriting the table.
+        inserts = old_schema.diff_types(new_schema)["inserts"]
+        return not (inserts & dataset.legend_column_ids())
+
+    def _is_schema_update_supported(self, old_schema, new_schema):
+        """
+        Returns True if the table can be changed from old_schema to new_schema in place - see _apply_meta_schema_json.
+        Columns can be renamed, reordered, added or deleted, and their types can be changed within the same data type
+        (eg integer size, text length) - except for primary key and geometry columns, which can only be renamed.
+        """
+        dt = old_schema.diff_types(new_schema)
+        if dt["pk_updates"]:
+            return False
+
+        def is_plain_column(col):
+            return col.pk_index is None and col.data_type != "geometry"
+
+        if not all(is_plain_column(new_schema[col_id]) for col_id in dt["inserts"]):
+            return False
+        if not all(is_plain_column(old_schema[col_id]) for col_id in dt["deletes"]):
+            return False
+        for col_id in dt["type_updates"]:
+            old_col, new_col = old_schema[col_id], new_schema[col_id]
+            if not is_plain_column(old_col) or old_col.data_type != new_col.data_type:
+                return False
+        return True
 
     def _apply_meta_title(self, table_name, src_value, dest_value, db, dbcur):
         # TODO - find a better way to roundtrip titles while keeping them unique
@@ -1028,16 +1499,20 @@ class WorkingCopyGPKG(WorkingCopy):
         )
 
     def _apply_meta_schema_json(self, table_name, src_value, dest_value, db, dbcur):
+        """
+        Changes the table's columns from src_schema to dest_schema without rewriting any features from the repository.
+        Renames and columns added after the existing columns are done using ALTER TABLE - any other changes
+        rebuild the table within SQLite, see _rebuild_table.
+        """
         src_schema = Schema.from_column_dicts(src_value)
         dest_schema = Schema.from_column_dicts(dest_value)
-
-        diff_types = src_schema.diff_types(dest_schema)
-        name_updates = diff_types.pop("name_updates")
-        if any(dt for dt in diff_types.values()):
+        if not self._is_schema_update_supported(src_schema, dest_schema):
             raise RuntimeError(
-                f"This schema change not supported by update - should be drop + rewrite_full: {diff_types}"
+                f"This schema change not supported by update - should be drop + rewrite_full: {src_schema.diff_type_counts(dest_schema)}"
             )
 
+        diff_types = src_schema.diff_types(dest_schema)
+        name_updates = diff_types.pop("name_updates")
         for col_id in name_updates:
             src_name = src_schema[col_id].name
             dest_name = dest_schema[col_id].name
@@ -1045,6 +1520,68 @@ class WorkingCopyGPKG(WorkingCopy):
                 f"""ALTER TABLE {gpkg.ident(table_name)} RENAME COLUMN {gpkg.ident(src_name)} TO {gpkg.ident(dest_name)}"""
             )
 
+        inserts = diff_types.pop("inserts")
+        if any(diff_types.values()):
+            self._rebuild_table(table_name, src_schema, dest_schema, dbcur)
+        elif inserts:
+            # The new columns are all after the existing columns.
+            cols, pk_field = self._sqlite_column_specs(
+                gpkg_adapter.schema_to_sqlite_table_info(dest_schema)
+            )
+            for col in dest_schema:
+                if col.id in inserts:
+                    dbcur.execute(
+                        f"ALTER TABLE {gpkg.ident(table_name)} ADD COLUMN {cols[col.name]};"
+                    )
+
+    def _rebuild_table(self, table_name, src_schema, dest_schema, dbcur):
+        """
+        Changes the table's columns to dest_schema by creating a new table and copying the rows into it with a single
+        INSERT ... SELECT. The table's indexes and triggers are recreated, and the tracking table is left as it is.
+        Any columns which are in both schemas must already have their names from dest_schema.
+        """
+        L = logging.getLogger(f"{self.__class__.__qualname__}._rebuild_table")
+        t0 = time.monotonic()
+
+        table = gpkg.ident(table_name)
+        new_table = self._sno_table(table_name, "rebuild")
+        dbcur.execute(
+            """
+            SELECT type, name, sql FROM sqlite_master
+            WHERE tbl_name=? AND type IN ('index', 'trigger') AND sql IS NOT NULL;
+            """,
+            (table_name,),
+        )
+        dependents = dbcur.fetchall()
+
+        cols, pk_field = self._sqlite_column_specs(
+            gpkg_adapter.schema_to_sqlite_table_info(dest_schema)
+        )
+        dbcur.execute(f"CREATE TABLE {new_table} ({', '.join(cols.values())});")
+        copy_cols = ", ".join(
+            gpkg.ident(col.name) for col in dest_schema if col.id in src_schema
+        )
+        with phase("sqlite write"):
+            dbcur.execute(
+                f"INSERT INTO {new_table} ({copy_cols}) SELECT {copy_cols} FROM {table};"
+            )
+        dbcur.execute(f"DROP TABLE {table};")
+        # Don't check every other trigger and view in the GeoPackage while renaming.
+        dbcur.execute("PRAGMA legacy_alter_table = ON;")
+        dbcur.execute(f"ALTER TABLE {new_table} RENAME TO {table};")
+        dbcur.execute("PRAGMA legacy_alter_table = OFF;")
+
+        for obj_type, name, sql in dependents:
+            try:
+                dbcur.execute(sql)
+            except apsw.SQLError as e:
+                # eg, an index of a column which was deleted.
+                L.warning(
+                    "Couldn't recreate %s %s on %s: %s", obj_type, name, table_name, e
+                )
+
+        L.info("Rebuilt table %s in %.1fs", table_name, time.monotonic() - t0)
+
     def _apply_meta_metadata_dataset_json(
         self, table_name, src_value, dest_value, db, dbcur
     ):
@@ -1075,7 +1612,13 @@ class WorkingCopyGPKG(WorkingCopy):
             func(table_name, delta.old_value, delta.new_value, db, dbcur)
 
     def _apply_feature_diff(
-        self, base_ds, target_ds, db, dbcur, track_changes_as_dirty=False
+        self,
+        base_ds,
+        target_ds,
+        db,
+        dbcur,
+        track_changes_as_dirty=False,
+        feature_diff_index=None,
     ):
         """
         Change the features of this working copy from their current state, base_ds - to the desired state, target_ds.
@@ -1083,8 +1626,12 @@ class WorkingCopyGPKG(WorkingCopy):
         target_ds - dataset containing the desired features of the WC table.
         db, dbcur - database, database cursor.
         track_changes_as_dirty - whether to track these changes as working-copy edits in the tracking table.
+        feature_diff_index - the diff between the feature trees of base_ds and target_ds, if already known.
         """
-        feature_diff_index = base_ds.feature_tree.diff_to_tree(target_ds.feature_tree)
+        if feature_diff_index is None:
+            feature_diff_index = base_ds.feature_tree.diff_to_tree(
+                target_ds.feature_tree
+            )
         if not feature_diff_index:
             return
 
@@ -1117,9 +1664,16 @@ class WorkingCopyGPKG(WorkingCopy):
             # We want to track these changes as working copy edits so they can be committed later.
             ctx = contextlib.nullcontext()
 
-        with ctx:
-            self.delete_features(dbcur, base_ds, delete_pks)
-            self.write_features(dbcur, target_ds, insert_and_update_pks)
+        reset_progress = Progress(
+            "reset",
+            dataset=target_ds.path,
+            total=len(delete_pks) + len(insert_and_update_pks),
+        )
+        with ctx, reset_progress:
+            self.delete_features(dbcur, base_ds, reset_progress.iter(delete_pks))
+            self.write_features(
+                dbcur, target_ds, reset_progress.iter(insert_and_update_pks)
+            )
 
     def reset(
         self,
@@ -1190,20 +1744,17 @@ class WorkingCopyGPKG(WorkingCopy):
 
         for table in table_updates:
             base_ds = base_datasets[table]
-            ds_version = base_ds.version
 
             # Do we support changing the WC metadata to back to base_ds metadata?
             rev_wc_meta_diff = self.diff_db_to_tree_meta(base_ds)
-            update_supported = self._is_meta_update_supported(
-                ds_version, rev_wc_meta_diff
-            )
+            update_supported = self._is_meta_update_supported(base_ds, rev_wc_meta_diff)
 
             # And, do we support then changing it from base_ds metadata to target_ds metadata?
             target_ds = target_datasets[table]
             if target_ds != base_ds:
                 rev_rev_meta_diff = base_ds.diff_meta(target_ds)
                 update_supported = update_supported and self._is_meta_update_supported(
-                    ds_version, rev_rev_meta_diff
+                    base_ds, rev_rev_meta_diff
                 )
 
             if not update_supported:
@@ -1285,26 +1836,61 @@ class WorkingCopyGPKG(WorkingCopy):
         track_changes_if_dirty - whether to track changes made from base_ds -> target_ds as WC edits.
         """
 
-        self._apply_meta_diff(base_ds, ~self.diff_db_to_tree_meta(base_ds), db, dbcur)
-        # WC now has base_ds structure and so we can write base_ds features to WC.
-        self._reset_dirty_rows(base_ds, db, dbcur)
-
+        # Estimate how many features are about to change, from the tracking table and the tree diff.
+        dbcur.execute(
+            f"SELECT COUNT(*) FROM {self.TRACKING_TABLE} WHERE table_name=?;",
+            (base_ds.table_name,),
+        )
+        change_count = dbcur.fetchone()[0]
+        feature_diff_index = None
         if target_ds != base_ds:
-            self._apply_meta_diff(base_ds, base_ds.diff_meta(target_ds), db, dbcur)
-            # WC now has target_ds structure and so we can write target_ds features to WC.
-            self._apply_feature_diff(
-                base_ds,
-                target_ds,
-                db,
-                dbcur,
-                track_changes_as_dirty=track_changes_as_dirty,
+            feature_diff_index = base_ds.feature_tree.diff_to_tree(
+                target_ds.feature_tree
             )
+            change_count += len(feature_diff_index)
 
-        self._update_gpkg_contents(target_ds, db, dbcur, commit)
+        rebuild_spatial_index = self._should_rebuild_spatial_index(
+            base_ds, target_ds, change_count
+        )
+        if rebuild_spatial_index:
+            L.info("Suspending spatial index for %s changes", change_count)
+            ctx = self._suspend_spatial_index(dbcur, target_ds)
+        else:
+            ctx = contextlib.nullcontext()
+
+        with ctx:
+            self._apply_meta_diff(
+                base_ds, ~self.diff_db_to_tree_meta(base_ds), db, dbcur
+            )
+            # WC now has base_ds structure and so we can write base_ds features to WC.
+            self._reset_dirty_rows(base_ds, db, dbcur)
+
+            if target_ds != base_ds:
+                self._apply_meta_diff(base_ds, base_ds.diff_meta(target_ds), db, dbcur)
+                # WC now has target_ds structure and so we can write target_ds features to WC.
+                self._apply_feature_diff(
+                    base_ds,
+                    target_ds,
+                    db,
+                    dbcur,
+                    track_changes_as_dirty=track_changes_as_dirty,
+                    feature_diff_index=feature_diff_index,
+                )
 
-    def _update_gpkg_contents(self, dataset, db, dbcur, commit=None):
+        # If only a few features have changed, target_ds can be summarised from base_ds's summary by reading just
+        # the subtrees that have changed. Otherwise, the table is scanned - see _update_gpkg_contents.
+        summarise = (
+            not rebuild_spatial_index
+            and get_stored_feature_summary(self.repo, base_ds) is not None
+        )
+        self._update_gpkg_contents(target_ds, db, dbcur, commit, summarise=summarise)
+
+    def _update_gpkg_contents(self, dataset, db, dbcur, commit=None, summarise=False):
         """
         Update the metadata for the given table in gpkg_contents to have the new bounding-box / last-updated timestamp.
+        The bounding box comes from the dataset's stored summary if there is one - or if summarise is True, the
+        dataset is summarised, which reads every feature in any subtree that hasn't been summarised before.
+        Otherwise, the table is scanned.
         """
         if commit:
             change_time = datetime.utcfromtimestamp(commit.commit_time)
@@ -1315,7 +1901,20 @@ class WorkingCopyGPKG(WorkingCopy):
 
         table = dataset.table_name
         geom_col = dataset.geom_column_name
+        summary = None
         if geom_col is not None:
+            get_summary = (
+                get_feature_summary if summarise else get_stored_feature_summary
+            )
+            summary = get_summary(self.repo, dataset)
+        if summary is not None:
+            # The working copy table has just been updated to match the dataset - no need to scan the table.
+            self._set_gpkg_contents_envelope(dbcur, table, summary.envelope)
+            dbcur.execute(
+                """UPDATE gpkg_contents SET last_change=? WHERE table_name=?;""",
+                (gpkg_change_time, table),
+            )
+        elif geom_col is not None:
             # FIXME: Why doesn't Extent(geom) work here as an aggregate?
             dbcur.execute(
                 f"""
@@ -1348,6 +1947,15 @@ class WorkingCopyGPKG(WorkingCopy):
         rowcount = db.changes()
         assert rowcount == 1, f"gpkg_contents update: expected 1Δ, got {rowcount}"
 
+    def _set_gpkg_contents_envelope(self, dbcur, table, envelope):
+        min_x, max_x, min_y, max_y = envelope or (None, None, None, None)
+        dbcur.execute(
+            """
+            UPDATE gpkg_contents SET min_x=?, min_y=?, max_x=?, max_y=? WHERE table_name=?;
+            """,
+            (min_x, min_y, max_x, max_y, table),
+        )
+
     def _reset_dirty_rows(self, base_ds, db, dbcur):
         """
         Reset the dirty rows recorded in the tracking table to match the originals from the dataset.
@@ -1364,7 +1972,7 @@ class WorkingCopyGPKG(WorkingCopy):
 
         # We're resetting the dirty rows so we don't track these changes in the tracking table.
         with self._suspend_triggers(dbcur, table):
-            # todo: suspend/remove spatial index
+            # The spatial index is suspended by _update_table if there are many dirty rows.
             L.debug("Cleaning up dirty rows...")
 
             track_count = db.changes()
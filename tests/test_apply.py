@@ -66,6 +66,35 @@ def test_apply_twice(data_archive, cli_runner):
         assert 'Patch does not apply' in r.stderr
 
 
+def test_apply_in_batches(data_archive, cli_runner, monkeypatch):
+    from sno import json_patch, structure
+
+    patch_path = patches / 'points-1U-1D-1I.snopatch'
+    with data_archive("points") as repo_dir:
+        r = cli_runner.invoke(["apply", str(patch_path)])
+        assert r.exit_code == 0, r.stderr
+        expected_tree_id = pygit2.Repository(str(repo_dir)).head.peel(pygit2.Tree).id
+
+    # Read the patch a few bytes at a time, and write each feature change to the tree separately.
+    monkeypatch.setattr(json_patch, "_READ_SIZE", 16)
+    monkeypatch.setattr(structure, "FEATURE_TREE_BATCH_SIZE", 1)
+    with data_archive("points") as repo_dir:
+        r = cli_runner.invoke(["--progress-format=jsonl", "apply", str(patch_path)])
+        assert r.exit_code == 0, r.stderr
+        repo = pygit2.Repository(str(repo_dir))
+        assert repo.head.peel(pygit2.Tree).id == expected_tree_id
+
+        events = [json.loads(line) for line in r.stderr.splitlines()]
+        assert [e["event"] for e in events if e["phase"] == "write"] == [
+            "start",
+            "end",
+        ]
+        assert events[-1]["done"] == 3
+
+        r = cli_runner.invoke(["apply", str(patch_path)])
+        assert r.exit_code == PATCH_DOES_NOT_APPLY
+
+
 def test_apply_with_no_working_copy(data_archive, cli_runner):
     patch_filename = 'updates-only.snopatch'
     message = 'Change the Coromandel'
@@ -291,6 +320,33 @@ def test_apply_multiple_dataset_patch_roundtrip(data_archive, cli_runner):
         assert new_patch_json == patch_json
 
 
+def test_apply_msgpack_patch_roundtrip(data_archive, cli_runner, tmp_path):
+    with data_archive("au-census"):
+        r = cli_runner.invoke(["create-patch", "master"])
+        assert r.exit_code == 0, r.stderr
+        patch_json = json.loads(r.stdout)
+
+        patch_path = tmp_path / "master.snopatch"
+        r = cli_runner.invoke(
+            ["create-patch", "master", "-o", "msgpack", f"--output={patch_path}"]
+        )
+        assert r.exit_code == 0, r.stderr
+        assert patch_path.read_bytes().startswith(b"SNOPATCH")
+
+        r = cli_runner.invoke(["apply", str(patch_path)])
+        assert r.exit_code == 0, r.stderr
+
+        r = cli_runner.invoke(["create-patch", "HEAD"])
+        assert r.exit_code == 0, r.stderr
+        assert json.loads(r.stdout) == patch_json
+
+        # A truncated patch doesn't apply
+        patch_path.write_bytes(patch_path.read_bytes()[:-10])
+        r = cli_runner.invoke(["apply", str(patch_path)])
+        assert r.exit_code == 1, r
+        assert "Failed to parse binary patch file" in r.stderr
+
+
 @pytest.mark.slow
 def test_apply_benchmark(
     data_working_copy, geopackage, benchmark, cli_runner, monkeypatch
@@ -1,8 +1,12 @@
+import json
 import re
+import subprocess
+import sys
 
+import click
 import pytest
 
-from sno import cli
+from sno import cli, progress
 
 
 H = pytest.helpers.helpers()
@@ -16,7 +20,135 @@ def test_version(cli_runner):
 
 def test_cli_help():
     click_app = cli.cli
-    for name, cmd in click_app.commands.items():
+    ctx = click.Context(click_app)
+    for name in click_app.list_commands(ctx):
         if name == 'help':
             continue
+        cmd = click_app.get_command(ctx, name)
         assert cmd.help, f"`{name}` command has no help text"
+
+
+def test_profiling_options(data_archive_readonly, cli_runner, tmp_path):
+    profile_path = tmp_path / "show.pstats"
+    with data_archive_readonly("points2"):
+        r = cli_runner.invoke(
+            [
+                "--profile",
+                str(profile_path),
+                "--trace-memory",
+                "show",
+                "-o",
+                "json",
+                "HEAD",
+            ]
+        )
+        assert r.exit_code == 0, r.stderr
+
+    assert profile_path.exists()
+    assert "Phase timings" in r.stderr
+    assert re.search(r"^  tree diff +\d", r.stderr, re.MULTILINE)
+    assert re.search(r"^  blob decode +\d", r.stderr, re.MULTILINE)
+    assert re.search(r"^  output +\d", r.stderr, re.MULTILINE)
+    assert "Memory: peak" in r.stderr
+    assert "Top allocators" in r.stderr
+
+    # Methods are only instrumented during profiled commands.
+    from sno.dataset2 import Dataset2
+
+    assert Dataset2.get_feature.__module__ == "sno.dataset2"
+    assert not hasattr(Dataset2.get_feature, "__wrapped__")
+
+
+def test_progress_format_jsonl(data_archive_readonly, cli_runner, tmp_path):
+    with data_archive_readonly("gpkg-points") as data:
+        r = cli_runner.invoke(
+            [
+                "--progress-format=jsonl",
+                "init",
+                "--import",
+                data / "nz-pa-points-topo-150k.gpkg",
+                tmp_path / "repo",
+            ]
+        )
+        assert r.exit_code == 0, r.stderr
+
+    events = [
+        json.loads(line) for line in r.stderr.splitlines() if line.startswith("{")
+    ]
+    import_events = [e for e in events if e["phase"] == "import"]
+    assert [e["event"] for e in import_events] == ["start", "end"]
+    end = import_events[-1]
+    assert end["dataset"] == H.POINTS.LAYER
+    assert end["done"] == end["total"] == H.POINTS.ROWCOUNT
+    assert end["bytes"] > 0
+    assert end["rate"] > 0
+
+    checkout_events = [e for e in events if e["phase"] == "checkout"]
+    assert [e["event"] for e in checkout_events] == ["start", "progress", "end"]
+    assert checkout_events[-1]["done"] == H.POINTS.ROWCOUNT
+
+
+def test_progress_events_to_fd(tmp_path):
+    path = tmp_path / "progress.jsonl"
+    with open(path, "w") as f:
+        with progress.progress_events("jsonl", f.fileno()):
+            p = progress.Progress("test", dataset="ds", total=5, unit="things")
+            with p:
+                for x in p.iter(range(5), every=2):
+                    pass
+        # Events aren't written once the command is done.
+        progress.emit("ignored")
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(e["event"], e["done"]) for e in events] == [
+        ("start", 0),
+        ("progress", 2),
+        ("progress", 4),
+        ("end", 5),
+    ]
+    assert all(e["phase"] == "test" and e["dataset"] == "ds" for e in events)
+    assert all(e["total"] == 5 and e["unit"] == "things" for e in events)
+    assert "rate" not in events[0] and "rate" in events[-1]
+
+
+def test_cli_startup_imports():
+    # Command modules are only imported when they are used, so that starting sno doesn't load GDAL, SQLite, etc.
+    code = "import sys; import sno.cli; print('\\n'.join(sys.modules))"
+    r = subprocess.run(
+        [sys.executable, "-c", code], check=True, stdout=subprocess.PIPE, text=True
+    )
+    modules = {name.split(".")[0] for name in r.stdout.splitlines()}
+    assert not modules & {"osgeo", "apsw", "psycopg2", "rtree"}
+
+    # But every command is still available.
+    ctx = click.Context(cli.cli)
+    for name in cli.MODULE_COMMANDS:
+        assert cli.cli.get_command(ctx, name).name == name
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["show", "-o", "json"],
+        ["diff", "HEAD^...HEAD"],
+        ["diff", "HEAD^...HEAD", "-o", "json"],
+        ["create-patch", "HEAD"],
+    ],
+)
+def test_commands_dont_load_gdal(args, data_archive_readonly):
+    # Commands which only read the repository - and don't reproject or convert geometries - don't need GDAL.
+    code = (
+        "import sys; from sno.cli import cli; "
+        "cli.main(args=sys.argv[1:], standalone_mode=False); "
+        "print('\\n'.join(sys.modules), file=sys.stderr)"
+    )
+    with data_archive_readonly("points2"):
+        r = subprocess.run(
+            [sys.executable, "-c", code, *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    modules = {name.split(".")[0] for name in r.stderr.splitlines()}
+    assert "osgeo" not in modules
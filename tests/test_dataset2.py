@@ -1,6 +1,8 @@
+import pygit2
 import pytest
 
 from sno.dataset2 import Dataset2
+from sno.decode_cache import legend_cache
 from sno.schema import Legend, ColumnSchema, Schema
 
 
@@ -35,6 +37,7 @@ class DictTree:
 
         if all_data.get(cur_path) is not None:
             self.data = all_data[cur_path]
+            self.id = pygit2.hash(self.data)
             self.type_str = 'blob'
         else:
             self.type_str = 'tree'
@@ -63,6 +66,23 @@ def test_legend_roundtrip():
     assert roundtripped == orig
 
 
+def test_legend_cache_shared_between_datasets():
+    legend = Legend(["a", "b", "c"], ["d", "e", "f"])
+    path, data = EMPTY_DATASET.encode_legend(legend)
+    tree = DictTree({path: data})
+
+    legend_cache.clear()
+    dataset_a = Dataset2(tree / DATASET_PATH, DATASET_PATH)
+    dataset_b = Dataset2(tree / DATASET_PATH, DATASET_PATH)
+
+    legend_a = dataset_a.get_legend(legend.hexhash())
+    assert (legend_cache.hits, legend_cache.misses) == (0, 1)
+    # A different dataset with the same legend blob doesn't decode it again.
+    legend_b = dataset_b.get_legend(legend.hexhash())
+    assert (legend_cache.hits, legend_cache.misses) == (1, 1)
+    assert legend_b is legend_a
+
+
 def test_raw_dict_to_value_tuples():
     legend = Legend(["a", "b", "c"], ["d", "e", "f"])
     raw_feature_dict = {
@@ -262,3 +282,48 @@ def test_schema_change_roundtrip(gen_uuid):
         "first_name": "Joe",
         "middle_names": None,
     }
+
+
+def test_row_codec(gen_uuid):
+    old_schema = Schema(
+        [
+            ColumnSchema(gen_uuid(), "ID", "integer", 0),
+            ColumnSchema(gen_uuid(), "given_name", "text", None),
+            ColumnSchema(gen_uuid(), "surname", "text", None),
+        ]
+    )
+    new_schema = Schema(
+        [
+            ColumnSchema(old_schema[0].id, "ID", "integer", 0),
+            ColumnSchema(old_schema[2].id, "surname", "text", None),
+            ColumnSchema(gen_uuid(), "middle_names", "text", None),
+        ]
+    )
+    feature = {"ID": 7, "given_name": "Joe", "surname": "Bloggs"}
+
+    # Codecs are only compiled once per (legend, schema).
+    codec = old_schema.row_codec()
+    assert old_schema.row_codec(old_schema.legend) is codec
+    assert codec.legend_hash == old_schema.legend.hexhash()
+
+    # Encoding gives the same result as going via a raw dict.
+    raw_dict = old_schema.feature_to_raw_dict(feature)
+    expected_path, expected_data = EMPTY_DATASET.encode_raw_feature_dict(
+        raw_dict, old_schema.legend
+    )
+    pk_values, data = codec.encode(feature)
+    assert data == expected_data
+    assert EMPTY_DATASET.encode_pks_to_path(pk_values) == expected_path
+    assert codec.encode((7, "Joe", "Bloggs")) == (pk_values, data)
+
+    # Decoding features stored with an old legend using the new schema.
+    new_codec = new_schema.row_codec(old_schema.legend)
+    assert not new_codec.can_encode
+    assert new_codec.decode([7], ["Joe", "Bloggs"], keys=False) == (7, "Bloggs", None)
+    assert new_codec.decode([7], ["Joe", "Bloggs"]) == {
+        "ID": 7,
+        "surname": "Bloggs",
+        "middle_names": None,
+    }
+    with pytest.raises(ValueError):
+        new_codec.encode((7, "Bloggs", None))
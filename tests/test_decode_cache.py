@@ -0,0 +1,38 @@
+from sno.decode_cache import DecodeCache
+
+
+def test_decode_cache():
+    cache = DecodeCache("test", maxsize=2)
+    decoded = []
+
+    def decoder(value):
+        def _decode():
+            decoded.append(value)
+            return value.upper()
+
+        return _decode
+
+    assert cache.get("oid-a", decoder("a")) == "A"
+    assert cache.get("oid-a", decoder("a")) == "A"
+    assert cache.get("oid-b", decoder("b")) == "B"
+    assert decoded == ["a", "b"]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # oid-a was used more recently than oid-b, so oid-b is evicted.
+    assert cache.get("oid-a", decoder("a")) == "A"
+    assert cache.get("oid-c", decoder("c")) == "C"
+    assert len(cache) == 2
+    assert cache.get("oid-b", decoder("b")) == "B"
+    assert decoded == ["a", "b", "c", "b"]
+
+    assert cache.stats() == {
+        "name": "test",
+        "size": 2,
+        "maxsize": 2,
+        "hits": 2,
+        "misses": 4,
+    }
+
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -6,7 +6,7 @@ import html5lib
 import pytest
 
 import pygit2
-from sno.diff_structs import Delta, DeltaDiff
+from sno.diff_structs import Delta, DeltaDiff, DeltaStream
 from sno.geometry import hex_wkb_to_ogr
 from sno.structure import RepositoryStructure
 
@@ -329,6 +329,70 @@ def test_diff_reprojection(
             _check_geojson(odata['nz_pa_points_topo_150k'])
 
 
+def test_diff_geojsonseq(data_working_copy, geopackage, cli_runner, tmp_path):
+    with data_working_copy("points2") as (repo, wc):
+        db = geopackage(wc)
+        with db:
+            cur = db.cursor()
+            cur.execute(H.POINTS.INSERT, H.POINTS.RECORD)
+            cur.execute(f"UPDATE {H.POINTS.LAYER} SET fid=9998 WHERE fid=1;")
+            cur.execute(f"DELETE FROM {H.POINTS.LAYER} WHERE fid=3;")
+
+        r = cli_runner.invoke(["diff", "--output-format=geojson", "--output=-"])
+        assert r.exit_code == 0, r.stderr
+        expected_features = json.loads(r.stdout)["features"]
+        assert len(expected_features) == 4
+
+        # GeoJSONSeq features are written as they are found, rather than sorted.
+        def _sorted(features):
+            return sorted(features, key=lambda f: f["id"])
+
+        r = cli_runner.invoke(["diff", "--output-format=geojsonseq", "--output=-"])
+        assert r.exit_code == 0, r.stderr
+        lines = r.stdout.splitlines()
+        assert _sorted(json.loads(line) for line in lines) == _sorted(expected_features)
+
+        r = cli_runner.invoke(
+            [
+                "diff",
+                "--output-format=geojsonseq",
+                "--json-style=extracompact",
+                f"--output={tmp_path / 'diff.geojsonl'}",
+            ]
+        )
+        assert r.exit_code == 0, r.stderr
+        lines = (tmp_path / "diff.geojsonl").read_text().splitlines()
+        assert _sorted(json.loads(line) for line in lines) == _sorted(expected_features)
+        assert lines[0].startswith('{"type":"Feature",')
+
+
+def test_diff_html_max_features(data_working_copy, geopackage, cli_runner):
+    with data_working_copy("points2") as (repo, wc):
+        db = geopackage(wc)
+        with db:
+            cur = db.cursor()
+            cur.execute(f"DELETE FROM {H.POINTS.LAYER} WHERE fid<=10;")
+
+        r = cli_runner.invoke(["diff", "--output-format=html", "--output=-"])
+        assert r.exit_code == 0, r.stderr
+        fc = _check_html_output(r.stdout)[H.POINTS.LAYER]
+        assert len(fc["features"]) == 10
+        assert "sampled" not in fc
+
+        r = cli_runner.invoke(
+            ["diff", "--output-format=html", "--output=-", "--html-max-features=4"]
+        )
+        assert r.exit_code == 0, r.stderr
+        fc = _check_html_output(r.stdout)[H.POINTS.LAYER]
+        assert fc["sampled"] == {"count": 4, "total": 10}
+        assert [f["id"] for f in fc["features"]] == [
+            "D::1",
+            "D::3",
+            "D::6",
+            "D::8",
+        ]
+
+
 @pytest.mark.parametrize("output_format", DIFF_OUTPUT_FORMATS)
 @pytest.mark.parametrize(*V1_OR_V2)
 def test_diff_polygons(
@@ -1553,3 +1617,43 @@ def test_diff_streaming(repo_version, data_archive_readonly):
             expected_calls += 1
             assert old.get_feature_calls == expected_calls
             assert new.get_feature_calls == expected_calls
+
+
+@pytest.mark.parametrize(*V1_OR_V2)
+def test_diff_delta_stream(repo_version, data_archive_readonly):
+    # Test that a DeltaStream yields the same deltas as the DeltaDiff, sorted or unsorted,
+    # and that each feature is only read as its delta is consumed.
+    data_archive = "points2" if repo_version == "2" else "points"
+    with data_archive_readonly(data_archive) as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        old = RepositoryStructure.lookup(repo, "HEAD^")[H.POINTS.LAYER]
+        new = RepositoryStructure.lookup(repo, "HEAD")[H.POINTS.LAYER]
+
+        expected = old.diff(new)["feature"]
+
+        def override_get_feature(self, *args, **kwargs):
+            self.get_feature_calls += 1
+            return self.__class__.get_feature(self, *args, **kwargs)
+
+        new.get_feature_calls = 0
+        new.get_feature = functools.partial(override_get_feature, new)
+
+        stream = DeltaStream(old.iter_feature_deltas(new))
+        keys = []
+        for key, delta in stream.sorted_items():
+            assert new.get_feature_calls == len(keys)
+            assert delta.new_value == expected[key].new_value
+            keys.append(key)
+
+        assert keys == sorted(expected.keys())
+        assert stream.count() == len(expected) == 5
+
+        # Unsorted, each delta is only generated as it is consumed.
+        stream = DeltaStream(old.iter_feature_deltas(new))
+        keys = []
+        for key, delta in stream.items():
+            keys.append(key)
+            assert repr(stream) == f"DeltaStream(consumed={len(keys)})"
+            assert delta.new_value == expected[key].new_value
+
+        assert sorted(keys) == sorted(expected.keys())
@@ -0,0 +1,103 @@
+import sqlite3
+from pathlib import Path
+
+import pygit2
+import pytest
+
+from sno.feature_summary import (
+    get_feature_summary,
+    get_stored_feature_summary,
+    store_feature_summaries,
+    SUMMARY_DB_PATH,
+)
+from sno.geometry import geom_envelope
+from sno.structure import RepositoryStructure
+
+
+H = pytest.helpers.helpers()
+
+
+def _num_stored_summaries(repo):
+    db = sqlite3.connect(str(Path(repo.path) / SUMMARY_DB_PATH))
+    try:
+        return db.execute("SELECT COUNT(*) FROM tree_summary;").fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_feature_summary(data_archive):
+    with data_archive("points2") as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        old_dataset = RepositoryStructure.lookup(repo, "HEAD^")[H.POINTS.LAYER]
+        new_dataset = RepositoryStructure.lookup(repo, "HEAD")[H.POINTS.LAYER]
+
+        summary = get_feature_summary(repo, old_dataset)
+        assert summary.count == H.POINTS.ROWCOUNT
+        assert sum(summary.shard_counts.values()) == summary.count
+        assert set(summary.shard_counts) == {t.name for t in old_dataset.feature_tree}
+
+        envelopes = [
+            geom_envelope(f["geom"]) for _, f in old_dataset.features() if f["geom"]
+        ]
+        assert summary.envelope == (
+            min(e[0] for e in envelopes),
+            max(e[1] for e in envelopes),
+            min(e[2] for e in envelopes),
+            max(e[3] for e in envelopes),
+        )
+
+        # Summarising again is just a lookup.
+        num_stored = _num_stored_summaries(repo)
+        assert get_feature_summary(repo, old_dataset) == summary
+        assert _num_stored_summaries(repo) == num_stored
+
+        # Summarising the next commit only summarises the subtrees that changed.
+        new_summary = get_feature_summary(repo, new_dataset)
+        assert new_summary.count == new_dataset.feature_count()
+        num_changed = len(new_dataset.diff(old_dataset)["feature"])
+        assert 0 < _num_stored_summaries(repo) - num_stored <= 1 + 2 * num_changed
+
+
+def test_stored_feature_summary(data_archive):
+    with data_archive("points2") as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        dataset = RepositoryStructure.lookup(repo, "HEAD")[H.POINTS.LAYER]
+
+        # Nothing is summarised unless it's already stored.
+        assert get_stored_feature_summary(repo, dataset) is None
+        assert not (Path(repo.path) / SUMMARY_DB_PATH).exists()
+
+        summary = get_feature_summary(repo, dataset)
+        assert get_stored_feature_summary(repo, dataset) == summary
+
+
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_summarise_while_reading(data_archive, monkeypatch, num_threads):
+    with data_archive("points2") as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        dataset = RepositoryStructure.lookup(repo, "HEAD")[H.POINTS.LAYER]
+
+        tree_summaries = []
+        batches = dataset.features_batched(
+            [dataset.primary_key],
+            100,
+            num_threads=num_threads,
+            tree_summaries=tree_summaries,
+        )
+        assert sum(len(batch) for batch in batches) == H.POINTS.ROWCOUNT
+        store_feature_summaries(repo, dataset, tree_summaries)
+        summary = get_stored_feature_summary(repo, dataset)
+        num_stored = _num_stored_summaries(repo)
+
+        # Counting the features is now just a lookup.
+        def _find_blobs_in_tree(*args, **kwargs):
+            raise AssertionError("Features shouldn't be counted")
+
+        monkeypatch.setattr("sno.dataset2.find_blobs_in_tree", _find_blobs_in_tree)
+        assert dataset.feature_count() == H.POINTS.ROWCOUNT
+        monkeypatch.undo()
+
+        # Every subtree is stored, with the same summary as reading the features separately.
+        (Path(repo.path) / SUMMARY_DB_PATH).unlink()
+        assert get_feature_summary(repo, dataset) == summary
+        assert _num_stored_summaries(repo) == num_stored
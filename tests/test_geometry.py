@@ -4,11 +4,15 @@ import pytest
 from osgeo import ogr, osr
 
 from sno.geometry import (
+    geom_envelope,
+    gpkg_geom_summary,
     gpkg_geom_to_hex_wkb,
     gpkg_geom_to_ogr,
+    gpkg_geom_to_wkb,
     hex_wkb_to_gpkg_geom,
     normalise_gpkg_geom,
     ogr_to_gpkg_geom,
+    wkb_to_gpkg_geom,
     GPKG_ENVELOPE_NONE,
     GPKG_ENVELOPE_XY,
 )
@@ -232,3 +236,60 @@ def test_gpkg_wkb_gpkg_roundtrip(
     gpkg_geom = hex_wkb_to_gpkg_geom(hex_wkb_2)
 
     assert gpkg_geom == input
+
+
+@pytest.mark.parametrize(
+    'wkt',
+    [
+        'POINT(1 2)',
+        'POINT Z(1 2 3)',
+        'POINT M(1 2 4)',
+        'POINT ZM(1 2 3 4)',
+        'POINT EMPTY',
+        'LINESTRING(1 2,-3 4.5,5 -6)',
+        'LINESTRING ZM(1 2 3 4,5 6 -7 8)',
+        'LINESTRING EMPTY',
+        'POLYGON((0 0,0 5,5 0,0 0),(1 1,1 2,2 1,1 1))',
+        'POLYGON Z((0 0 1,0 5 2,5 0 3,0 0 1))',
+        'MULTIPOINT((1 2),(3 4))',
+        'MULTIPOINT EMPTY',
+        'MULTILINESTRING M((1 2 3,4 5 6),(7 8 9,10 11 12))',
+        'MULTIPOLYGON(((0 0,0 5,5 0,0 0)),((10 10,10 15,15 10,10 10)))',
+        'GEOMETRYCOLLECTION(POINT(1 2),MULTIPOINT EMPTY,LINESTRING(5 5,-5 -5))',
+        'GEOMETRYCOLLECTION(POINT EMPTY)',
+        'GEOMETRYCOLLECTION EMPTY',
+        'COMPOUNDCURVE((0 0,1 1),(1 1,2 0))',
+        'TRIANGLE((0 0 0,0 1 0,1 1 0,0 0 0))',
+        'TIN(((0 0 0,0 0 1,0 1 0,0 0 0)),((0 0 0,0 1 0,1 1 0,0 0 0)))',
+        'POLYHEDRALSURFACE Z(((0 0 0,0 1 0,1 1 0,0 0 0)))',
+    ],
+)
+@pytest.mark.parametrize('little_endian_wkb', [False, True])
+def test_wkb_codec_matches_ogr(wkt, little_endian_wkb):
+    """
+    Geometries are mostly converted without using OGR - check the results are exactly the same as OGR's,
+    whatever the byte order of the input.
+    """
+    ogr_geom = ogr.CreateGeometryFromWkt(wkt)
+    wkb = ogr_geom.ExportToIsoWkb(ogr.wkbNDR if little_endian_wkb else ogr.wkbXDR)
+    expected = ogr_to_gpkg_geom(ogr_geom)
+
+    assert wkb_to_gpkg_geom(wkb) == expected
+    assert gpkg_geom_to_wkb(expected) == ogr_geom.ExportToIsoWkb(ogr.wkbNDR)
+
+    gpkg_geom = ogr_to_gpkg_geom(
+        ogr_geom,
+        _little_endian=little_endian_wkb,
+        _little_endian_wkb=little_endian_wkb,
+        _add_envelope_type=GPKG_ENVELOPE_NONE,
+    )
+    assert normalise_gpkg_geom(gpkg_geom) == expected
+    assert gpkg_geom_to_wkb(gpkg_geom) == ogr_geom.ExportToIsoWkb(ogr.wkbNDR)
+
+    expected_envelope = None if ogr_geom.IsEmpty() else ogr_geom.GetEnvelope()
+    assert geom_envelope(gpkg_geom) == expected_envelope
+
+    expected_summary = ogr_geom.GetGeometryName() + (
+        " EMPTY" if ogr_geom.IsEmpty() else "(...)"
+    )
+    assert gpkg_geom_summary(gpkg_geom) == expected_summary
@@ -62,6 +62,42 @@ def test_init_import_single_table_source(data_archive_readonly, tmp_path, cli_ru
         assert lines[-1] == "Creating working copy at emptydir.gpkg ..."
 
 
+@pytest.mark.slow
+def test_init_import_multiple_processes(data_archive_readonly, tmp_path, cli_runner):
+    with data_archive_readonly("gpkg-points") as data:
+        tree_ids = []
+        for num_processes in ("1", "2"):
+            repo_path = tmp_path / f"jobs-{num_processes}"
+            r = cli_runner.invoke(
+                [
+                    "init",
+                    "--bare",
+                    "--import",
+                    data / "nz-pa-points-topo-150k.gpkg",
+                    f"--jobs={num_processes}",
+                    str(repo_path),
+                ]
+            )
+            assert r.exit_code == 0, r
+            repo = pygit2.Repository(str(repo_path))
+            tree_ids.append(repo.head.peel(pygit2.Tree).id)
+
+        # Encoding features in parallel makes no difference to the result.
+        assert tree_ids[0] == tree_ids[1]
+
+        r = cli_runner.invoke(
+            [
+                "init",
+                "--repo-version=1",
+                "--import",
+                data / "nz-pa-points-topo-150k.gpkg",
+                "--jobs=2",
+                str(tmp_path / "v1"),
+            ]
+        )
+        assert r.exit_code == INVALID_OPERATION, r
+
+
 @pytest.mark.slow
 def test_init_import_custom_message(data_archive_readonly, tmp_path, cli_runner, chdir):
     with data_archive_readonly("gpkg-points") as data:
@@ -237,6 +273,59 @@ def test_import_replace_existing(
             }
 
 
+def test_import_replace_existing_with_inserts_and_deletes(
+    data_archive, tmp_path, cli_runner, chdir, geopackage,
+):
+    with data_archive("gpkg-polygons") as data:
+        repo_path = tmp_path / 'emptydir'
+        r = cli_runner.invoke(["init", repo_path])
+        assert r.exit_code == 0
+        with chdir(repo_path):
+            r = cli_runner.invoke(
+                [
+                    "import",
+                    data / "nz-waca-adjustments.gpkg",
+                    "nz_waca_adjustments:mytable",
+                ]
+            )
+            assert r.exit_code == 0, r.stderr
+
+            db = geopackage(data / "nz-waca-adjustments.gpkg")
+            dbcur = db.cursor()
+            dbcur.execute("DELETE FROM nz_waca_adjustments WHERE id = 1424927")
+            dbcur.execute(
+                """
+                INSERT INTO nz_waca_adjustments (id, geom, date_adjusted, survey_reference, adjusted_nodes)
+                    SELECT 9999999, geom, date_adjusted, survey_reference, adjusted_nodes
+                    FROM nz_waca_adjustments WHERE id = 1443053
+                """
+            )
+
+            r = cli_runner.invoke(
+                [
+                    "import",
+                    "--replace-existing",
+                    data / "nz-waca-adjustments.gpkg",
+                    "nz_waca_adjustments:mytable",
+                ]
+            )
+            assert r.exit_code == 0, r.stderr
+            r = cli_runner.invoke(["show", "-o", "json"])
+            assert r.exit_code == 0, r.stderr
+            diff = json.loads(r.stdout)["sno.diff/v1+hexwkb"]["mytable"]
+
+            # Only the inserted and deleted features are in the diff.
+            assert "meta" not in diff
+            changes = sorted(
+                (k, v["id"]) for change in diff["feature"] for k, v in change.items()
+            )
+            assert changes == [("+", 9999999), ("-", 1424927)]
+
+            repo = pygit2.Repository(str(repo_path))
+            head_rs = RepositoryStructure.lookup(repo, "HEAD")
+            assert head_rs["mytable"].feature_count() == H.POLYGONS.ROWCOUNT
+
+
 def test_import_replace_existing_with_compatible_schema_changes(
     data_archive, tmp_path, cli_runner, chdir, geopackage,
 ):
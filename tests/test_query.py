@@ -5,6 +5,7 @@ from pathlib import Path
 import pytest
 
 from sno.geometry import hex_wkb_to_ogr
+from sno.spatial_index import SPATIAL_INDEX_DIR
 
 
 H = pytest.helpers.helpers()
@@ -31,14 +32,14 @@ def indexed_dataset(data_archive, cli_runner):
 )
 def test_build_spatial_index(archive, table, data_archive, cli_runner):
     with data_archive(archive) as repo_dir:
-        for p in Path(repo_dir).glob(f"{table}.sno-idx*"):
-            p.unlink()
+        index_dir = Path(repo_dir) / SPATIAL_INDEX_DIR
+        assert not index_dir.exists()
 
         r = cli_runner.invoke(["query", table, "index"])
-        assert r.exit_code == 0
+        assert r.exit_code == 0, r
+        assert r.stdout.startswith("Indexed ")
 
-        assert (Path(repo_dir) / f"{table}.sno-idxi").exists()
-        assert (Path(repo_dir) / f"{table}.sno-idxd").exists()
+        assert len(list(index_dir.glob("*.db"))) == 1
 
 
 def test_query_cli_get(indexed_dataset, cli_runner):
@@ -112,3 +113,27 @@ def test_query_cli_geo_intersects(indexed_dataset, cli_runner):
             assert (
                 intersects
             ), f"No intersection found for idx {i}/{len(data)-1}: {json.dumps(o)}"
+
+
+def test_query_cli_ref(data_archive, cli_runner):
+    with data_archive("points") as repo_dir:
+        r = cli_runner.invoke(["query", H.POINTS.LAYER, "geo-nearest", "177,-38"])
+        assert r.exit_code == 0, r
+        assert json.loads(r.stdout)[0]["fid"] == 147
+
+        r = cli_runner.invoke(
+            ["query", "--ref=HEAD^", H.POINTS.LAYER, "geo-count", "177,-38,177.1,-37.9"]
+        )
+        assert r.exit_code == 0, r
+        assert json.loads(r.stdout) == 6
+
+        # One index per version of the dataset
+        index_dir = Path(repo_dir) / SPATIAL_INDEX_DIR
+        assert len(list(index_dir.glob("*.db"))) == 2
+
+        r = cli_runner.invoke(["query", "--ref=HEAD^", H.POINTS.LAYER, "get", "1095"])
+        assert r.exit_code == 0, r
+        assert json.loads(r.stdout)["name"] is None
+        r = cli_runner.invoke(["query", H.POINTS.LAYER, "get", "1095"])
+        assert r.exit_code == 0, r
+        assert json.loads(r.stdout)["name"] is not None
@@ -0,0 +1,131 @@
+import threading
+
+import pygit2
+import pytest
+
+from sno.serve import NO_SERVER_ENV, SnoServer, get_socket_path
+
+
+@pytest.fixture
+def sno_server():
+    """Runs a server for the repository in a thread, for the duration of the test."""
+
+    servers = []
+
+    def _start(repo_dir):
+        server = SnoServer(pygit2.Repository(str(repo_dir)))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        return server
+
+    yield _start
+
+    for server, thread in servers:
+        server.shutdown()
+        thread.join()
+        server.close()
+
+
+def test_serve(data_archive, sno_server, cli_runner):
+    with data_archive("points2") as repo_dir:
+        args = ["diff", "HEAD^...HEAD", "-o", "json"]
+        expected = cli_runner.invoke(args)
+        assert expected.exit_code == 0, expected
+
+        server = sno_server(repo_dir)
+        assert get_socket_path(repo_dir).exists()
+
+        calls = []
+        orig_run_command = server.run_command
+
+        def _run_command(*args, **kwargs):
+            calls.append(args)
+            return orig_run_command(*args, **kwargs)
+
+        server.run_command = _run_command
+
+        r = cli_runner.invoke(args)
+        assert r.exit_code == 0, r
+        assert r.stdout == expected.stdout
+        assert len(calls) == 1
+
+        # The repository stays open, so the next command sees the same results.
+        r = cli_runner.invoke(args)
+        assert r.stdout == expected.stdout
+        assert len(calls) == 2
+
+        # Errors are reported with the same exit code and message.
+        r = cli_runner.invoke(["diff", "no-such-ref"])
+        assert r.exit_code != 0, r
+        assert len(calls) == 3
+        expected = cli_runner.invoke(["diff", "no-such-ref"], env={NO_SERVER_ENV: "1"})
+        assert (r.exit_code, r.stderr) == (expected.exit_code, expected.stderr)
+        assert len(calls) == 3
+
+        # Commands which aren't served, or are run with SNO_NO_SERVER set, are run as usual.
+        r = cli_runner.invoke(["show", "-o", "json"])
+        assert r.exit_code == 0, r
+        r = cli_runner.invoke(args, env={NO_SERVER_ENV: "1"})
+        assert r.exit_code == 0, r
+        assert len(calls) == 3
+
+
+def test_serve_already_running(data_archive, sno_server, cli_runner):
+    with data_archive("points2") as repo_dir:
+        sno_server(repo_dir)
+        r = cli_runner.invoke(["serve"])
+        assert r.exit_code == 20, r
+        assert "already running" in r.stderr
+
+
+def test_serve_output_chunks(data_archive, sno_server, cli_runner, monkeypatch):
+    with data_archive("points2") as repo_dir:
+        args = ["diff", "HEAD^...HEAD", "-o", "json"]
+        expected = cli_runner.invoke(args)
+        assert expected.exit_code == 0, expected
+
+        # Output is sent to the client as it's written, rather than all at once when the command finishes.
+        monkeypatch.setattr("sno.serve.OUTPUT_CHUNK_SIZE", 100)
+        server = sno_server(repo_dir)
+        frames = []
+        orig_run_command = server.run_command
+
+        def _run_command(args, cwd, response, **kwargs):
+            orig_write_frame = response.write_frame
+
+            def _write_frame(frame_type, data):
+                frames.append((frame_type, len(data)))
+                orig_write_frame(frame_type, data)
+
+            response.write_frame = _write_frame
+            return orig_run_command(args, cwd, response, **kwargs)
+
+        server.run_command = _run_command
+
+        r = cli_runner.invoke(args)
+        assert r.exit_code == 0, r
+        assert r.stdout == expected.stdout
+        assert len(frames) > len(expected.stdout) // 100
+        assert all(size <= 100 for frame_type, size in frames)
+
+
+def test_serve_commit(data_working_copy, sno_server, cli_runner):
+    with data_working_copy("points") as (repo_dir, wc):
+        sno_server(repo_dir)
+        # The client's environment and input are used by the server.
+        r = cli_runner.invoke(
+            ["commit", "--allow-empty", "-m", "-"],
+            input="Message from stdin",
+            env={
+                "GIT_AUTHOR_NAME": "Served Author",
+                "GIT_AUTHOR_EMAIL": "served@example.com",
+            },
+        )
+        assert r.exit_code == 0, r.stderr
+        commit = pygit2.Repository(str(repo_dir)).head.peel(pygit2.Commit)
+        assert commit.message == "Message from stdin"
+        assert (commit.author.name, commit.author.email) == (
+            "Served Author",
+            "served@example.com",
+        )
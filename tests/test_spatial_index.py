@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pygit2
+import pytest
+
+from sno.spatial_index import get_spatial_index, SPATIAL_INDEX_DIR
+from sno.structure import DatasetStructure, RepositoryStructure
+
+
+H = pytest.helpers.helpers()
+
+
+def _delete_features(repo, dataset, pks):
+    """Returns a copy of dataset without the given features, without committing it."""
+    index = pygit2.Index()
+    index.read_tree(dataset.tree)
+    for pk in pks:
+        index.remove(dataset.encode_1pk_to_path(pk, relative=True))
+    tree = repo[index.write_tree(repo)]
+    return DatasetStructure.instantiate(tree, dataset.path, dataset.version)
+
+
+def _all_pks(index):
+    with index:
+        return set(index.intersection(index.bounds()))
+
+
+@pytest.mark.parametrize(
+    "archive",
+    [pytest.param("points", id="points"), pytest.param("points2", id="points2")],
+)
+def test_spatial_index_updated_incrementally(archive, data_archive):
+    with data_archive(archive) as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        dataset = RepositoryStructure.lookup(repo, "HEAD")[H.POINTS.LAYER]
+        index_dir = Path(repo.path) / SPATIAL_INDEX_DIR
+
+        all_pks = _all_pks(get_spatial_index(repo, dataset))
+        assert len(all_pks) == H.POINTS.ROWCOUNT
+
+        deleted_pks = [1, 2, 147]
+        edited_dataset = _delete_features(repo, dataset, deleted_pks)
+        index = get_spatial_index(repo, edited_dataset)
+        assert len(list(index_dir.glob("*.db"))) == 2
+        assert _all_pks(index) == all_pks - set(deleted_pks)
+        with index:
+            assert index.nearest((177, 177, -38, -38), 1) != [147]
+            updated_nearest = index.nearest((177, 177, -38, -38), 4)
+
+        # An index built from scratch gives the same results.
+        for p in index_dir.glob("*.db"):
+            p.unlink()
+        index = get_spatial_index(repo, edited_dataset)
+        assert _all_pks(index) == all_pks - set(deleted_pks)
+        with index:
+            assert index.nearest((177, 177, -38, -38), 4) == updated_nearest
@@ -321,3 +321,28 @@ def test_status_merging(create_conflicts, cli_runner):
                 "conflicts": {"nz_pa_points_topo_150k": {"feature": 4}},
             }
         }
+
+
+def test_status_exact(data_working_copy, geopackage, cli_runner, edit_points):
+    with data_working_copy("points2") as (repo_dir, wc_path):
+        db = geopackage(wc_path)
+        with db:
+            edit_points(db.cursor())
+            # Changed, and then changed back.
+            db.cursor().execute(
+                f"UPDATE {H.POINTS.LAYER} SET t50_fid=t50_fid+1 WHERE fid=4;"
+            )
+            db.cursor().execute(
+                f"UPDATE {H.POINTS.LAYER} SET t50_fid=t50_fid-1 WHERE fid=4;"
+            )
+
+        def feature_changes(*args):
+            r = cli_runner.invoke(["status", "-o", "json", *args])
+            assert r.exit_code == 0, r
+            changes = json.loads(r.stdout)["sno.status/v1"]["workingCopy"]["changes"]
+            return changes[H.POINTS.LAYER]["feature"]
+
+        # Changed rows are counted without comparing them to the repository - so the row which was changed back
+        # is counted as an update, and the feature whose primary key changed is counted as a delete and an insert.
+        assert feature_changes() == {"inserts": 2, "updates": 2, "deletes": 6}
+        assert feature_changes("--exact") == {"inserts": 1, "updates": 2, "deletes": 5}
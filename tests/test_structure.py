@@ -10,11 +10,12 @@ import psycopg2
 import pygit2
 import pytest
 
-from sno import gpkg, structure, fast_import
+from sno import gpkg, git_util, structure, fast_import
+from sno.diff_structs import Delta, DeltaDiff, RepoDiff
 from sno.ogr_import_source import OgrImportSource, PostgreSQLImportSource
 from sno.dataset1 import Dataset1
 from sno.dataset2 import Dataset2
-from sno.exceptions import INVALID_OPERATION
+from sno.exceptions import INVALID_OPERATION, InvalidOperation
 from sno.geometry import ogr_to_gpkg_geom, gpkg_geom_to_ogr
 from sno.repository_version import REPO_VERSIONS_CHOICE
 
@@ -905,3 +906,106 @@ def test_fast_import(repo_version, data_archive, tmp_path, cli_runner, chdir):
             # has the right number of features
             feature_count = sum(1 for f in dataset.features())
             assert feature_count == source.feature_count
+
+
+@pytest.mark.parametrize("archive", ["points", "points2"])
+def test_features_batched(archive, data_archive_readonly):
+    with data_archive_readonly(archive) as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        dataset = structure.RepositoryStructure(repo)[H.POINTS.LAYER]
+
+        col_names = ["fid", "name", "geom", "t50_fid"]
+        expected = sorted(
+            tuple(feature[c] for c in col_names) for _, feature in dataset.features()
+        )
+
+        batches = list(dataset.features_batched(col_names, batch_size=1000))
+        assert [len(b) for b in batches] == [1000, 1000, 143]
+        assert sorted(row for b in batches for row in b.rows) == expected
+
+        # Reading with multiple threads gives the same features, in any order.
+        threaded_batches = list(
+            dataset.features_batched(col_names, batch_size=1000, num_threads=4)
+        )
+        assert sorted(row for b in threaded_batches for row in b.rows) == expected
+
+        columns = batches[0].columns
+        assert list(columns.keys()) == col_names
+        assert all(len(values) == 1000 for values in columns.values())
+        assert batches[0].column("fid") == tuple(row[0] for row in batches[0].rows)
+
+
+@pytest.mark.parametrize("archive", ["table", "table2"])
+def test_write_to_new_tree(archive, data_archive_readonly):
+    with data_archive_readonly(archive) as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        rs = structure.RepositoryStructure(repo)
+        dataset = rs[H.TABLE.LAYER]
+        pk = H.TABLE.LAYER_PK
+
+        old_feature = dataset.get_feature(1)
+        new_feature = {**old_feature, "NAME": "Updated"}
+        inserted_feature = {**old_feature, pk: 9999}
+        # Keys are strings, as they are when applying a patch.
+        feature_diff = DeltaDiff(
+            [
+                Delta.update(("1", old_feature), ("1", new_feature)),
+                Delta.delete(("2", dataset.get_feature(2))),
+                Delta.insert(("9999", inserted_feature)),
+            ]
+        )
+        repo_diff = RepoDiff()
+        repo_diff.recursive_set([dataset.path, "feature"], feature_diff)
+        new_tree = repo[rs.create_tree_from_diff(repo_diff)]
+
+        new_dataset = structure.RepositoryStructure.lookup(repo, new_tree.id)[
+            H.TABLE.LAYER
+        ]
+        assert new_dataset.get_feature(1) == new_feature
+        assert new_dataset.get_feature(9999) == inserted_feature
+        with pytest.raises(KeyError):
+            new_dataset.get_feature(2)
+        assert new_dataset.feature_count() == H.TABLE.ROWCOUNT
+
+        # Updating a feature that has already changed is a conflict.
+        changed_diff = DeltaDiff(
+            [Delta.update(("1", {**old_feature, "NAME": "Other"}), ("1", new_feature))]
+        )
+        repo_diff = RepoDiff()
+        repo_diff.recursive_set([dataset.path, "feature"], changed_diff)
+        with pytest.raises(InvalidOperation):
+            rs.create_tree_from_diff(repo_diff)
+
+
+def test_build_tree(data_archive_readonly):
+    with data_archive_readonly("points2") as repo_path:
+        repo = pygit2.Repository(str(repo_path))
+        root_tree = repo.head.peel(pygit2.Tree)
+        blob_id = repo.create_blob(b"new")
+        feature_dir = f"{H.POINTS.LAYER}/.sno-dataset/feature"
+        existing_path = next(
+            f"{feature_dir}/{d1.name}/{d2.name}/{leaf.name}"
+            for d1 in root_tree / feature_dir
+            for d2 in d1
+            for leaf in d2
+        )
+
+        new_tree = repo[
+            git_util.build_tree(
+                repo,
+                root_tree,
+                {
+                    existing_path: None,
+                    f"{feature_dir}/zz/zz/new": blob_id,
+                    "new-dir/new": blob_id,
+                },
+            )
+        ]
+        get_blob_id = git_util.blob_id_getter(new_tree)
+        assert get_blob_id(existing_path) is None
+        assert get_blob_id(f"{feature_dir}/zz/zz/new") == blob_id
+        assert get_blob_id("new-dir/new") == blob_id
+        assert (new_tree / f"{H.POINTS.LAYER}/.sno-dataset/meta").id == (
+            root_tree / f"{H.POINTS.LAYER}/.sno-dataset/meta"
+        ).id
+        assert git_util.build_tree(repo, root_tree, {}) == root_tree.id
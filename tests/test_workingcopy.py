@@ -9,9 +9,10 @@ import apsw
 import pygit2
 
 import sno.checkout
+import sno.working_copy
 from sno.exceptions import INVALID_ARGUMENT, INVALID_OPERATION
 from sno.structure import RepositoryStructure
-from sno.working_copy import WorkingCopy
+from sno.working_copy import WorkingCopy, WorkingCopy_GPKG_2
 
 
 H = pytest.helpers.helpers()
@@ -479,7 +480,7 @@ def test_switch_with_meta_items(data_working_copy, geopackage, cli_runner):
 
 
 def test_switch_with_trivial_schema_change(data_working_copy, geopackage, cli_runner):
-    # Column renames are one of the only schema changes we can do without having to recreate the whole table.
+    # Column renames are done using ALTER TABLE, without having to recreate the whole table.
     with data_working_copy("points2") as (repo, wc):
         db = geopackage(wc)
         cur = db.cursor()
@@ -542,6 +543,112 @@ def test_switch_with_schema_change(data_working_copy, geopackage, cli_runner):
         ]
 
 
+def test_switch_with_schema_change_in_place(
+    data_working_copy, geopackage, cli_runner, monkeypatch
+):
+    def _write_full(*args, **kwargs):
+        raise AssertionError("Table shouldn't be rewritten")
+
+    with data_working_copy("polygons2") as (repo, wc):
+        db = geopackage(wc)
+        cur = db.cursor()
+        # Drop survey_reference, widen adjusted_nodes, and add a column in the middle.
+        cur.execute(
+            f"""
+            CREATE TABLE tmp (
+                "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+                "geom" MULTIPOLYGON,
+                "colour" TEXT,
+                "date_adjusted" DATETIME,
+                "adjusted_nodes" INTEGER
+            );
+            INSERT INTO tmp (id, geom, date_adjusted, adjusted_nodes)
+                SELECT id, geom, date_adjusted, adjusted_nodes FROM {H.POLYGONS.LAYER};
+            DROP TABLE {H.POLYGONS.LAYER};
+            ALTER TABLE tmp RENAME TO {H.POLYGONS.LAYER};
+            """
+        )
+        r = cli_runner.invoke(['commit', '-m', 'change schema'])
+        assert r.exit_code == 0, r.stderr
+
+        H.clear_working_copy()
+        r = cli_runner.invoke(['checkout', 'HEAD^'])
+        assert r.exit_code == 0, r.stderr
+        db = geopackage(wc)
+        cur = db.cursor()
+
+        monkeypatch.setattr(WorkingCopy_GPKG_2, "write_full", _write_full)
+        r = cli_runner.invoke(['checkout', 'master'])
+        assert r.exit_code == 0, r.stderr
+        cur.execute(
+            f"""SELECT name, type FROM pragma_table_info('{H.POLYGONS.LAYER}');"""
+        )
+        assert cur.fetchall() == [
+            ('id', 'INTEGER'),
+            ('geom', 'MULTIPOLYGON'),
+            ('colour', 'TEXT'),
+            ('date_adjusted', 'DATETIME'),
+            ('adjusted_nodes', 'INTEGER'),
+        ]
+        assert H.row_count(db, H.POLYGONS.LAYER) == H.POLYGONS.ROWCOUNT
+
+        r = cli_runner.invoke(['diff', '--exit-code'])
+        assert r.exit_code == 0, r.stdout
+
+        # Edits are still tracked.
+        cur.execute(f"UPDATE {H.POLYGONS.LAYER} SET colour='red' WHERE id=1424927;")
+        r = cli_runner.invoke(['diff', '--exit-code', '-o', 'json'])
+        assert r.exit_code == 1, r
+        diff = json.loads(r.stdout)["sno.diff/v1+hexwkb"][H.POLYGONS.LAYER]
+        assert len(diff["feature"]) == 1
+
+        # Putting survey_reference back needs its values from the features, so the table is rewritten.
+        monkeypatch.undo()
+        r = cli_runner.invoke(['checkout', 'HEAD^', '--discard-changes'])
+        assert r.exit_code == 0, r.stderr
+        cur.execute(
+            f"""SELECT name, type FROM pragma_table_info('{H.POLYGONS.LAYER}');"""
+        )
+        assert cur.fetchall() == [
+            ('id', 'INTEGER'),
+            ('geom', 'MULTIPOLYGON'),
+            ('date_adjusted', 'DATETIME'),
+            ('survey_reference', 'TEXT(50)'),
+            ('adjusted_nodes', 'MEDIUMINT'),
+        ]
+        cur.execute(
+            f"SELECT COUNT(*) FROM {H.POLYGONS.LAYER} WHERE survey_reference IS NOT NULL;"
+        )
+        assert cur.fetchone()[0] > 0
+
+
+def test_switch_with_column_added_in_place(
+    data_working_copy, geopackage, cli_runner, monkeypatch
+):
+    def _write_full(*args, **kwargs):
+        raise AssertionError("Table shouldn't be rewritten")
+
+    with data_working_copy("polygons2") as (repo, wc):
+        db = geopackage(wc)
+        cur = db.cursor()
+        cur.execute(f"ALTER TABLE {H.POLYGONS.LAYER} ADD COLUMN colour TEXT;")
+        r = cli_runner.invoke(['commit', '-m', 'add colour'])
+        assert r.exit_code == 0, r.stderr
+
+        monkeypatch.setattr(WorkingCopy_GPKG_2, "write_full", _write_full)
+        r = cli_runner.invoke(['checkout', 'HEAD^'])
+        assert r.exit_code == 0, r.stderr
+        r = cli_runner.invoke(['checkout', 'master'])
+        assert r.exit_code == 0, r.stderr
+
+        cur.execute(f"""SELECT name FROM pragma_table_info('{H.POLYGONS.LAYER}');""")
+        assert [row[0] for row in cur.fetchall()][-1] == 'colour'
+        assert H.row_count(db, H.POLYGONS.LAYER) == H.POLYGONS.ROWCOUNT
+
+        r = cli_runner.invoke(['diff', '--exit-code'])
+        assert r.exit_code == 0, r.stdout
+
+
 @pytest.mark.parametrize("repo_version", [1, 2])
 def test_switch_pre_import_post_import(
     repo_version, data_working_copy, data_archive_readonly, geopackage, cli_runner
@@ -690,6 +797,86 @@ def test_create_workingcopy(data_working_copy, cli_runner, tmp_path):
         assert repo.config["sno.workingcopy.path"] == str(new_path)
 
 
+def test_create_workingcopy_wal(data_working_copy, cli_runner):
+    with data_working_copy("points2") as (repo_path, wc):
+        repo = pygit2.Repository(str(repo_path))
+
+        r = cli_runner.invoke(["create-workingcopy", "--wal"])
+        assert r.exit_code == 0, r
+        assert repo.config.get_bool("sno.workingcopy.wal")
+
+        # Another program reads the working copy while sno rewrites it.
+        reader = apsw.Connection(str(wc))
+        reader_cur = reader.cursor()
+        assert reader_cur.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+        reader_cur.execute("BEGIN;")
+        sql = f"SELECT name FROM {H.POINTS.LAYER} WHERE fid=1166;"
+        assert reader_cur.execute(sql).fetchone()[0] == "Oturu"
+
+        r = cli_runner.invoke(["checkout", "HEAD^"])
+        assert r.exit_code == 0, r
+
+        # The reader still sees the working copy as it was when it started reading.
+        assert reader_cur.execute(sql).fetchone()[0] == "Oturu"
+        reader_cur.execute("COMMIT;")
+        assert reader_cur.execute(sql).fetchone()[0] is None
+        reader.close()
+
+        r = cli_runner.invoke(["create-workingcopy", "--no-wal"])
+        assert r.exit_code == 0, r
+        assert not repo.config.get_bool("sno.workingcopy.wal")
+
+
+def test_reset_rebuilds_spatial_index(
+    data_working_copy, geopackage, cli_runner, monkeypatch
+):
+    # Rebuild the spatial index after every reset, however few features change.
+    monkeypatch.setattr(sno.working_copy, "SPATIAL_INDEX_REBUILD_MIN_CHANGES", 0)
+    monkeypatch.setattr(sno.working_copy, "SPATIAL_INDEX_REBUILD_MIN_RATIO", 0)
+    rebuilt = []
+    orig_rebuild = WorkingCopy_GPKG_2._rebuild_spatial_index
+
+    def _rebuild_spatial_index(self, dbcur, dataset, rtree):
+        rebuilt.append(rtree)
+        return orig_rebuild(self, dbcur, dataset, rtree)
+
+    monkeypatch.setattr(
+        WorkingCopy_GPKG_2, "_rebuild_spatial_index", _rebuild_spatial_index
+    )
+
+    with data_working_copy("points2") as (repo_dir, wc):
+        layer = H.POINTS.LAYER
+        rtree = f"rtree_{layer}_geom"
+        db = geopackage(wc)
+        dbcur = db.cursor()
+        dbcur.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE ?;",
+            [f"{rtree}%"],
+        )
+        trigger_count = dbcur.fetchone()[0]
+        assert trigger_count > 0
+
+        r = cli_runner.invoke(["checkout", "HEAD^"])
+        assert r.exit_code == 0, r
+        assert rebuilt == [rtree]
+
+        # The triggers are back, and the index matches the table.
+        dbcur.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE ?;",
+            [f"{rtree}%"],
+        )
+        assert dbcur.fetchone()[0] == trigger_count
+        dbcur.execute(
+            f"""
+            SELECT COUNT(*) FROM {layer} T LEFT OUTER JOIN "{rtree}" R ON (T.fid = R.id)
+            WHERE R.id IS NULL OR R.minx > ST_MinX(T.geom) OR R.maxx < ST_MaxX(T.geom)
+                OR R.miny > ST_MinY(T.geom) OR R.maxy < ST_MaxY(T.geom);
+            """
+        )
+        assert dbcur.fetchone()[0] == 0
+        assert H.row_count(db, rtree) == H.POINTS.ROWCOUNT
+
+
 @pytest.mark.parametrize(
     "source",
     [pytest.param([], id="head"), pytest.param(["-s", H.POINTS.HEAD_SHA], id="prev"),],
@@ -890,3 +1077,71 @@ def test_reset(data_working_copy, cli_runner, geopackage, edit_polygons):
         assert changes is None
         r = cli_runner.invoke(["diff", "--exit-code"])
         assert r.exit_code == 0, r
+
+
+@pytest.mark.parametrize("archive", ["points", "points2"])
+def test_diff_db_to_tree_compare_blob_ids(
+    archive, data_working_copy, geopackage, edit_points
+):
+    with data_working_copy(archive) as (repo_path, wc_path):
+        db = geopackage(wc_path)
+        with db:
+            cur = db.cursor()
+            edit_points(cur)
+            # Changed and then changed back - not a change.
+            (name,) = cur.execute(
+                f"SELECT name FROM {H.POINTS.LAYER} WHERE fid=4;"
+            ).fetchone()
+            cur.execute(f"UPDATE {H.POINTS.LAYER} SET name='test' WHERE fid=4;")
+            cur.execute(f"UPDATE {H.POINTS.LAYER} SET name=? WHERE fid=4;", (name,))
+
+        repo = pygit2.Repository(str(repo_path))
+        wc = WorkingCopy.get(repo)
+        dataset = RepositoryStructure(repo)[H.POINTS.LAYER]
+
+        by_value = {
+            d.key: d
+            for d in wc.iter_feature_deltas_db_to_tree(
+                dataset, find_renames=False, compare_blob_ids=False
+            )
+        }
+        by_blob_id = {
+            d.key: d
+            for d in wc.iter_feature_deltas_db_to_tree(
+                dataset, find_renames=False, compare_blob_ids=True
+            )
+        }
+        assert 4 not in by_blob_id
+        assert sorted(by_blob_id) == sorted(by_value)
+        for key, delta in by_value.items():
+            assert by_blob_id[key].type == delta.type
+            assert by_blob_id[key].old_value == delta.old_value
+            assert by_blob_id[key].new_value == delta.new_value
+
+
+def test_diff_db_to_tree_compare_blob_ids_older_legend(
+    data_working_copy, geopackage, cli_runner
+):
+    with data_working_copy("points2") as (repo_path, wc_path):
+        db = geopackage(wc_path)
+        cur = db.cursor()
+        cur.execute(f"ALTER TABLE {H.POINTS.LAYER} ADD COLUMN colour TEXT;")
+        r = cli_runner.invoke(["commit", "-m", "change schema"])
+        assert r.exit_code == 0, r.stderr
+
+        # The existing features are still encoded using the older legend, so their blob IDs
+        # differ from those of the working copy rows - but feature 1 hasn't actually changed.
+        cur.execute(f"UPDATE {H.POINTS.LAYER} SET name=name WHERE fid=1;")
+        cur.execute(f"UPDATE {H.POINTS.LAYER} SET colour='red' WHERE fid=2;")
+
+        repo = pygit2.Repository(str(repo_path))
+        wc = WorkingCopy.get(repo)
+        dataset = RepositoryStructure(repo)[H.POINTS.LAYER]
+        deltas = list(
+            wc.iter_feature_deltas_db_to_tree(
+                dataset, find_renames=False, compare_blob_ids=True
+            )
+        )
+        assert [(d.type, d.key) for d in deltas] == [("update", 2)]
+        assert deltas[0].old_value["colour"] is None
+        assert deltas[0].new_value["colour"] == "red"